@@ -0,0 +1,406 @@
+import os
+import sys
+import pickle
+import marshal
+import hashlib
+import tempfile
+import numpy as np
+import autodiffpy
+from autodiffpy import autodiffmod as autodiff
+from autodiffpy import autodiff_graph as adgraph
+
+
+
+#Source templates of the forward kernels of autodiff_graph: {0} and {1} are the parents, other fields are params
+_FWD = {
+    'neg': '-{0}',
+    'add': '{0} + {1}',
+    'sub': '{0} - {1}',
+    'mul': '{0}*{1}',
+    'dot': 'np.matmul({0}, {1}.T)',
+    'truediv': '{0}/{1}',
+    'rtruediv': '{1}/{0}',
+    'pow': '{0}**{1}',
+    'rpow': '{1}**{0}',
+    'log': 'np.log({0})/np.log({base})',
+    'logistic': '{A}/1.0/(1.0 + np.exp(-1.0*{k}*({0} - {x0})))',
+}
+for _op in ('sqrt', 'sin', 'cos', 'tan', 'exp', 'arcsin', 'arccos', 'arctan', 'sinh', 'cosh', 'tanh'):
+    _FWD[_op] = 'np.' + _op + '({0})'
+
+#Source templates of the backward kernels, one per parent: {g} is the adjoint of the node and {out} its value
+_VJP = {
+    'neg': ['-{g}'],
+    'add': ['{g}', '{g}'],
+    'sub': ['{g}', '-{g}'],
+    'mul': ['{g}*{1}', '{g}*{0}'],
+    'dot': ['np.matmul({g}, {1})', 'np.matmul(np.atleast_2d({g}).T, np.atleast_2d({0}))'],
+    'truediv': ['{g}/{1}', '-{g}*{out}/{1}'],
+    'rtruediv': ['-{g}*{out}/{0}', '{g}/{0}'],
+    'pow': ['{g}*{1}*{0}**({1} - 1)', '{g}*{out}*np.log({0})'],
+    'rpow': ['{g}*{out}*np.log({1})', '{g}*{0}*{1}**({0} - 1)'],
+    'sqrt': ['{g}/(2*{out})'],
+    'sin': ['{g}*np.cos({0})'],
+    'cos': ['-{g}*np.sin({0})'],
+    'tan': ['{g}/np.cos({0})**2'],
+    'log': ['{g}/({0}*np.log({base}))'],
+    'exp': ['{g}*{out}'],
+    'arcsin': ['{g}/np.sqrt(1 - {0}**2)'],
+    'arccos': ['-{g}/np.sqrt(1 - {0}**2)'],
+    'arctan': ['{g}/(1 + {0}**2)'],
+    'sinh': ['{g}*np.cosh({0})'],
+    'cosh': ['{g}*np.sinh({0})'],
+    'tanh': ['{g}/np.cosh({0})**2'],
+    'logistic': ['{g}*{A}*{k}*np.exp(-1.0*{k}*({0} - {x0}))/((np.exp(-1.0*{k}*({0} - {x0})) + 1.0)**2)'],
+}
+
+_DEFAULTS = {'log': {'base': np.e}, 'logistic': {'A': 1.0, 'k': 1.0, 'x0': 0.0}}
+
+#Compiled source and code objects by graph hash and wrt
+_CACHE = {}
+
+#Constants and seeds of more elements than this are bound into the namespace of the generated code, not written into it
+_INLINE = 16
+
+
+def _literal(value):
+    """Returns Python source that evaluates to value."""
+    if isinstance(value, (bool, int, float)) and np.isfinite(value):
+        return repr(value)
+    arr = np.asarray(value)
+    if arr.dtype.kind in 'biuf' and np.all(np.isfinite(arr)):
+        return f"np.array({arr.tolist()!r}, dtype='{arr.dtype.str}')"
+    return f"np.frombuffer(bytes.fromhex('{arr.tobytes().hex()}'), dtype='{arr.dtype.str}').reshape({arr.shape!r})"
+
+
+def _params(op, params):
+    """Returns the params of an op, with defaults filled in, as source literals."""
+    params = dict(_DEFAULTS.get(op, {}), **params)
+    return {key:_literal(float(value) if np.ndim(value) == 0 else value) for key, value in params.items()}
+
+
+def _variables(g):
+    """Returns the source name of the value of every node: l<idx> for leaves (idx of the first leaf of the name),
+    c<idx> for constants and v<idx> for operations. Leaf names are never used, so they cannot shadow the
+    generated functions, their locals or builtins."""
+    variables = []
+    for idx, (op, args, params) in enumerate(g.ops):
+        name = g.names[idx]
+        if name is None:
+            variables.append(('c' if op == 'input' else 'v') + str(idx))
+        else:
+            variables.append('l' + str(g.leaves[name][0]))
+    return variables
+
+
+def _bound(g, wrt=None):
+    """Returns the constants and seeds of a graph that are too large to be written into its source, by source name:
+    c<idx> for constants and s<idx> for the seeds of the leaves in wrt."""
+    variables = _variables(g)
+    wrt = sorted(g.leaves) if wrt is None else wrt
+    bound = {}
+    for idx, (op, args, params) in enumerate(g.ops):
+        if op == 'input' and g.names[idx] is None and np.size(g.values[idx]) > _INLINE:
+            bound[variables[idx]] = g.values[idx]
+    for name in wrt:
+        for idx in g.leaves[name]:
+            if g.seeds[idx] is not None and np.size(g.seeds[idx]) > _INLINE:
+                bound['s' + str(idx)] = g.seeds[idx]
+    return bound
+
+
+def _namespace(code, bound):
+    """Runs compiled generated code in a new namespace holding the bound constants, and returns the namespace."""
+    functions = dict(bound)
+    exec(code, functions)
+    return functions
+
+
+def graph_hash(g):
+    """Returns a hex digest identifying the structure of a graph: its ops, leaf names and seeds, and constant values.
+
+    Graphs with the same hash generate the same source; the values of leaves do not enter the hash, nor do the
+    values of constants and seeds of more than _INLINE elements, which are bound rather than written into it
+    (only their shape and dtype do).
+    """
+    digest = hashlib.sha256()
+    for idx, (op, args, params) in enumerate(g.ops):
+        digest.update(repr((op, args, sorted(params.items()), g.names[idx])).encode())
+        if op == 'input':
+            value = g.values[idx] if g.names[idx] is None else g.seeds[idx]
+            if value is not None:
+                value = np.asarray(value)
+                digest.update(repr((value.dtype.str, value.shape)).encode())
+                if value.size <= _INLINE:
+                    digest.update(value.tobytes())
+    digest.update(repr(g.output).encode())
+    return digest.hexdigest()
+
+
+def generate(g, wrt=None):
+    """Returns Python source computing the value, gradient and Jacobian of a traced graph with plain NumPy code.
+
+    The source defines, with one argument l<idx> per leaf name in the order of the module-level list order:
+    value(*leaves) returning the output; forward(*leaves) returning the values of every node;
+    backward(seed, vals) returning the adjoints of the leaves in wrt, given vals from forward() and
+    the adjoint seed of the output; gradient(seed, *leaves) running both; and jacobian(*leaves)
+    returning the derivatives of the output along the seed of each leaf, stacked along a new leading
+    axis (one reverse sweep per output element). Constants and seeds of at most _INLINE elements are
+    written into the source; larger ones, such as data columns, are module-level names c<idx> and s<idx>
+    that are not defined in it, and must be bound into its namespace before the functions are called.
+
+    INPUTS
+    =======
+    g: graph instance returned by autodiff_graph.trace()
+    wrt: names of the leaves to differentiate with respect to (all leaves by default)
+
+    RETURNS
+    ========
+    string of Python source
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_graph as adgraph
+    >>> from autodiffpy import autodiff_codegen as adcodegen
+    >>> x = ad.autodiff('x', 2)
+    >>> source = adcodegen.generate(adgraph.trace(admath.sin(x)*x + 3))
+    >>> print(source[source.index('def value'):source.index('def forward')].strip())
+    def value(l0):
+        v1 = np.sin(l0)
+        v2 = v1*l0
+        v4 = v2 + c3
+        return v4
+    """
+    order = sorted(g.leaves)
+    wrt = order if wrt is None else list(wrt)
+    for name in wrt:
+        g._resolve(name)
+    variables = _variables(g)
+    arguments = ', '.join(variables[g.leaves[name][0]] for name in order)
+    wanted = [idx for name in wrt for idx in g.leaves[name]]
+    requires = g._requires(set(wanted))
+
+    lines = ['import numpy as np', 'from autodiffpy.autodiff_graph import _unbroadcast', '', '',
+             f'order = {order!r}', f'wrt = {wrt!r}']
+    bound = _bound(g, wrt)
+    if bound:
+        lines.append(f"bound = {sorted(bound)!r}")
+    for idx, (op, args, params) in enumerate(g.ops):
+        if op == 'input' and g.names[idx] is None and variables[idx] not in bound:
+            lines.append(f'{variables[idx]} = {_literal(g.values[idx])}')
+    for idx in wanted:
+        seed = 1.0 if g.seeds[idx] is None else g.seeds[idx]
+        if f's{idx}' not in bound:
+            lines.append(f's{idx} = {_literal(seed)}')
+
+    body = []
+    for idx, (op, args, params) in enumerate(g.ops):
+        if op != 'input':
+            body.append(f'    {variables[idx]} = ' + _FWD[op].format(*[variables[j] for j in args], **_params(op, params)))
+    every = ', '.join(variables) + ','
+
+    lines = lines + ['', '', f'def value({arguments}):'] + body + [f'    return {variables[g.output]}']
+    lines = lines + ['', '', f'def forward({arguments}):'] + body + [f'    return ({every})']
+
+    #Reverse sweep: every adjoint is written once, then accumulated, in the order the graph is walked backwards
+    reverse = [f'    {every} = vals', f'    a{g.output} = _unbroadcast(seed, np.shape({variables[g.output]}))']
+    written = set([g.output])
+    for idx in range(len(g.ops) - 1, -1, -1):
+        op, args, params = g.ops[idx]
+        if op == 'input' or not requires[idx] or idx not in written:
+            continue
+        fields = dict(_params(op, params), g=f'a{idx}', out=variables[idx])
+        for k, j in enumerate(args):
+            if not requires[j]:
+                continue
+            expr = _VJP[op][k].format(*[variables[i] for i in args], **fields)
+            if len(args) == 2:
+                expr = f'_unbroadcast({expr}, np.shape({variables[j]}))'
+            reverse.append(f'    a{j} = {expr}' if j not in written else f'    a{j} = a{j} + {expr}')
+            written.add(j)
+    for idx in wanted:
+        if idx not in written:
+            reverse.append(f'    a{idx} = np.zeros(np.shape({variables[idx]}))')
+    leaf_adjoints = ', '.join(f'a{idx}' for idx in wanted) + ','
+    sums = ', '.join(' + '.join(f'a{idx}' for idx in g.leaves[name]) for name in wrt) + ','
+
+    lines = lines + ['', '', 'def leaf_adjoints(seed, vals):'] + reverse + [f'    return ({leaf_adjoints})']
+    lines = lines + ['', '', 'def backward(seed, vals):'] + reverse + [f'    return ({sums})']
+    lines = lines + ['', '', f'def gradient(seed, {arguments}):', f'    return backward(seed, forward({arguments}))']
+    lines = lines + ['', '', f'def jacobian({arguments}):',
+                     f'    vals = forward({arguments})',
+                     f'    shape = np.shape(vals[{g.output}])',
+                     f'    rows = np.zeros(({len(wrt)}, int(np.prod(shape))))',
+                     f'    for i in range(rows.shape[1]):',
+                     f'        seed = np.zeros(rows.shape[1])',
+                     f'        seed[i] = 1.0',
+                     f'        ({leaf_adjoints}) = leaf_adjoints(seed.reshape(shape), vals)']
+    for p, name in enumerate(wrt):
+        total = ' + '.join(f'np.sum(a{idx}*s{idx})' for idx in g.leaves[name])
+        lines.append(f'        rows[{p}, i] = {total}')
+    lines = lines + [f'    return rows.reshape(({len(wrt)},) + shape)', '']
+    return '\n'.join(lines)
+
+
+
+class compiled():
+    """Generated code of a traced graph, compiled once and called with the graph's inputs.
+
+    Leaves missing from the values of a call take the values they were traced with. The generated
+    functions themselves are in compiled.functions, taking the leaves positionally in compiled.order.
+    compiled.key identifies the code in a cache directory (see compile_graph() and load()), and
+    compiled.constants holds the constants bound into the namespace of the functions.
+    """
+
+    def __init__(self, g, source, functions, key=None, constants=None):
+        self.graph = g
+        self.source = source
+        self.functions = functions
+        self.constants = constants or {}
+        self.order = functions['order']
+        self.wrt = functions['wrt']
+        self.key = key
+
+
+    def _arguments(self, values):
+        """Returns the leaf values for a call, in order, with the leaves in values overridden."""
+        values = dict(values or {})
+        for name, value in values.items():
+            self.graph._resolve(name)
+            if isinstance(value, list):
+                values[name] = np.asarray(value)
+        return [values[name] if name in values else self.graph.values[self.graph.leaves[name][0]] for name in self.order]
+
+
+    def value(self, values=None):
+        """Returns the value of the output, with the leaves in the values dictionary overridden for this call."""
+        return self.functions['value'](*self._arguments(values))
+
+
+    def gradient(self, seed, values=None):
+        """Returns a dictionary mapping each leaf in wrt to its adjoint, given the adjoint seed of the output."""
+        return dict(zip(self.wrt, self.functions['gradient'](seed, *self._arguments(values))))
+
+
+    def backprop(self, y_true, loss='MSE', values=None):
+        """Same as autodiff_graph.graph.backprop(), with the generated code."""
+        vals = self.functions['forward'](*self._arguments(values))
+        loss_value, d_loss = autodiff._loss(vals[self.graph.output], y_true, loss)
+        return dict(zip(self.wrt, self.functions['backward'](d_loss, vals))), loss_value
+
+
+    def jacobian(self, values=None):
+        """Returns the Jacobian with respect to the leaves in wrt and its ordering, as autodiff.jacobian() does."""
+        return {"jacobian":self.functions['jacobian'](*self._arguments(values)), "order":list(self.wrt)}
+
+
+    def save(self, path):
+        """Writes the generated source to path, as a module that can be imported directly.
+
+        The bound constants are written at the end of the module, so it runs without the cache entry.
+        """
+        with open(path, 'w') as file:
+            file.write(self.source)
+            for name, value in sorted(self.constants.items()):
+                file.write(f'{name} = {_literal(value)}\n')
+
+
+
+def cache_key(g, wrt=None):
+    """Returns the name under which the compiled code of a graph is stored in a cache directory.
+
+    It combines the graph hash and wrt with the package version and the Python version, since the
+    generated source depends on the first and the stored bytecode on the second.
+    """
+    digest = hashlib.sha256(repr((graph_hash(g), None if wrt is None else list(wrt))).encode()).hexdigest()
+    return f"{digest[:32]}-{autodiffpy.__version__}-{sys.implementation.cache_tag}"
+
+
+def _write(path, data):
+    """Writes data to path atomically, so other processes never read a partly written file."""
+    handle, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def load(key, cache_dir):
+    """Returns the compiled instance stored under key in cache_dir, without tracing or generating anything.
+
+    INPUTS
+    =======
+    key: key of a compiled instance written by compile_graph(..., cache_dir=cache_dir)
+    cache_dir: path of the cache directory
+
+    RETURNS
+    ========
+    compiled instance, whose leaves default to the values of the graph that was stored
+    """
+    path = os.path.join(cache_dir, key + '.pkl')
+    try:
+        with open(path, 'rb') as file:
+            entry = pickle.load(file)
+    except FileNotFoundError:
+        raise KeyError(f"Error: no compiled graph '{key}' in {cache_dir}.")
+    if key not in _CACHE:
+        _CACHE[key] = (entry['source'], marshal.loads(entry['code']))
+    source, code = _CACHE[key]
+    constants = entry.get('constants', {})
+    return compiled(entry['graph'], source, _namespace(code, constants), key, constants)
+
+
+def compile_graph(f, wrt=None, cache_dir=None):
+    """Generates NumPy source for an autodiff expression or traced graph, compiles it and returns a compiled instance.
+
+    Compiled code is cached by graph hash, so graphs of the same structure are generated and compiled only once.
+    With cache_dir, it is also stored on disk, in a file named by compiled.key holding the traced graph, the source
+    and its bytecode, so other processes can call load() to get a ready-to-run instance without tracing the
+    expression, or compile_graph() to reuse the code of an expression with the same structure. Large constants
+    are stored in that file rather than in the source, so data columns neither bloat the generated code nor
+    change its key. The generated source is written next to it as <key>.py, for inspection.
+
+    INPUTS
+    =======
+    f: autodiff instance, or graph instance returned by autodiff_graph.trace()
+    wrt: names of the leaves to differentiate with respect to (all leaves by default)
+    cache_dir: path of a directory to store compiled code in and read it from
+
+    RETURNS
+    ========
+    compiled instance
+
+    EXAMPLES
+    =========
+    >>> import numpy as np
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_codegen as adcodegen
+    >>> x = ad.autodiff('x', [1.0, 2.0])
+    >>> y = ad.autodiff('y', [3.0, 4.0])
+    >>> c = adcodegen.compile_graph(admath.exp(x/4)*y)
+    >>> print(c.value({'x': [0.0, 0.0]}), c.gradient(np.ones(2))['y'])
+    [3. 4.] [1.28402542 1.64872127]
+    >>> print(c.jacobian()['order'], c.jacobian()['jacobian'][1])
+    ['x', 'y'] [1.28402542 1.64872127]
+    """
+    g = f if isinstance(f, adgraph.graph) else adgraph.trace(f)
+    key = cache_key(g, wrt)
+    path = None if cache_dir is None else os.path.join(cache_dir, key + '.pkl')
+    if key not in _CACHE and path is not None and os.path.exists(path):
+        load(key, cache_dir)
+    if key not in _CACHE:
+        source = generate(g, wrt)
+        _CACHE[key] = (source, compile(source, f'<autodiff graph {key}>', 'exec'))
+    source, code = _CACHE[key]
+    constants = _bound(g, wrt)
+    if path is not None and not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        _write(os.path.join(cache_dir, key + '.py'), source.encode())
+        _write(path, pickle.dumps({'graph':g, 'source':source, 'code':marshal.dumps(code), 'constants':constants}))
+    return compiled(g, source, _namespace(code, constants), key, constants)
@@ -0,0 +1,344 @@
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from autodiffpy import autodiffmod as autodiff
+from autodiffpy import autodiff_graph as adgraph
+
+
+
+def read_chunks(path, target='y', chunksize=100000):
+    """Yields consecutive chunks of a CSV file of samples, so that only one chunk is held in memory at a time.
+
+    INPUTS
+    =======
+    path: path of the CSV file, with one column per feature and one column of desired outputs
+    target: name of the column of desired outputs
+    chunksize: number of rows per chunk
+
+    RETURNS
+    ========
+    generator of (table, y) pairs: table is a DataFrame of the feature columns of the chunk, and y is an array of its desired outputs
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiff_data as addata
+    >>> chunks = addata.read_chunks('docs/demo.csv', chunksize=150)
+    >>> print([(list(table.columns), len(y)) for table, y in chunks])
+    [(['x1', 'x2', 'x3', 'x4', 'x5'], 150), (['x1', 'x2', 'x3', 'x4', 'x5'], 48)]
+    """
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        y = chunk[target].to_numpy(dtype=float)
+        yield chunk.drop(columns=[target]), y
+
+
+def _cache_paths(path, cache_dir):
+    """Returns the cache directory of a CSV file and the path of its manifest."""
+    if cache_dir is None:
+        cache_dir = path + '.cache'
+    return cache_dir, os.path.join(cache_dir, 'manifest.json')
+
+
+def _source_stamp(path):
+    """Returns what the cache records about its source file to detect later changes."""
+    stat = os.stat(path)
+    return {"source":os.path.abspath(path), "size":stat.st_size, "mtime_ns":stat.st_mtime_ns}
+
+
+def build_cache(path, cache_dir=None, chunksize=100000):
+    """Converts a CSV file once into a binary columnar cache: one float64 .npy file per column plus a manifest.
+
+    The file is parsed in chunks, so it never has to fit in memory. The manifest records the size and
+    modification time of the CSV file so that load_cache() can tell when the cache is stale.
+
+    INPUTS
+    =======
+    path: path of the CSV file
+    cache_dir: directory to write the cache to (path + '.cache' by default)
+    chunksize: number of rows parsed at a time
+
+    RETURNS
+    ========
+    the manifest dictionary, with the column names (under key 'columns'), their files (under key 'files') and the number of rows (under key 'rows')
+    """
+    cache_dir, manifest_path = _cache_paths(path, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    stamp = _source_stamp(path)
+    columns = None
+    raw = []
+    rows = 0
+    try:
+        # Append every chunk to one raw file per column, then prepend the .npy headers once the row count is known
+        for chunk in pd.read_csv(path, chunksize=chunksize):
+            if columns is None:
+                columns = list(chunk.columns)
+                raw = [open(os.path.join(cache_dir, f"col{i}.raw"), 'wb') for i in range(len(columns))]
+            for fh, column in zip(raw, columns):
+                fh.write(chunk[column].to_numpy(dtype='<f8').tobytes())
+            rows = rows + len(chunk)
+    finally:
+        for fh in raw:
+            fh.close()
+    if columns is None:
+        raise ValueError("Error: no data found in file.")
+
+    files = []
+    for i in range(len(columns)):
+        files.append(f"col{i}.npy")
+        raw_path = os.path.join(cache_dir, f"col{i}.raw")
+        with open(os.path.join(cache_dir, files[i]), 'wb') as out, open(raw_path, 'rb') as fh:
+            np.lib.format.write_array_header_1_0(out, {'descr':'<f8', 'fortran_order':False, 'shape':(rows,)})
+            shutil.copyfileobj(fh, out)
+        os.remove(raw_path)
+
+    # The manifest is written last, so a cache without one is always treated as incomplete
+    manifest = dict(stamp, columns=columns, files=files, rows=rows, dtype='float64')
+    with open(manifest_path, 'w') as fh:
+        json.dump(manifest, fh)
+    return manifest
+
+
+def is_stale(path, cache_dir=None):
+    """Returns True if the cache of a CSV file is missing, incomplete, or older than the file."""
+    cache_dir, manifest_path = _cache_paths(path, cache_dir)
+    try:
+        with open(manifest_path) as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return True
+    stamp = _source_stamp(path)
+    if any(manifest.get(key) != stamp[key] for key in stamp):
+        return True
+    return not all(os.path.exists(os.path.join(cache_dir, name)) for name in manifest['files'])
+
+
+def load_cache(path, cache_dir=None, chunksize=100000):
+    """Opens the columns of a CSV file as read-only memory maps, (re)building the binary cache first if it is stale.
+
+    INPUTS
+    =======
+    path: path of the CSV file
+    cache_dir: directory of the cache (path + '.cache' by default)
+    chunksize: number of rows parsed at a time if the cache has to be built
+
+    RETURNS
+    ========
+    dictionary mapping each column name, in file order, to a memory-mapped array of its values
+
+    EXAMPLES
+    =========
+    >>> import os, tempfile
+    >>> from autodiffpy import autodiff_data as addata
+    >>> cache_dir = os.path.join(tempfile.mkdtemp(), 'demo')
+    >>> columns = addata.load_cache('docs/demo.csv', cache_dir)
+    >>> print(list(columns), columns['y'].shape, addata.is_stale('docs/demo.csv', cache_dir))
+    ['x1', 'x2', 'x3', 'x4', 'x5', 'y'] (198,) False
+    """
+    if is_stale(path, cache_dir):
+        build_cache(path, cache_dir, chunksize)
+    cache_dir, manifest_path = _cache_paths(path, cache_dir)
+    with open(manifest_path) as fh:
+        manifest = json.load(fh)
+    return {column:np.load(os.path.join(cache_dir, name), mmap_mode='r') for column, name in zip(manifest['columns'], manifest['files'])}
+
+
+def cache_leaves(columns, names=None, differentiable=False):
+    """Builds autodiff leaves directly on memory-mapped columns, without copying them.
+
+    The leaves are data (der=None), so mini-batch gradient_descent() and data_parallel() slice them per sample.
+    With differentiable=True, they are variables instead, whose derivative seeds are broadcast views of a
+    single 1, so they take no memory either.
+
+    INPUTS
+    =======
+    columns: dictionary of column arrays, such as load_cache() returns
+    names: names of the columns to turn into leaves (all columns by default)
+    differentiable: whether derivatives are propagated for the leaves
+
+    RETURNS
+    ========
+    dictionary mapping each name to an autodiff instance whose value is the column itself
+
+    EXAMPLES
+    =========
+    >>> import numpy as np
+    >>> from autodiffpy import autodiff_data as addata
+    >>> columns = {'x1': np.arange(3.0)}
+    >>> x1 = addata.cache_leaves(columns)['x1']
+    >>> print(x1.val is columns['x1'], x1.der)
+    True {}
+    >>> print(addata.cache_leaves(columns, differentiable=True)['x1'].der['x1'])
+    [1. 1. 1.]
+    """
+    if names is None:
+        names = list(columns)
+    return {name:autodiff.autodiff(name, columns[name], np.broadcast_to(1.0, columns[name].shape) if differentiable else None)
+            for name in names}
+
+
+def cache_chunks(columns, target='y', chunksize=100000):
+    """Yields consecutive row slices of cached columns as (table, y) pairs, the same way read_chunks() does for a CSV file.
+
+    The slices are views of the memory maps, so no data is copied or parsed.
+    """
+    features = [column for column in columns if column != target]
+    num_rows = columns[target].shape[0]
+    for start in range(0, num_rows, chunksize):
+        stop = start + chunksize
+        yield {column:columns[column][start:stop] for column in features}, columns[target][start:stop]
+
+
+def _data_columns(g, table):
+    """Finds the per-sample inputs of a traced model (the inputs with one row per output value of the model) and the
+    columns of the data each one holds, given the first chunk.
+
+    Leaves named after a column hold that column. Other inputs hold the columns their values (each of their
+    columns, for 2-D inputs) are equal to on the first rows of the chunk, so they must have been built on the first
+    rows of the data, on enough rows to tell the columns apart. Returns a dictionary mapping each input index to a
+    column name (1-D inputs) or a list of column names (2-D inputs).
+    """
+    features = list(table.keys())
+    num_rows = np.shape(g.evaluate())[0]
+    data = g.sample_inputs(num_rows, include=features)
+    if not data:
+        raise ValueError("Error: could not find data with one row per output value of the function.")
+    first = {column:np.asarray(table[column], dtype=float)[:num_rows] for column in features}
+    columns = {}
+    for idx in data:
+        value = np.asarray(g.values[idx], dtype=float)
+        if g.names[idx] in features:
+            columns[idx] = g.names[idx]
+            continue
+        matches = []
+        for vector in (value.T if value.ndim == 2 else [value]):
+            match = [column for column in features if np.array_equal(first[column], vector[:len(first[column])])]
+            if not match:
+                raise ValueError("Error: could not match a per-sample input of the function to columns of the data; build it on the first rows of the data.")
+            if len(match) > 1:
+                raise ValueError(f"Error: a per-sample input of the function matches several columns of the data ({', '.join(match)}); build it on more rows of the data.")
+            matches.append(match[0])
+        columns[idx] = matches if value.ndim == 2 else matches[0]
+    return columns
+
+
+def _chunk_values(columns, table):
+    """Binds the per-sample inputs of a traced model to a chunk, given the columns each one holds (see _data_columns())."""
+    values = {}
+    for idx, names in columns.items():
+        if isinstance(names, list):
+            values[idx] = np.column_stack([np.asarray(table[column], dtype=float) for column in names])
+        else:
+            values[idx] = np.asarray(table[names], dtype=float)
+    return values
+
+
+def chunked_backprop(f, chunks, loss='MSE', wrt=None):
+    """Returns the loss of f over a stream of data chunks and its gradient, accumulated one chunk at a time.
+
+    f is traced once; for every chunk its per-sample inputs (the inputs with one row per output value of f)
+    are rebound to the chunk and the traced function is evaluated and differentiated on that chunk only.
+    The result equals backprop() on all the data at once, but memory use is bounded by the chunk size.
+    Each per-sample input is rebound to the columns it holds: leaves named after a column to that column,
+    and other inputs to the columns they equal on the first rows of the data, in their own order.
+
+    INPUTS
+    =======
+    f: autodiff instance (or traced graph) built on a small sample of the data, e.g. the first rows of the file
+    chunks: iterable of (table, y) pairs such as read_chunks() yields
+    loss: string name of the desired loss function; allowed types are ['MSE', 'MAE', 'RMSE']
+    wrt: names of the leaves to differentiate with respect to (['w'] by default)
+
+    RETURNS
+    ========
+    tuple of a dictionary mapping each leaf name in wrt to its gradient, and the loss value
+
+    EXAMPLES
+    =========
+    >>> import numpy as np
+    >>> import pandas as pd
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_data as addata
+    >>> data = pd.read_csv('docs/demo.csv')
+    >>> w = ad.autodiff('w', [1, 1, 1, 1, 1])
+    >>> f_sample = w*data.drop(columns=['y'])[:10]
+    >>> grads, loss_value = addata.chunked_backprop(f_sample, addata.read_chunks('docs/demo.csv', chunksize=64))
+    >>> delta, loss_full = (w*data.drop(columns=['y'])).backprop(data['y'])
+    >>> print(np.allclose(grads['w'], [np.sum(value) for value in delta['w']]), np.isclose(loss_value, loss_full))
+    True True
+    """
+    if wrt is None:
+        wrt = ['w']
+    g = f if isinstance(f, adgraph.graph) else adgraph.trace(f)
+
+    columns = None
+    num_samples = 0
+    total = 0.0
+    grads = {name:0.0 for name in wrt}
+    for table, y in chunks:
+        if columns is None:
+            columns = _data_columns(g, table)
+        vals = g.forward(_chunk_values(columns, table))
+        chunk_total, seed = autodiff._loss_sums(vals[g.output], y, loss)
+        chunk_grads = g.backward(vals, seed, wrt)
+        for name in wrt:
+            grads[name] = grads[name] + chunk_grads[name]
+        total = total + chunk_total
+        num_samples = num_samples + len(y)
+
+    if num_samples == 0:
+        raise ValueError("Error: no data found in chunks.")
+    return autodiff._finish_loss(total, grads, num_samples, loss)
+
+
+def chunked_gradient_descent(f, path, target='y', loss='MSE', beta=0.01, max_iter=1000, tol=10**(-8), chunksize=100000):
+    """Runs full-batch gradient descent on a CSV file that is streamed in chunks on every iteration, so it never has to fit in memory.
+
+    INPUTS
+    =======
+    f: autodiff instance with weights named 'w', built on a small sample of the data, e.g. the first rows of the file
+    path: path of the CSV file, with one column per feature and one column of desired outputs
+    target: name of the column of desired outputs
+    loss: string name of the desired loss function; allowed types are ['MSE', 'MAE', 'RMSE']
+    beta: learning rate (constant)
+    max_iter: maximum allowed number of iterations
+    tol: minimum desired loss for the function
+    chunksize: number of rows read per chunk
+
+    RETURNS
+    ========
+    dictionary containing the following keys and values:
+       'f': the function autodiff instance on the sample data, at the final weights
+       'w': the final weights
+       'loss_array': an array of all losses for all iterations (under key 'loss_array')
+       'num_iter': total number of iterations
+
+    EXAMPLES
+    =========
+    >>> import pandas as pd
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_data as addata
+    >>> sample = pd.read_csv('docs/demo.csv', nrows=5).drop(columns=['y'])
+    >>> w = ad.autodiff('w', [1, 1, 1, 1, 1])
+    >>> g = addata.chunked_gradient_descent(w*sample, 'docs/demo.csv', beta=0.1, max_iter=50, chunksize=64)
+    >>> print(g['num_iter'], g['loss_array'][-1] < g['loss_array'][0])
+    50 True
+    """
+    w = autodiff._find_weights(f)
+    g = adgraph.trace(f)
+
+    loss_values = []
+    i = 0
+    loss_v = np.inf
+    while i<max_iter and loss_v>tol:
+        g.bind('w', w.val)
+        grads, loss_v = chunked_backprop(g, read_chunks(path, target, chunksize), loss=loss, wrt=['w'])
+        loss_values.append(loss_v)
+        w.val = w.val - beta*grads['w']
+        i=i+1
+
+    f = f.forwardprop()
+    return {"f":f,"w":w,"loss_array":loss_values,"num_iter":i}
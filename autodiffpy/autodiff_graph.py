@@ -0,0 +1,517 @@
+import numpy as np
+from autodiffpy import autodiffmod as autodiff
+
+
+
+def _unbroadcast(g, shape):
+    """Sums g down to the given shape, undoing any NumPy broadcasting that happened on the forward pass."""
+    if np.shape(g) == shape:
+        return g
+    g = np.asarray(g)
+    while g.ndim > len(shape):
+        g = g.sum(axis=0)
+    for axis, size in enumerate(shape):
+        if size == 1 and g.shape[axis] != 1:
+            g = g.sum(axis=axis, keepdims=True)
+    return g
+
+
+#Forward kernels take the parent values (left parent first) and return the value of the node.
+#Backward kernels take the adjoint g of the node, its value, a list flagging which parents need
+#an adjoint, and the parent values, and return one adjoint per parent (None where not needed).
+
+def _neg_vjp(g, out, need, a):
+    return (-g,)
+
+def _add_vjp(g, out, need, a, b):
+    return (g, g)
+
+def _sub_vjp(g, out, need, a, b):
+    return (g, -g if need[1] else None)
+
+def _mul_vjp(g, out, need, a, b):
+    return (g*b if need[0] else None, g*a if need[1] else None)
+
+def _dot(a, b):
+    # Same as np.dot(b, a), but a may carry leading batch axes
+    return np.matmul(a, b.T)
+
+def _dot_vjp(g, out, need, a, b):
+    return (np.matmul(g, b) if need[0] else None, np.matmul(np.atleast_2d(g).T, np.atleast_2d(a)) if need[1] else None)
+
+def _truediv_vjp(g, out, need, a, b):
+    return (g/b if need[0] else None, -g*out/b if need[1] else None)
+
+def _rtruediv(a, b):
+    return b/a
+
+def _rtruediv_vjp(g, out, need, a, b):
+    return (-g*out/a if need[0] else None, g/a if need[1] else None)
+
+def _pow_vjp(g, out, need, a, b):
+    return (g*b*a**(b - 1) if need[0] else None, g*out*np.log(a) if need[1] else None)
+
+def _rpow(a, b):
+    return b**a
+
+def _rpow_vjp(g, out, need, a, b):
+    return (g*out*np.log(b) if need[0] else None, g*a*b**(a - 1) if need[1] else None)
+
+def _log(a, base=np.e):
+    return np.log(a)/np.log(base)
+
+def _log_vjp(g, out, need, a, base=np.e):
+    return (g/(a*np.log(base)),)
+
+def _logistic(a, A=1.0, k=1.0, x0=0.0):
+    return A/1.0/(1.0 + np.exp(-1.0*k*(a - x0)))
+
+def _logistic_vjp(g, out, need, a, A=1.0, k=1.0, x0=0.0):
+    e = np.exp(-1.0*k*(a - x0))
+    return (g*A*k*e/((e + 1.0)**2),)
+
+
+_OPS = {
+    'neg': (np.negative, _neg_vjp),
+    'add': (np.add, _add_vjp),
+    'sub': (np.subtract, _sub_vjp),
+    'mul': (np.multiply, _mul_vjp),
+    'dot': (_dot, _dot_vjp),
+    'truediv': (np.true_divide, _truediv_vjp),
+    'rtruediv': (_rtruediv, _rtruediv_vjp),
+    'pow': (np.power, _pow_vjp),
+    'rpow': (_rpow, _rpow_vjp),
+    'sqrt': (np.sqrt, lambda g, out, need, a: (g/(2*out),)),
+    'sin': (np.sin, lambda g, out, need, a: (g*np.cos(a),)),
+    'cos': (np.cos, lambda g, out, need, a: (-g*np.sin(a),)),
+    'tan': (np.tan, lambda g, out, need, a: (g/np.cos(a)**2,)),
+    'log': (_log, _log_vjp),
+    'exp': (np.exp, lambda g, out, need, a: (g*out,)),
+    'arcsin': (np.arcsin, lambda g, out, need, a: (g/np.sqrt(1 - a**2),)),
+    'arccos': (np.arccos, lambda g, out, need, a: (-g/np.sqrt(1 - a**2),)),
+    'arctan': (np.arctan, lambda g, out, need, a: (g/(1 + a**2),)),
+    'sinh': (np.sinh, lambda g, out, need, a: (g*np.cosh(a),)),
+    'cosh': (np.cosh, lambda g, out, need, a: (g*np.sinh(a),)),
+    'tanh': (np.tanh, lambda g, out, need, a: (g/np.cosh(a)**2,)),
+    'logistic': (_logistic, _logistic_vjp),
+}
+
+
+def _jvp(op, tangents, out, args, params):
+    """Pushes the tangents of the parents of a node (None where constant) forward to the node."""
+    if op == 'dot':
+        (ta, tb), (a, b) = tangents, args
+        total = 0
+        if ta is not None:
+            total = total + _dot(ta, b)
+        if tb is not None:
+            total = total + np.matmul(a, np.swapaxes(tb, -1, -2))
+        return total
+    # The backward kernel of an elementwise op multiplies the adjoint by the local partial, so
+    # handing it a tangent instead of an adjoint gives that parent's share of the node's tangent
+    total = 0
+    for k, t in enumerate(tangents):
+        if t is not None:
+            need = [j == k for j in range(len(tangents))]
+            total = total + _OPS[op][1](t, out, need, *args, **params)[k]
+    return total
+
+
+def _parents(obj):
+    """Returns the parents of a node of an autodiff graph, left parent first."""
+    if isinstance(obj, autodiff.autodiff) and obj.lparent is not None:
+        if obj.rparent is None:
+            return [obj.lparent]
+        return [obj.lparent, obj.rparent]
+    return []
+
+
+def _op_of(node):
+    """Returns the operation name and parameters that produced an autodiff node."""
+    op = node.function.__name__.strip('_')
+    if op not in _OPS:
+        raise ValueError(f"Error: cannot trace operation '{op}'.")
+    # Multiplying by a 2D constant of a different shape is a matrix-vector product (see autodiff.__mul__)
+    other = node.rparent
+    if op == 'mul' and isinstance(other, np.ndarray) and other.ndim == 2 and other.shape != autodiff._shape_of(node.lparent):
+        op = 'dot'
+    return op, dict(node.params or {})
+
+
+#Largest number of elements of an input value or seed that _key() compares by value rather than by identity
+_KEY_SIZE = 16
+
+
+def _array_key(value):
+    """Returns a hashable key for an input value or seed: its contents if it is small, else its identity."""
+    if np.size(value) > _KEY_SIZE:
+        return ('id', id(value))
+    value = np.asarray(value)
+    return (value.dtype.str, value.shape, value.tobytes())
+
+
+def _key(op, args, params, name=None, value=None, seed=None):
+    """Returns a hashable key that two nodes share only if they always hold the same value (and seed).
+
+    Arguments of the commutative operations add and mul are sorted, so that x*y and y*x share a key.
+    Inputs are keyed by name, seed and value: small constants are merged by value, while arrays of more
+    than _KEY_SIZE elements are merged only when they are the same object, so keying them costs O(1).
+    The caller must keep the keyed values alive while the keys are in use.
+    """
+    if op != 'input':
+        if op in ('add', 'mul'):
+            args = sorted(args)
+        return (op, tuple(args), repr(sorted(params.items())))
+    return (op, name, _array_key(value), None if seed is None else _array_key(seed))
+
+
+class graph():
+    """Flat, topologically ordered record of an autodiff expression.
+
+    Every node is an entry (op, args, params) of graph.ops, where args are the indices of its parent nodes.
+    Leaves (autodiff instances without parents) and constants are 'input' nodes whose values are kept in
+    graph.values; graph.names holds the name of each leaf and None for constants. Evaluating a graph never
+    touches the autodiff instances it was traced from, so inputs can be rebound without rebuilding anything.
+    graph.seeds holds the derivative seed (der) each leaf was created with, for forward-mode sweeps.
+    """
+
+    def __init__(self, ops, names, values, seeds=None):
+        self.ops = ops
+        self.names = names
+        self.values = values
+        self.seeds = seeds if seeds is not None else [None]*len(ops)
+        self.output = len(ops) - 1
+
+        self.leaves = {}
+        for idx, name in enumerate(names):
+            if name is not None:
+                self.leaves.setdefault(name, []).append(idx)
+
+
+    def _resolve(self, key):
+        """Returns the node indices bound by key: a leaf name or a node index."""
+        if isinstance(key, str):
+            try:
+                return self.leaves[key]
+            except KeyError:
+                raise KeyError(f"Error: variable '{key}' has not been encountered by this graph.")
+        return [key]
+
+
+    def bind(self, key, value):
+        """Replaces the value of the leaf (by name) or input node (by index) key."""
+        if isinstance(value, list):
+            value = np.asarray(value)
+        for idx in self._resolve(key):
+            self.values[idx] = value
+
+
+    def sample_inputs(self, num_samples, include=()):
+        """Returns the indices of the input nodes holding one row per sample: constants and leaves created with
+        der=None (data), plus the leaves named in include. Other leaves are variables such as weights, and are
+        never per-sample, even when their length happens to be num_samples."""
+        return [idx for idx, (op, args, params) in enumerate(self.ops)
+                if op == 'input' and (self.seeds[idx] is None or self.names[idx] in include)
+                and np.ndim(self.values[idx]) >= 1 and np.shape(self.values[idx])[0] == num_samples]
+
+
+    def forward(self, values=None):
+        """Returns the values of every node, with the inputs in the values dictionary (keyed like bind()) overridden for this call only."""
+        vals = list(self.values)
+        if values:
+            for key, value in values.items():
+                for idx in self._resolve(key):
+                    vals[idx] = value
+        for idx, (op, args, params) in enumerate(self.ops):
+            if op != 'input':
+                vals[idx] = _OPS[op][0](*[vals[j] for j in args], **params)
+        return vals
+
+
+    def evaluate(self, values=None):
+        """Returns the value of the output node; see forward()."""
+        return self.forward(values)[self.output]
+
+
+    def _requires(self, wanted):
+        """Flags the nodes that lie on a path from the wanted leaf nodes to the output."""
+        requires = [False]*len(self.ops)
+        for idx, (op, args, params) in enumerate(self.ops):
+            if op == 'input':
+                requires[idx] = idx in wanted
+            else:
+                requires[idx] = any(requires[j] for j in args)
+        return requires
+
+
+    def tangent(self, vals, tangents):
+        """Returns the tangent of the output given the node values from forward() and the tangents of some
+        input nodes (keyed by node index), or None if the output does not depend on those inputs.
+
+        Every tangent carries a leading batch axis, so one sweep pushes several seed directions at once.
+        Values left as None in vals (by subclasses that free values) are recomputed first.
+        """
+        if any(val is None for val in vals):
+            vals = graph.forward(self, {idx:vals[idx] for idx, (op, args, params) in enumerate(self.ops) if op == 'input'})
+        tan = [None]*len(self.ops)
+        for idx, t in tangents.items():
+            tan[idx] = t
+        for idx, (op, args, params) in enumerate(self.ops):
+            if op == 'input':
+                continue
+            ts = [tan[j] for j in args]
+            if any(t is not None for t in ts):
+                tan[idx] = _jvp(op, ts, vals[idx], [vals[j] for j in args], params)
+        return tan[self.output]
+
+
+    def jacobian(self, vals, names, mode=None):
+        """Returns the derivatives of the output along the derivative seed of each leaf in names, given the node
+        values from forward(), stacked along a new leading axis in the order of names (as in autodiff.jacobian()).
+
+        mode 'forward' pushes one tangent per name through a single sweep; mode 'reverse' runs one reverse sweep
+        per output element instead. By default the mode needing fewer sweeps' worth of work is chosen.
+        """
+        if mode is None:
+            mode = 'reverse' if np.size(vals[self.output]) < len(names) else 'forward'
+        if mode == 'reverse':
+            return self._reverse_jacobian(vals, names)
+        tangents = {}
+        for p, name in enumerate(names):
+            for idx in self._resolve(name):
+                if idx not in tangents:
+                    tangents[idx] = np.zeros((len(names),) + np.shape(vals[idx]))
+                tangents[idx][p] = 1.0 if self.seeds[idx] is None else self.seeds[idx]
+        shape = (len(names),) + np.shape(vals[self.output])
+        t = self.tangent(vals, tangents)
+        return np.zeros(shape) if t is None else np.broadcast_to(t, shape)
+
+
+    def _reverse_jacobian(self, vals, names):
+        """Same as jacobian(), built one output element at a time with reverse sweeps."""
+        shape = np.shape(vals[self.output])
+        rows = np.zeros((len(names), int(np.prod(shape))))
+        leaves = [idx for name in names for idx in self._resolve(name)]
+        for i in range(rows.shape[1]):
+            seed = np.zeros(rows.shape[1])
+            seed[i] = 1.0
+            adj = self.backward(vals, seed.reshape(shape), leaves)
+            for p, name in enumerate(names):
+                for idx in self._resolve(name):
+                    rows[p, i] += np.sum(adj[idx]*(1.0 if self.seeds[idx] is None else self.seeds[idx]))
+        return rows.reshape((len(names),) + shape)
+
+
+    def _backward_node(self, idx, g, vals, requires):
+        """Returns (j, adjoint) pairs for the required parents j of node idx, given its adjoint g."""
+        op, args, params = self.ops[idx]
+        need = [requires[j] for j in args]
+        grads = _OPS[op][1](g, vals[idx], need, *[vals[j] for j in args], **params)
+        return [(j, gj) for j, gj, nj in zip(args, grads, need) if nj]
+
+
+    def _sweep(self, vals, adj, requires, nodes, shapes=None, freed=None):
+        """Pushes the adjoints in adj back through nodes, last node first, accumulating them into adj.
+
+        shapes gives the shape of the value of every node (by default, read from vals); freed lists, for
+        every node, the values in vals to set to None once the sweep has passed that node.
+        """
+        for idx in reversed(nodes):
+            g = adj[idx]
+            if self.ops[idx][0] != 'input' and g is not None and requires[idx]:
+                for j, gj in self._backward_node(idx, g, vals, requires):
+                    gj = _unbroadcast(gj, np.shape(vals[j]) if shapes is None else shapes[j])
+                    adj[j] = gj if adj[j] is None else adj[j] + gj
+                adj[idx] = None
+            if freed is not None:
+                for j in freed[idx]:
+                    vals[j] = None
+
+
+    def _leaf_adjoints(self, names, adj, shapes):
+        """Returns the adjoints in adj summed over the input nodes of each name, with zeros for inputs the sweep did not reach."""
+        grads = {}
+        for name in names:
+            total = 0
+            for idx in self._resolve(name):
+                total = total + (adj[idx] if adj[idx] is not None else np.zeros(shapes[idx]))
+            grads[name] = total
+        return grads
+
+
+    def backward(self, vals, seed, wrt=None):
+        """Returns the adjoints of the leaves named in wrt (all leaves by default) given the node values
+        from forward() and the adjoint seed of the output, summed over leaves sharing a name. wrt may also
+        hold node indices, for the adjoint of a single input node."""
+        names = list(self.leaves) if wrt is None else list(wrt)
+        requires = self._requires(set(idx for name in names for idx in self._resolve(name)))
+        shapes = [np.shape(val) for val in vals]
+
+        adj = [None]*len(self.ops)
+        adj[self.output] = _unbroadcast(seed, shapes[self.output])
+        self._sweep(vals, adj, requires, range(len(self.ops)), shapes)
+        return self._leaf_adjoints(names, adj, shapes)
+
+
+    def backprop(self, y_true, loss='MSE', wrt=None, values=None):
+        """Returns the gradient of the loss with respect to the leaves named in wrt, and the loss itself.
+
+        INPUTS
+        =======
+        y_true: desired outputs
+        loss: string name of the desired loss function; allowed types are ['MSE', 'MAE', 'RMSE']
+        wrt: names of the leaves to differentiate with respect to (all leaves by default)
+        values: dictionary of input values to use for this call only (keyed by leaf name or node index)
+
+        RETURNS
+        ========
+        tuple of a dictionary mapping each leaf name to its gradient (shaped like the leaf value), and the loss value
+
+        EXAMPLES
+        =========
+        >>> import numpy as np
+        >>> from autodiffpy import autodiffmod as ad
+        >>> from autodiffpy import autodiff_graph as adgraph
+        >>> w = ad.autodiff('w', [1, 2])
+        >>> g = adgraph.trace(w*np.array([[1, 0], [0, 1], [1, 1]]))
+        >>> grads, loss_value = g.backprop([1, 2, 3], loss='MSE')
+        >>> print(grads['w'], loss_value)
+        [0. 0.] 0.0
+        """
+        vals = self.forward(values)
+        loss_value, d_loss = autodiff._loss(vals[self.output], y_true, loss)
+        return self.backward(vals, d_loss, wrt), loss_value
+
+
+
+def trace(f, cse=False):
+    """Records the graph behind an autodiff instance as a graph object that can be re-evaluated with new inputs.
+
+    With cse, structurally identical nodes with identical inputs are recorded once (hash-consing), so
+    repeated subexpressions are evaluated and differentiated once; their adjoints add up at the merged node.
+
+    INPUTS
+    =======
+    f: autodiff instance
+    cse: whether to merge common subexpressions
+
+    RETURNS
+    ========
+    graph instance whose output node is f
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_graph as adgraph
+    >>> x = ad.autodiff('x', 2)
+    >>> g = adgraph.trace(admath.sin(x)*x + 3)
+    >>> print([op for op, args, params in g.ops])
+    ['input', 'sin', 'mul', 'input', 'add']
+    >>> print(g.evaluate({'x': [0, 1]}))
+    [3.         3.84147098]
+    >>> g = adgraph.trace(admath.sin(x)*x + admath.sin(x)*x, cse=True)
+    >>> print([op for op, args, params in g.ops])
+    ['input', 'sin', 'mul', 'add']
+    """
+    if isinstance(f, autodiff.autodiff) == False:
+        raise ValueError("Error: only autodiff instances can be traced.")
+
+    index = {}
+    seen = {}
+    ops, names, values, seeds = [], [], [], []
+    stack = [(f, False)]
+    while stack:
+        obj, expanded = stack.pop()
+        if id(obj) in index:
+            continue
+        if isinstance(obj, autodiff.autodiff) and obj.released:
+            raise ValueError("Error: cannot trace an autodiff instance whose graph has been released by backprop().")
+        parents = _parents(obj)
+        if parents and not expanded:
+            stack.append((obj, True))
+            for parent in reversed(parents):
+                if id(parent) not in index:
+                    stack.append((parent, False))
+            continue
+
+        if parents:
+            op, params = _op_of(obj)
+            entry = (op, [index[id(parent)] for parent in parents], params), None, None, None
+        elif isinstance(obj, autodiff.autodiff):
+            entry = ('input', [], {}), obj.name, obj.val, obj.der.get(obj.name)
+        else:
+            entry = ('input', [], {}), None, np.asarray(obj) if isinstance(obj, list) else obj, None
+
+        if cse:
+            key = _key(*entry[0], *entry[1:])
+            if key in seen:
+                index[id(obj)] = seen[key]
+                continue
+            seen[key] = len(ops)
+        index[id(obj)] = len(ops)
+        ops.append(entry[0])
+        names.append(entry[1])
+        values.append(entry[2])
+        seeds.append(entry[3])
+
+    return graph(ops, names, values, seeds)
+
+
+
+def vmap(f, settings, order=None):
+    """Evaluates an autodiff expression and its Jacobian at many settings of its leaves in one pass.
+
+    The settings of each leaf are stacked along a new leading batch axis and the traced graph is run once,
+    so every operation is applied to the whole batch and the Python overhead is paid once rather than
+    once per setting. Leaves without settings keep the values they were traced with.
+
+    INPUTS
+    =======
+    f: autodiff instance, or graph instance returned by trace()
+    settings: dictionary mapping leaf names to a list or array with one value of the leaf per row
+    order: list of variable names giving the Jacobian row order (the names in alphabetical order by default)
+
+    RETURNS
+    ========
+    dictionary containing the batched values (under key "val"), the batched array representation of the
+    Jacobian (under key "jacobian", one f.jacobian() array per setting) and the ordering of the variables (under key "order")
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_graph as adgraph
+    >>> x = ad.autodiff('x', 3)
+    >>> y = ad.autodiff('y', 4)
+    >>> res = adgraph.vmap(admath.sqrt(x*y), {'x': [3, 1, 4], 'y': [4, 1, 1]}, order=['y', 'x'])
+    >>> print(res['val'][:, 0], res['order'], res['jacobian'][0, :, 0])
+    [3.46410162 1.         2.        ] ['y', 'x'] [0.4330127  0.57735027]
+    """
+    g = f if isinstance(f, graph) else trace(f)
+    if order is None:
+        order = sorted(g.leaves)
+    order = list(order)
+
+    if any(name not in g.leaves for name in settings):
+        raise KeyError("Error: variable(s) in settings have not been encountered by this autodiff instance.")
+    values = {}
+    sizes = set()
+    for name, idxs in g.leaves.items():
+        if name in settings:
+            batch = np.asarray(settings[name], dtype=float)
+            if batch.ndim == 1:
+                batch = batch[:, np.newaxis]
+            sizes.add(batch.shape[0])
+            values.update((idx, batch) for idx in idxs)
+        else:
+            # Leaves without settings get a batch axis of length one, so that every leaf broadcasts alike
+            values.update((idx, np.asarray(g.values[idx])[np.newaxis]) for idx in idxs)
+    if len(sizes) != 1:
+        raise ValueError("Error: every leaf in settings must have the same number of settings.")
+    num_settings = sizes.pop()
+
+    vals = g.forward(values)
+    shape = (num_settings,) + np.shape(vals[g.output])[1:]
+    jacobian = np.broadcast_to(g.jacobian(vals, order), (len(order),) + shape)
+    return {"val":np.array(np.broadcast_to(vals[g.output], shape)), "jacobian":np.moveaxis(jacobian, 0, 1).copy(), "order":order}
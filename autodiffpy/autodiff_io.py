@@ -0,0 +1,210 @@
+import io
+import json
+import numpy as np
+import autodiffpy
+from autodiffpy import autodiffmod as autodiff
+from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_graph as adgraph
+
+
+
+#Version of the layout of saved graphs
+_FORMAT = 1
+
+#autodiff methods that replay the operator ops of a graph on their left parent
+_METHODS = {'neg': '__neg__', 'add': '__add__', 'sub': '__sub__', 'mul': '__mul__', 'dot': '__mul__',
+            'truediv': '__truediv__', 'rtruediv': '__rtruediv__', 'pow': '__pow__', 'rpow': '__rpow__'}
+
+
+def _jsonable(value):
+    """Returns a param value as a JSON-compatible number or list."""
+    return float(value) if np.ndim(value) == 0 else np.asarray(value, dtype=float).tolist()
+
+
+def _arrays(g, header):
+    """Returns the header and the input values and seeds of a graph as the arrays of an npz file."""
+    header = dict(header, format=_FORMAT, version=autodiffpy.__version__,
+                  ops=[[op, args, {key:_jsonable(value) for key, value in params.items()}] for op, args, params in g.ops],
+                  names=g.names, output=g.output, scalars=[], seeds=[])
+    arrays = {}
+    for idx, (op, args, params) in enumerate(g.ops):
+        if op != 'input':
+            continue
+        if isinstance(g.values[idx], (bool, int, float, complex)):
+            header['scalars'].append(idx)
+        arrays[f'value{idx}'] = np.asarray(g.values[idx])
+        if g.seeds[idx] is not None:
+            header['seeds'].append(idx)
+            arrays[f'seed{idx}'] = np.asarray(g.seeds[idx])
+    arrays['header'] = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+    return arrays
+
+
+def _graph(data):
+    """Returns the graph and header stored in an open npz file."""
+    try:
+        header = json.loads(bytes(data['header']).decode())
+    except KeyError:
+        raise ValueError("Error: the file does not hold a saved graph.")
+    if header.get('format') != _FORMAT:
+        raise ValueError(f"Error: cannot read graphs saved in format {header.get('format')}.")
+    ops = [(op, args, params) for op, args, params in header['ops']]
+    values = [None]*len(ops)
+    seeds = [None]*len(ops)
+    for idx, (op, args, params) in enumerate(ops):
+        if op == 'input':
+            values[idx] = data[f'value{idx}']
+    for idx in header['scalars']:
+        values[idx] = values[idx].item()
+    for idx in header['seeds']:
+        seeds[idx] = data[f'seed{idx}']
+    g = adgraph.graph(ops, header['names'], values, seeds)
+    g.output = header['output']
+    return g, header
+
+
+def dumps(g, **header):
+    """Returns a traced graph serialized as bytes: an npz archive of its input arrays and a JSON header.
+
+    The header holds the op list, leaf names and output, plus any extra JSON-compatible keywords. The
+    constants, leaf values and seeds are stored as raw arrays, so the bytes are about the size of the data
+    and can be sent to worker processes instead of pickled autodiff instances.
+
+    INPUTS
+    =======
+    g: graph instance returned by autodiff_graph.trace()
+    header: extra JSON-compatible entries to store with the graph
+
+    RETURNS
+    ========
+    bytes
+    """
+    buffer = io.BytesIO()
+    np.savez(buffer, **_arrays(g, header))
+    return buffer.getvalue()
+
+
+def loads(data):
+    """Returns the graph serialized in bytes by dumps()."""
+    with np.load(io.BytesIO(data), allow_pickle=False) as archive:
+        return _graph(archive)[0]
+
+
+def save_graph(f, file):
+    """Saves an autodiff expression or traced graph to a .npz file (see dumps()).
+
+    INPUTS
+    =======
+    f: autodiff instance, or graph instance returned by autodiff_graph.trace()
+    file: path or file object to write to
+
+    EXAMPLES
+    =========
+    >>> import io
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_io as adio
+    >>> x = ad.autodiff('x', [1.0, 2.0])
+    >>> file = io.BytesIO()
+    >>> adio.save_graph(admath.sin(x)*x + 3, file)
+    >>> g = adio.load_graph(io.BytesIO(file.getvalue()))
+    >>> print([op for op, args, params in g.ops], g.evaluate({'x': [0.0, 1.0]}))
+    ['input', 'sin', 'mul', 'input', 'add'] [3.         3.84147098]
+    """
+    g = f if isinstance(f, adgraph.graph) else adgraph.trace(f)
+    np.savez(file, **_arrays(g, {}))
+
+
+def load_graph(file):
+    """Returns the graph saved by save_graph() in a .npz file (path or file object)."""
+    with np.load(file, allow_pickle=False) as archive:
+        return _graph(archive)[0]
+
+
+def _rebuild(g):
+    """Replays a graph with autodiff operations, and returns the output and the first leaf of each name."""
+    nodes = [None]*len(g.ops)
+    leaves = {}
+    for idx, (op, args, params) in enumerate(g.ops):
+        if op == 'input':
+            if g.names[idx] is None:
+                nodes[idx] = g.values[idx]
+            else:
+                nodes[idx] = autodiff.autodiff(g.names[idx], g.values[idx], g.seeds[idx])
+                leaves.setdefault(g.names[idx], nodes[idx])
+            continue
+        parents = [nodes[j] for j in args]
+        if not any(isinstance(parent, autodiff.autodiff) for parent in parents):
+            nodes[idx] = adgraph._OPS[op][0](*parents, **params)
+        elif op in _METHODS:
+            if not isinstance(parents[0], autodiff.autodiff):
+                if op not in ('add', 'mul'):
+                    raise ValueError(f"Error: cannot rebuild operation '{op}' on a constant.")
+                parents = parents[::-1]
+            nodes[idx] = getattr(parents[0], _METHODS[op])(*parents[1:])
+        else:
+            nodes[idx] = getattr(admath, op)(parents[0], **params)
+    return nodes[g.output], leaves
+
+
+def to_autodiff(g):
+    """Returns the autodiff expression a graph describes, rebuilt with its current input values.
+
+    INPUTS
+    =======
+    g: graph instance, such as one returned by load_graph()
+
+    RETURNS
+    ========
+    autodiff instance, with values and derivatives computed as if it had been written out by hand
+
+    EXAMPLES
+    =========
+    >>> import io
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_io as adio
+    >>> x = ad.autodiff('x', 2.0)
+    >>> f = adio.to_autodiff(adio.loads(adio.dumps(adio.adgraph.trace(admath.exp(x)/2))))
+    >>> print(f.val, f.der['x'])
+    [3.69452805] [3.69452805]
+    """
+    return _rebuild(g)[0]
+
+
+def save_result(result, file):
+    """Saves the result of gradient_descent() or lbfgs() to a .npz file: the expression of "f" with its current
+    weights, and the loss history and number of iterations. The loaded "f" is recomputed at the final weights.
+
+    INPUTS
+    =======
+    result: dictionary returned by autodiffmod.gradient_descent() or autodiffmod.lbfgs()
+    file: path or file object to write to
+
+    EXAMPLES
+    =========
+    >>> import io
+    >>> import numpy as np
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_io as adio
+    >>> w = ad.autodiff('w', [1, 1])
+    >>> result = ad.gradient_descent(w*np.array([[1, 0], [0, 1]]), [2, 3], max_iter=100, beta=0.5)
+    >>> file = io.BytesIO()
+    >>> adio.save_result(result, file)
+    >>> loaded = adio.load_result(io.BytesIO(file.getvalue()))
+    >>> print(np.round(loaded['w'].val, 3), np.round(loaded['f'].val, 3), loaded['num_iter'] == result['num_iter'])
+    [2. 3.] [2. 3.] True
+    """
+    g = adgraph.trace(result['f'])
+    header = {'loss_array':[float(loss_v) for loss_v in result['loss_array']], 'num_iter':int(result['num_iter'])}
+    np.savez(file, **_arrays(g, header))
+
+
+def load_result(file):
+    """Returns the result saved by save_result(), with "f" rebuilt as an autodiff expression and "w" its weights leaf."""
+    with np.load(file, allow_pickle=False) as archive:
+        g, header = _graph(archive)
+    f, leaves = _rebuild(g)
+    if 'w' not in leaves:
+        raise ValueError('Could not find weight vector. Be sure to name the weight autodiff as "w"')
+    return {"f":f, "w":leaves['w'], "loss_array":header['loss_array'], "num_iter":header['num_iter']}
@@ -9,6 +9,18 @@ except:
     from autodiffpy import autodiffmod as autodiff
 
 
+#Functions defined on part of the real line: test for a value outside the domain, and the error raised
+_DOMAINS = {'sqrt': (lambda val: np.min(val) < 0, 'Error: cannot evaluate the square root of a negative number(s).'),
+            'log': (lambda val: np.min(val) <= 0, 'Error: cannot evaluate the log of a nonpositive number.'),
+            'arcsin': (lambda val: min(val**2) > 1, 'Error: invalid value encountered while calculating derivatives.'),
+            'arccos': (lambda val: min(val**2) > 1, 'Error: invalid value encountered while calculating derivatives.')}
+
+
+def _check_domain(function, val):
+    """Raises a ValueError if val is outside the domain of the named function (no check for other functions)."""
+    if function in _DOMAINS and _DOMAINS[function][0](val):
+        raise ValueError(_DOMAINS[function][1])
+
 
 def sqrt(ad):
     """Returns autodiff instance of sqrt(x)
@@ -33,14 +45,18 @@ def sqrt(ad):
     [3.46410162] {'x': array([0.57735027]), 'y': array([0.4330127])}
     """
     try:
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, sqrt, ad)
         # Check that the domain of the square root is valid
-        if np.min(ad.val) < 0:
-            raise ValueError('Error: cannot evaluate the square root of a negative number(s).')
+        _check_domain('sqrt', ad.val)
 
         # Create a new autodiff instance with forward result
-        anew = autodiff.autodiff(name = ad.name, val = np.sqrt(ad.val), der = ad.der)
+        val = np.sqrt(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == (1/(2*np.sqrt(ad.val))).shape:
                 anew.der[key] = 1/(2*np.sqrt(ad.val))*ad.der[key]
             else:
@@ -50,7 +66,7 @@ def sqrt(ad):
         # Update with the backpropagation derivatives
         anew.lparent = ad
         anew.function = sqrt
-        ad.back_partial_der = (1/2.0)*((ad.val)**(-1/2.0))
+        anew.lpartial = (1/2.0)*((ad.val)**(-1/2.0))
         return anew
     except AttributeError: #If non-autodiff instance passed
         raise AttributeError("Error: input should be autodiff instance only.")
@@ -78,17 +94,22 @@ def sin(ad):
     [-0.54402111] {'x': array([-0.83907153])}
     """
     try:
-        anew = autodiff.autodiff(name=ad.name, val = np.sin(ad.val), der = ad.der)
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, sin, ad)
+        val = np.sin(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.lparent = ad
         anew.function = sin
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == np.cos(ad.val).shape:
                 anew.der[key] = ad.der[key]*np.cos(ad.val)
             else:
                 anew.der[key] = np.dot(np.cos(ad.val), ad.der[key])
 
-        ad.back_partial_der = np.cos(ad.val)
+        anew.lpartial = np.cos(ad.val)
         return anew
     except AttributeError:
         raise AttributeError("Error: input should be autodiff instance only.")
@@ -116,16 +137,21 @@ def cos(ad):
     [-0.83907153] {'x': array([0.54402111])}
     """
     try:
-        anew = autodiff.autodiff(name=ad.name, val = np.cos(ad.val), der = ad.der)
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, cos, ad)
+        val = np.cos(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.lparent = ad
         anew.function = cos
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == (-1*np.sin(ad.val)).shape:
                 anew.der[key] = ad.der[key]*-1*np.sin(ad.val)
             else:
                 anew.der[key] = np.dot(-1*np.sin(ad.val), ad.der[key])
-        ad.back_partial_der = -1*np.sin(ad.val)
+        anew.lpartial = -1*np.sin(ad.val)
         return anew
     except AttributeError:
         raise AttributeError("Error: input should be autodiff instance only.")
@@ -152,17 +178,22 @@ def tan(ad):
     [0.64836083] {'x': array([1.42037176])}
     """
     try:
-        anew = autodiff.autodiff(name=ad.name, val = np.tan(ad.val), der = ad.der)
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, tan, ad)
+        val = np.tan(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.lparent = ad
         anew.function = tan
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == (1/(np.cos(ad.val))**2).shape:
                 anew.der[key] = 1/(np.cos(ad.val))**2*ad.der[key]
             else:
                 anew.der[key] = np.dot(1/(np.cos(ad.val))**2, ad.der[key])
 
-        ad.back_partial_der = 1/(np.cos(ad.val))**2
+        anew.lpartial = 1/(np.cos(ad.val))**2
         return anew
     except AttributeError:
         raise AttributeError("Error: input should be autodiff instance only.")
@@ -193,21 +224,26 @@ def log(ad, base = np.e):
     [0.13533528]
     '''
     try:
-        if np.min(ad.val) <= 0:
-            raise ValueError('Error: cannot evaluate the log of a nonpositive number.')
-
-        anew = autodiff.autodiff(name = ad.name, val = np.log(ad.val)/np.log(base), der = ad.der)
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, log, ad, params = {'base': base})
+        _check_domain('log', ad.val)
+
+        val = np.log(ad.val)/np.log(base)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.lparent = ad
         anew.function = log
+        anew.params = {'base': base}
 
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == (ad.val*(np.log(base))).shape:
                 anew.der[key] = ad.der[key]/(ad.val*(np.log(base)))
             else:
                 anew.der[key] = np.dot(1/(ad.val*(np.log(base))), ad.der[key])
 
-        ad.back_partial_der = 1/(ad.val*(np.log(base)))
+        anew.lpartial = 1/(ad.val*(np.log(base)))
         return anew
     except AttributeError:
         raise AttributeError("Error: input should be autodiff instance only.")
@@ -238,15 +274,20 @@ def exp(ad):
     '''
 
     try:
-        anew = autodiff.autodiff(name=ad.name, val = np.exp(ad.val), der = ad.der)
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, exp, ad)
+        val = np.exp(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.lparent = ad
         anew.function = exp
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == anew.val.shape:
                 anew.der[key] = ad.der[key]*anew.val
             else:
                 anew.der[key] = np.dot(anew.val, ad.der[key])
-        ad.back_partial_der = anew.val
+        anew.lpartial = anew.val
         return anew
     except AttributeError:
         raise AttributeError("Error: input should be autodiff instance only.")
@@ -274,22 +315,24 @@ def arcsin(ad):
     [0.10016742] {'x': array([1.00503782])}
     """
     try:
-
-        if min(ad.val**2) > 1:
-
-            raise ValueError('Error: invalid value encountered while calculating derivatives.')
-        anew = autodiff.autodiff(name=ad.name, val = np.arcsin(ad.val), der = ad.der)
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, arcsin, ad)
+        _check_domain('arcsin', ad.val)
+        val = np.arcsin(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.function = arcsin
         anew.lparent = ad
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
 
             if ad.der[key].shape == (1/np.sqrt(1 - ad.val**2)).shape:
                 anew.der[key] = 1/np.sqrt(1 - ad.val**2)*ad.der[key]
             else:
                 anew.der[key] = np.dot(1/np.sqrt(1 - ad.val**2), ad.der[key])
 
-        ad.back_partial_der = 1/np.sqrt(1 - ad.val**2)
+        anew.lpartial = 1/np.sqrt(1 - ad.val**2)
         return anew
     except AttributeError:
         raise AttributeError("Error: input should be autodiff instance only.")
@@ -316,21 +359,24 @@ def arccos(ad):
     [1.36943841] {'x': array([-1.02062073])}
     """
     try:
-        if min(ad.val**2) > 1:
-
-            raise ValueError('Error: invalid value encountered while calculating derivatives.')
-        anew = autodiff.autodiff(name=ad.name, val = np.arccos(ad.val), der = ad.der)
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, arccos, ad)
+        _check_domain('arccos', ad.val)
+        val = np.arccos(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.lparent = ad
         anew.function = arccos
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
 
             if ad.der[key].shape == (-1/np.sqrt(1 - ad.val**2)).shape:
                 anew.der[key] = -1/np.sqrt(1 - ad.val**2)*ad.der[key]
             else:
                 anew.der[key] = np.dot(-1/np.sqrt(1 - ad.val**2), ad.der[key])
 
-        ad.back_partial_der = -1/np.sqrt(1 - ad.val**2)
+        anew.lpartial = -1/np.sqrt(1 - ad.val**2)
         return anew
     except AttributeError:
         raise AttributeError("Error: input should be autodiff instance only.")
@@ -358,18 +404,23 @@ def arctan(ad):
     [0.19739556] {'x': array([0.96153846])}
     """
     try:
-        anew = autodiff.autodiff(name=ad.name, val = np.arctan(ad.val), der = ad.der)
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, arctan, ad)
+        val = np.arctan(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.function = arctan
         anew.lparent = ad
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
 
             if ad.der[key].shape == (1/(1+ad.val**2)).shape:
                 anew.der[key] = 1/(1+ad.val**2)*ad.der[key]
             else:
                 anew.der[key] = np.dot(1/(1+ad.val**2), ad.der[key])
 
-        ad.back_partial_der = 1/(1+ad.val**2)
+        anew.lpartial = 1/(1+ad.val**2)
         return anew
     except AttributeError:
         raise AttributeError("Error: input should be autodiff instance only.")
@@ -400,20 +451,25 @@ def sinh(ad):
     '''
 
     try:
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, sinh, ad)
         # Create a new autodiff instance with forward result
-        anew = autodiff.autodiff(name=ad.name, val = np.sinh(ad.val), der = ad.der)
+        val = np.sinh(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.function = sinh
         anew.lparent = ad
 
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == np.cosh(ad.val).shape:
                 anew.der[key] = ad.der[key]*np.cosh(ad.val)
             else:
                 anew.der[key] = np.dot(np.cosh(ad.val), ad.der[key])
 
         # Update with the backpropagation derivatives
-        ad.back_partial_der = np.cosh(ad.val)
+        anew.lpartial = np.cosh(ad.val)
 
         return anew
     except AttributeError: #If non-autodiff instance passed
@@ -444,12 +500,17 @@ def cosh(ad):
     '''
 
     try:
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, cosh, ad)
         # Create a new autodiff instance with forward result
-        anew = autodiff.autodiff(name=ad.name, val = np.cosh(ad.val), der = ad.der)
+        val = np.cosh(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.function = cosh
         anew.lparent = ad
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == np.sinh(ad.val).shape:
                 anew.der[key] = ad.der[key]*np.sinh(ad.val)
             else:
@@ -457,7 +518,7 @@ def cosh(ad):
 
         # Update with the backpropagation derivatives
 
-        ad.back_partial_der = np.sinh(ad.val)
+        anew.lpartial = np.sinh(ad.val)
 
         return anew
     except AttributeError: #If non-autodiff instance passed
@@ -488,13 +549,18 @@ def tanh(ad):
     '''
 
     try:
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, tanh, ad)
         # Create a new autodiff instance with forward result
-        anew = autodiff.autodiff(name=ad.name, val = np.tanh(ad.val), der = ad.der)
+        val = np.tanh(ad.val)
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.function = tanh
         anew.lparent = ad
 
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == ((1.0/np.cosh(ad.val))**2).shape:
                 anew.der[key] = ad.der[key]*((1.0/np.cosh(ad.val))**2)
             else:
@@ -503,7 +569,7 @@ def tanh(ad):
 
         # Update with the backpropagation derivatives
 
-        ad.back_partial_der = ((1.0/np.cosh(ad.val))**2)
+        anew.lpartial = ((1.0/np.cosh(ad.val))**2)
 
         return anew
     except AttributeError: #If non-autodiff instance passed
@@ -538,13 +604,20 @@ def logistic(ad, A=1.0, k=1.0, x0=0.0):
     '''
 
     try:
-        # Create a new autodiff instance with forward result
-        anew = autodiff.autodiff(name=ad.name, val = (A/1.0/(1.0 + np.exp(-1.0*k*(ad.val - x0)))), der = ad.der)
+        if autodiff.lazy_enabled() and autodiff.grad_enabled():
+            return autodiff.deferred(ad.name, logistic, ad, params = {'A': A, 'k': k, 'x0': x0})
+        # Create a new autodiff instance with forward result (ad.val is read before k is used, so that a
+        # non-autodiff input raises AttributeError rather than a TypeError about k)
+        val = (A/1.0/(1.0 + np.exp(-1.0*(ad.val - x0)*k)))
+        if autodiff.grad_enabled() == False:
+            return autodiff._value_only(ad.name, val)
+        anew = autodiff.autodiff(name = ad.name, val = val, der = ad.der)
         anew.function = logistic
+        anew.params = {'A': A, 'k': k, 'x0': x0}
         anew.lparent = ad
 
 
-        for key in ad.der:
+        for key in autodiff._keys(ad.der):
             if ad.der[key].shape == (A*k*np.exp(-1.0*k*(ad.val - x0))/1.0/((np.exp(-1.0*k*(ad.val - x0)) + 1.0)**2)).shape:
                 anew.der[key] = ad.der[key]*A*k*np.exp(-1.0*k*(ad.val - x0))/1.0/((np.exp(-1.0*k*(ad.val - x0)) + 1.0)**2)
             else:
@@ -552,7 +625,7 @@ def logistic(ad, A=1.0, k=1.0, x0=0.0):
 
 
         # Update with the backpropagation derivatives
-        ad.back_partial_der = (A*k)*np.exp(-1.0*k*(ad.val - x0))/1.0/((np.exp(-1.0*k*(ad.val - x0)) + 1.0)**2)
+        anew.lpartial = (A*k)*np.exp(-1.0*k*(ad.val - x0))/1.0/((np.exp(-1.0*k*(ad.val - x0)) + 1.0)**2)
 
         return anew
     except AttributeError: #If non-autodiff instance passed
@@ -0,0 +1,635 @@
+import numpy as np
+from autodiffpy import autodiff_graph as adgraph
+
+
+
+def _is_scalar(g, idx, number):
+    """Returns whether node idx of g is a scalar constant equal to number."""
+    value = g.values[idx]
+    return g.ops[idx][0] == 'input' and g.names[idx] is None and np.ndim(value) == 0 and value == number
+
+
+def _identity(g, op, args, params):
+    """Returns the node an operation on the nodes args of g is known to equal, or None.
+
+    Only scalar constants are matched, so that removing the operation never changes the shape of a value.
+    """
+    if op == 'mul':
+        for k in (0, 1):
+            if _is_scalar(g, args[k], 1):
+                return args[1 - k]
+    elif op == 'add':
+        for k in (0, 1):
+            if _is_scalar(g, args[k], 0):
+                return args[1 - k]
+    elif op == 'sub' and _is_scalar(g, args[1], 0):
+        return args[0]
+    elif op in ('truediv', 'pow') and _is_scalar(g, args[1], 1):
+        return args[0]
+    elif op == 'neg' and g.ops[args[0]][0] == 'neg':
+        return g.ops[args[0]][1][0]
+    elif op == 'log' and params.get('base', np.e) == np.e and g.ops[args[0]][0] == 'exp':
+        return g.ops[args[0]][1][0]
+    return None
+
+
+def _compact(g, keep):
+    """Returns a copy of g with only the nodes flagged in keep, and the output last."""
+    order = [idx for idx in range(len(g.ops)) if keep[idx] and idx != g.output] + [g.output]
+    index = {old:new for new, old in enumerate(order)}
+    return adgraph.graph([(g.ops[idx][0], [index[j] for j in g.ops[idx][1]], g.ops[idx][2]) for idx in order],
+                         [g.names[idx] for idx in order], [g.values[idx] for idx in order], [g.seeds[idx] for idx in order])
+
+
+def eliminate_dead(g):
+    """Returns a copy of g without the nodes the output does not depend on; named leaves are always kept."""
+    live = [False]*len(g.ops)
+    live[g.output] = True
+    for idx in range(g.output, -1, -1):
+        if live[idx]:
+            for j in g.ops[idx][1]:
+                live[j] = True
+    keep = [live[idx] or g.names[idx] is not None for idx in range(len(g.ops))]
+    return _compact(g, keep)
+
+
+def simplify(g, fixed=()):
+    """Returns an equivalent graph with constant subgraphs folded, algebraic identities applied and dead nodes removed.
+
+    Operations whose inputs are all constants are evaluated once and become constants. The identities
+    x*1, 1*x, x+0, 0+x, x-0, x/1, x**1, -(-x) and log(exp(x)) are replaced by x. Constants are treated as
+    fixed; leaves are not folded, so they can still be rebound, unless they are named in fixed (data leaves
+    that are never rebound or differentiated, for example).
+
+    INPUTS
+    =======
+    g: graph instance returned by autodiff_graph.trace()
+    fixed: names of leaves to treat as constants
+
+    RETURNS
+    ========
+    new graph instance; g is left unchanged
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_graph as adgraph
+    >>> from autodiffpy import autodiff_optimize as adoptimize
+    >>> y = ad.autodiff('y', 2)
+    >>> z = ad.autodiff('z', 4)
+    >>> g = adgraph.trace(admath.log(admath.exp(-y/z))*1 + 0)
+    >>> print([op for op, args, params in g.ops])
+    ['input', 'neg', 'input', 'truediv', 'exp', 'log', 'input', 'mul', 'input', 'add']
+    >>> h = adoptimize.simplify(g)
+    >>> print([op for op, args, params in h.ops], h.evaluate())
+    ['input', 'neg', 'input', 'truediv'] [-0.5]
+    """
+    new = adgraph.graph([], [], [], [])
+    index = {}
+    for idx, (op, args, params) in enumerate(g.ops):
+        if op != 'input':
+            args = [index[j] for j in args]
+            if all(new.ops[j][0] == 'input' and new.names[j] is None for j in args):
+                value = adgraph._OPS[op][0](*[new.values[j] for j in args], **params)
+                op, args, params = 'input', [], {}
+            else:
+                target = _identity(new, op, args, params)
+                if target is not None:
+                    index[idx] = target
+                    continue
+                value = None
+        else:
+            value = g.values[idx]
+        index[idx] = len(new.ops)
+        new.ops.append((op, args, params))
+        new.names.append(None if g.names[idx] in fixed else g.names[idx])
+        new.values.append(value)
+        new.seeds.append(g.seeds[idx])
+    new.output = index[g.output]
+    return eliminate_dead(new)
+
+
+def cse(g):
+    """Returns an equivalent graph in which structurally identical nodes with identical inputs are merged.
+
+    This is the pass autodiff_graph.trace(f, cse=True) applies while tracing; on its own it can be run
+    after other passes, such as simplify(), that may expose new common subexpressions. Adjoints of the
+    merged nodes add up during backward sweeps, so gradients are unchanged.
+
+    INPUTS
+    =======
+    g: graph instance returned by autodiff_graph.trace()
+
+    RETURNS
+    ========
+    new graph instance; g is left unchanged
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_graph as adgraph
+    >>> from autodiffpy import autodiff_optimize as adoptimize
+    >>> x = ad.autodiff('x', 1)
+    >>> y = ad.autodiff('y', 2)
+    >>> g = adgraph.trace(admath.exp(x*y) + admath.exp(y*x))
+    >>> print(len(g.ops), len(adoptimize.cse(g).ops))
+    7 5
+    """
+    new = adgraph.graph([], [], [], [])
+    index = {}
+    seen = {}
+    for idx, (op, args, params) in enumerate(g.ops):
+        args = [index[j] for j in args]
+        key = adgraph._key(op, args, params, g.names[idx], g.values[idx], g.seeds[idx])
+        if key not in seen:
+            seen[key] = len(new.ops)
+            new.ops.append((op, args, params))
+            new.names.append(g.names[idx])
+            new.values.append(g.values[idx])
+            new.seeds.append(g.seeds[idx])
+        index[idx] = seen[key]
+    new.output = index[g.output]
+    return eliminate_dead(new)
+
+
+
+def _log_into(out, a, base=np.e):
+    np.log(a, out=out)
+    if base != np.e:
+        np.divide(out, np.log(base), out=out)
+
+def _logistic_into(out, a, A=1.0, k=1.0, x0=0.0):
+    np.subtract(a, x0, out=out)
+    np.multiply(out, -1.0*k, out=out)
+    np.exp(out, out=out)
+    np.add(out, 1.0, out=out)
+    np.divide(A/1.0, out, out=out)
+
+
+#Elementwise kernels that write the value of a node into the buffer out instead of allocating it
+_INTO = {
+    'neg': lambda out, a: np.negative(a, out=out),
+    'add': lambda out, a, b: np.add(a, b, out=out),
+    'sub': lambda out, a, b: np.subtract(a, b, out=out),
+    'mul': lambda out, a, b: np.multiply(a, b, out=out),
+    'truediv': lambda out, a, b: np.true_divide(a, b, out=out),
+    'rtruediv': lambda out, a, b: np.true_divide(b, a, out=out),
+    'pow': lambda out, a, b: np.power(a, b, out=out),
+    'rpow': lambda out, a, b: np.power(b, a, out=out),
+    'log': _log_into,
+    'logistic': _logistic_into,
+}
+for _op in ('sqrt', 'sin', 'cos', 'tan', 'exp', 'arcsin', 'arccos', 'arctan', 'sinh', 'cosh', 'tanh'):
+    _INTO[_op] = (lambda ufunc: lambda out, a: ufunc(a, out=out))(adgraph._OPS[_op][0])
+
+
+def _planned(g, vals):
+    """Returns whether the input values in vals have the shapes and dtypes a fused or planned graph was planned for."""
+    return all(np.shape(vals[idx]) == g._shapes[idx] and np.asarray(vals[idx]).dtype == g._dtypes[idx]
+               for idx, (op, args, params) in enumerate(g.ops) if op == 'input')
+
+
+class fused(adgraph.graph):
+    """Graph whose chains of elementwise operations are evaluated as fused groups, one block at a time.
+
+    Every group is a set of elementwise nodes whose intermediate values are used only inside the group.
+    A group is run over its output in blocks of block_size values: each node writes into a block-sized
+    buffer that is reused for every block, so the intermediates stay in cache and no full-size temporary
+    is allocated; only the output of the group is stored whole. The reverse sweep of a group recomputes
+    its intermediates for each block and pushes the adjoint through them in the same blocks. forward()
+    leaves the values of the intermediate nodes of groups as None.
+
+    Groups are planned for the shapes and dtypes of the inputs the graph holds when fused; if inputs of
+    other shapes or dtypes are given, the graph is evaluated node by node instead.
+    """
+
+    def __init__(self, g, block_size=2**14):
+        super().__init__(list(g.ops), list(g.names), list(g.values), list(g.seeds))
+        self.output = g.output
+        self.block_size = block_size
+
+        vals = adgraph.graph.forward(self)
+        self._shapes = [np.shape(val) for val in vals]
+        self._dtypes = [np.asarray(val).dtype for val in vals]
+        consumers = [[] for idx in self.ops]
+        for idx, (op, args, params) in enumerate(self.ops):
+            for j in set(args):
+                consumers[j].append(idx)
+
+        #Grow groups in topological order: a node joins the groups of the parents it is the only consumer of
+        group_of = {}
+        for idx, (op, args, params) in enumerate(self.ops):
+            if not self._elementwise(idx):
+                continue
+            members = [idx]
+            for j in set(args):
+                if j in group_of and consumers[j] == [idx] and self._shapes[j] == self._shapes[idx]:
+                    members = members + group_of[j]
+            for j in members:
+                group_of[j] = members
+
+        #Each group is keyed by its output node (its last node), and holds its nodes and external inputs in order
+        self.groups = {}
+        for members in group_of.values():
+            if len(members) > 1 and max(members) not in self.groups:
+                nodes = sorted(members)
+                inputs = sorted(set(j for idx in nodes for j in self.ops[idx][1]) - set(nodes))
+                self.groups[nodes[-1]] = (nodes, inputs)
+        self._inner = set(idx for nodes, inputs in self.groups.values() for idx in nodes[:-1])
+
+
+    def _elementwise(self, idx):
+        """Returns whether node idx is elementwise with parents of its own shape or single values."""
+        op, args, params = self.ops[idx]
+        if op not in _INTO:
+            return False
+        return all(self._shapes[j] == self._shapes[idx] or int(np.prod(self._shapes[j])) == 1 for j in args)
+
+
+    def _blocks(self, nodes, inputs, vals, out=None):
+        """Yields (lo, hi, local) for every block of a group, with local mapping the external inputs and nodes
+        of the group to their values on the block. The output node of the group is written into out if given."""
+        size = int(np.prod(self._shapes[nodes[-1]]))
+        width = min(self.block_size, size)
+        flat = {j:(np.reshape(vals[j], -1) if np.size(vals[j]) == size else np.reshape(vals[j], ())) for j in inputs}
+        buffers = {idx:np.empty(width, dtype=self._dtypes[idx]) for idx in nodes}
+        if out is not None:
+            out = np.reshape(out, -1)
+        for lo in range(0, size, width):
+            hi = min(lo + width, size)
+            local = {j:(value[lo:hi] if value.ndim else value) for j, value in flat.items()}
+            for idx in nodes:
+                op, args, params = self.ops[idx]
+                local[idx] = out[lo:hi] if idx == nodes[-1] and out is not None else buffers[idx][:hi - lo]
+                _INTO[op](local[idx], *[local[j] for j in args], **params)
+            yield lo, hi, local
+
+
+    def forward(self, values=None):
+        """Same as graph.forward(), with every group evaluated in blocks; intermediate nodes of groups are left as None."""
+        vals = list(self.values)
+        if values:
+            for key, value in values.items():
+                for idx in self._resolve(key):
+                    vals[idx] = value
+        if not _planned(self, vals):
+            return adgraph.graph.forward(self, values)
+        for idx, (op, args, params) in enumerate(self.ops):
+            if idx in self.groups:
+                vals[idx] = np.empty(self._shapes[idx], dtype=self._dtypes[idx])
+                for block in self._blocks(*self.groups[idx], vals, vals[idx]):
+                    pass
+            elif op != 'input' and idx not in self._inner:
+                vals[idx] = adgraph._OPS[op][0](*[vals[j] for j in args], **params)
+        return vals
+
+
+    def _group_backward(self, idx, g, vals, requires):
+        """Returns the adjoints of the required external inputs of the group whose output is node idx."""
+        nodes, inputs = self.groups[idx]
+        adj = {j:np.zeros(self._shapes[j]) for j in inputs if requires[j]}
+        flat = {j:np.reshape(a, -1) for j, a in adj.items()}
+        g = np.reshape(np.broadcast_to(g, self._shapes[idx]), -1)
+        for lo, hi, local in self._blocks(nodes, inputs, vals):
+            ladj = {idx:g[lo:hi]}
+            for k in reversed(nodes):
+                if k not in ladj:
+                    continue
+                op, args, params = self.ops[k]
+                need = [requires[j] for j in args]
+                grads = adgraph._OPS[op][1](ladj.pop(k), local[k], need, *[local[j] for j in args], **params)
+                for j, gj, nj in zip(args, grads, need):
+                    if not nj:
+                        continue
+                    if j not in flat:
+                        ladj[j] = gj if j not in ladj else ladj[j] + gj
+                    elif flat[j].size == g.size:
+                        flat[j][lo:hi] += gj
+                    else:
+                        flat[j] += np.sum(gj)
+        return adj
+
+
+    def _backward_node(self, idx, g, vals, requires):
+        """Same as graph._backward_node(), pushing the adjoint of a group through it in blocks when forward()
+        left its intermediate values out (otherwise every node of the group is differentiated on its own)."""
+        if idx in self.groups and vals[self.groups[idx][0][0]] is None:
+            return list(self._group_backward(idx, g, vals, requires).items())
+        return adgraph.graph._backward_node(self, idx, g, vals, requires)
+
+
+
+def fuse(g, block_size=2**14):
+    """Returns a copy of a traced graph whose chains of elementwise operations run as fused, blocked kernels.
+
+    The fused graph has the same interface as g (forward, evaluate, backward, backprop, jacobian), but long
+    elementwise chains no longer allocate a full-size array for every intermediate value and adjoint.
+
+    INPUTS
+    =======
+    g: graph instance returned by autodiff_graph.trace()
+    block_size: number of values per block; the buffers of a group hold one block each
+
+    RETURNS
+    ========
+    fused instance
+
+    EXAMPLES
+    =========
+    >>> import numpy as np
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_graph as adgraph
+    >>> from autodiffpy import autodiff_optimize as adoptimize
+    >>> x1 = ad.autodiff('x1', np.linspace(0, 1, 5))
+    >>> x2 = ad.autodiff('x2', np.linspace(1, 2, 5))
+    >>> h = adoptimize.fuse(adgraph.trace(4*admath.sin(x1/2) + 2*admath.cos(x2*3)), block_size=2)
+    >>> print([[h.ops[idx][0] for idx in nodes] for nodes, inputs in h.groups.values()])
+    [['truediv', 'sin', 'mul', 'mul', 'cos', 'mul', 'add']]
+    >>> print(np.allclose(h.evaluate(), 4*np.sin(x1.val/2) + 2*np.cos(x2.val*3)))
+    True
+    """
+    return fused(g, block_size)
+
+
+
+#Operands each backward kernel reads: whether it needs the parent values, and whether it needs the node value
+_READS = {
+    'neg': (False, False), 'add': (False, False), 'sub': (False, False),
+    'mul': (True, False), 'dot': (True, False), 'truediv': (True, True), 'rtruediv': (True, True),
+    'pow': (True, True), 'rpow': (True, True), 'sqrt': (False, True), 'exp': (False, True),
+}
+
+
+class planned(adgraph.graph):
+    """Graph evaluated with a static, liveness-based memory plan.
+
+    Every elementwise node is assigned a buffer slot when the graph is planned. A slot is handed to a new
+    node as soon as the value it holds has had its last use, and the node writes into it with NumPy out=
+    arguments, so evaluate() holds only the values that are still needed at any point: O(width x n) for
+    a model whose layers have width values of n points, instead of O(depth x n). The plan for backprop()
+    also keeps the values that the reverse sweep reads, and releases each of them once the reverse sweep
+    has passed its last reader. Values freed by a plan are None in the list returned by forward().
+
+    Plans are made for the shapes and dtypes of the inputs the graph holds when planned; if inputs of other
+    shapes or dtypes are given, the graph is evaluated node by node instead.
+    """
+
+    def __init__(self, g):
+        super().__init__(list(g.ops), list(g.names), list(g.values), list(g.seeds))
+        self.output = g.output
+
+        vals = adgraph.graph.forward(self)
+        self._shapes = [np.shape(val) for val in vals]
+        self._dtypes = [np.asarray(val).dtype for val in vals]
+        self._last = list(range(len(self.ops)))
+        for idx, (op, args, params) in enumerate(self.ops):
+            for j in args:
+                self._last[j] = idx
+
+        #Values read by the reverse sweep, and the node after whose backward kernel each can be released
+        self._backward_reads = {}
+        for idx, (op, args, params) in enumerate(self.ops):
+            if op == 'input':
+                continue
+            reads_args, reads_out = _READS.get(op, (True, False))
+            for j in (args if reads_args else []) + ([idx] if reads_out else []):
+                self._backward_reads[j] = min(idx, self._backward_reads.get(j, idx))
+
+        self.plans = {'evaluate': self._plan(set([self.output])),
+                      'backprop': self._plan(set([self.output]) | set(self._backward_reads))}
+
+
+    def _plan(self, keep):
+        """Returns the buffer slot of every node (None for nodes that allocate their own value), the shape and
+        dtype of every slot, and the nodes whose values can be released after each node, keeping the nodes in keep."""
+        slot_of = [None]*len(self.ops)
+        slots = []
+        pool = {}
+        release = [[] for idx in self.ops]
+        for idx, (op, args, params) in enumerate(self.ops):
+            if op == 'input':
+                continue
+            for j in set(args):
+                if self._last[j] == idx and j not in keep and self.ops[j][0] != 'input':
+                    release[idx].append(j)
+                    if slot_of[j] is not None:
+                        pool.setdefault(slots[slot_of[j]], []).append(slot_of[j])
+            key = (self._shapes[idx], self._dtypes[idx].str)
+            if op in _INTO and all(self._shapes[j] == key[0] or int(np.prod(self._shapes[j])) == 1 for j in args):
+                if pool.get(key):
+                    slot_of[idx] = pool[key].pop()
+                else:
+                    slot_of[idx] = len(slots)
+                    slots.append(key)
+        return slot_of, slots, release
+
+
+    def forward(self, values=None, plan='backprop'):
+        """Same as graph.forward(), following the memory plan named plan ('evaluate' keeps only the output,
+        'backprop' also keeps the values backward() reads); released values are left as None."""
+        vals = list(self.values)
+        if values:
+            for key, value in values.items():
+                for idx in self._resolve(key):
+                    vals[idx] = value
+        if not _planned(self, vals):
+            return adgraph.graph.forward(self, values)
+        slot_of, slots, release = self.plans[plan]
+        buffers = [None]*len(slots)
+        for idx, (op, args, params) in enumerate(self.ops):
+            if op == 'input':
+                continue
+            if slot_of[idx] is None:
+                vals[idx] = adgraph._OPS[op][0](*[vals[j] for j in args], **params)
+            else:
+                # A slot holds one value at a time: the value it held before has been released
+                if buffers[slot_of[idx]] is None:
+                    buffers[slot_of[idx]] = np.empty(*slots[slot_of[idx]])
+                vals[idx] = buffers[slot_of[idx]]
+                _INTO[op](vals[idx], *[vals[j] for j in args], **params)
+            for j in release[idx]:
+                vals[j] = None
+        for k in range(len(buffers)):
+            buffers[k] = None
+        return vals
+
+
+    def evaluate(self, values=None):
+        """Returns the value of the output node, holding only the values still needed at any point."""
+        return self.forward(values, plan='evaluate')[self.output]
+
+
+    def backward(self, vals, seed, wrt=None, release=False):
+        """Same as graph.backward(); with release, every value in vals is set to None once the reverse sweep
+        has no further use for it, so backprop() frees forward values as it goes."""
+        if not _planned(self, vals):
+            return adgraph.graph.backward(self, vals, seed, wrt)
+        names = list(self.leaves) if wrt is None else list(wrt)
+        requires = self._requires(set(idx for name in names for idx in self._resolve(name)))
+        freed = [[] for idx in self.ops]
+        if release:
+            for j, idx in self._backward_reads.items():
+                if self.ops[j][0] != 'input' and j != self.output:
+                    freed[idx].append(j)
+
+        # Released values are None in vals, so shapes come from the plan
+        adj = [None]*len(self.ops)
+        adj[self.output] = adgraph._unbroadcast(seed, self._shapes[self.output])
+        self._sweep(vals, adj, requires, range(len(self.ops)), self._shapes, freed)
+        return self._leaf_adjoints(names, adj, self._shapes)
+
+
+    def backprop(self, y_true, loss='MSE', wrt=None, values=None):
+        """Same as graph.backprop(), releasing forward values as soon as the reverse sweep is done with them."""
+        vals = self.forward(values)
+        loss_value, d_loss = adgraph.autodiff._loss(vals[self.output], y_true, loss)
+        return self.backward(vals, d_loss, wrt, release=True), loss_value
+
+
+
+
+
+def plan_memory(g):
+    """Returns a copy of a traced graph that evaluates and differentiates with a liveness-based memory plan.
+
+    INPUTS
+    =======
+    g: graph instance returned by autodiff_graph.trace()
+
+    RETURNS
+    ========
+    planned instance, with the same interface as g
+
+    EXAMPLES
+    =========
+    >>> import numpy as np
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_graph as adgraph
+    >>> from autodiffpy import autodiff_optimize as adoptimize
+    >>> x = ad.autodiff('x', np.linspace(0, 1, 5))
+    >>> f = x
+    >>> for layer in range(20):
+    ...     f = admath.tanh(f*0.9 + 0.1)
+    >>> h = adoptimize.plan_memory(adgraph.trace(f))
+    >>> print(len(h.plans['evaluate'][1]), len(h.plans['backprop'][1]))
+    1 40
+    >>> print(np.allclose(h.evaluate(), f.val))
+    True
+    """
+    return planned(g)
+
+
+
+class checkpointed(adgraph.graph):
+    """Graph that differentiates in bounded memory by recomputing values instead of storing them.
+
+    The nodes are split, in order, into segments. forward() keeps only the checkpoints: the values used by
+    a later segment, and the output. The reverse sweep runs over one segment at a time, from the last one:
+    it first recomputes the values of the segment from the checkpoints, pushes the adjoints through it,
+    and drops those values again. For a chain of n nodes, storing about sqrt(n) checkpoints and one
+    segment of about sqrt(n) values at a time costs one extra forward sweep; fewer segments keep more
+    values and recompute less. Values that are not checkpoints are None in the list returned by forward().
+    """
+
+    def __init__(self, g, segments=None):
+        super().__init__(list(g.ops), list(g.names), list(g.values), list(g.seeds))
+        self.output = g.output
+        if segments is None:
+            segments = int(np.ceil(np.sqrt(len(self.ops))))
+        if segments < 1:
+            raise ValueError("Error: the number of segments must be at least 1.")
+        size = int(np.ceil(len(self.ops)/segments))
+        self.segments = [range(lo, min(lo + size, len(self.ops))) for lo in range(0, len(self.ops), size)]
+
+        segment_of = [k for k, segment in enumerate(self.segments) for idx in segment]
+        self.checkpoints = set([self.output])
+        for idx, (op, args, params) in enumerate(self.ops):
+            for j in args:
+                if segment_of[j] != segment_of[idx] and self.ops[j][0] != 'input':
+                    self.checkpoints.add(j)
+
+
+    def _dropped(self, idx):
+        """Returns whether forward() drops the value of node idx."""
+        return self.ops[idx][0] != 'input' and idx not in self.checkpoints
+
+
+    def forward(self, values=None):
+        """Same as graph.forward(), keeping only the inputs and checkpoints; other values are left as None."""
+        vals = list(self.values)
+        if values:
+            for key, value in values.items():
+                for idx in self._resolve(key):
+                    vals[idx] = value
+        for segment in self.segments:
+            for idx in segment:
+                op, args, params = self.ops[idx]
+                if op != 'input':
+                    vals[idx] = adgraph._OPS[op][0](*[vals[j] for j in args], **params)
+            for idx in segment:
+                if self._dropped(idx):
+                    vals[idx] = None
+        return vals
+
+
+    def backward(self, vals, seed, wrt=None):
+        """Same as graph.backward(), recomputing the values of each segment from the checkpoints as the reverse sweep reaches it."""
+        names = list(self.leaves) if wrt is None else list(wrt)
+        requires = self._requires(set(idx for name in names for idx in self._resolve(name)))
+        vals = list(vals)
+
+        adj = [None]*len(self.ops)
+        adj[self.output] = adgraph._unbroadcast(seed, np.shape(vals[self.output]))
+        for segment in reversed(self.segments):
+            recomputed = []
+            if any(adj[idx] is not None and requires[idx] for idx in segment):
+                for idx in segment:
+                    op, args, params = self.ops[idx]
+                    if vals[idx] is None:
+                        vals[idx] = adgraph._OPS[op][0](*[vals[j] for j in args], **params)
+                        recomputed.append(idx)
+            # Recomputed values are dropped again once the segment is done
+            freed = {idx:[] for idx in segment}
+            freed[segment[0]] = recomputed
+            self._sweep(vals, adj, requires, segment, freed=freed)
+        return self._leaf_adjoints(names, adj, [np.shape(val) for val in vals])
+
+
+
+def checkpoint(g, segments=None):
+    """Returns a copy of a traced graph whose reverse sweeps store only checkpoints and recompute the rest.
+
+    Use it to differentiate long graphs, such as unrolled iterations or time-stepping loops, on bounded
+    memory: the autodiff instances a graph was traced from can be dropped, and every later forward() and
+    backprop() of the copy holds the checkpoints plus one segment of values at a time.
+
+    INPUTS
+    =======
+    g: graph instance returned by autodiff_graph.trace()
+    segments: number of segments to split the nodes into (about the square root of the number of nodes by default)
+
+    RETURNS
+    ========
+    checkpointed instance, with the same interface as g
+
+    EXAMPLES
+    =========
+    >>> import numpy as np
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_graph as adgraph
+    >>> from autodiffpy import autodiff_optimize as adoptimize
+    >>> x = ad.autodiff('x', [1.0, 2.0])
+    >>> f = x
+    >>> for step in range(50):
+    ...     f = f + f*0.01
+    >>> h = adoptimize.checkpoint(adgraph.trace(f))
+    >>> print(len(h.ops), len(h.segments), len(h.checkpoints))
+    102 11 11
+    >>> print(h.backprop([0, 0])[0]['x'])
+    [2.70481383 5.40962766]
+    """
+    return checkpointed(g, segments)
@@ -0,0 +1,466 @@
+import os
+import pickle
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+from autodiffpy import autodiffmod as autodiff
+from autodiffpy import autodiff_graph as adgraph
+
+
+
+def _tree_reduce(parts, combine):
+    """Combines a list of partial results pairwise, in log2(len(parts)) rounds."""
+    parts = list(parts)
+    while len(parts) > 1:
+        paired = [combine(parts[i], parts[i+1]) for i in range(0, len(parts) - 1, 2)]
+        if len(parts) % 2:
+            paired.append(parts[-1])
+        parts = paired
+    return parts[0]
+
+
+def _combine(a, b):
+    """Adds two (loss sum, gradients) partial results."""
+    return (a[0] + b[0], {name:a[1][name] + b[1][name] for name in a[1]})
+
+
+def _shard_loss_sums(g, y, loss, wrt, values):
+    """Runs the forward and reverse sweeps of g on one shard and returns its (loss sum, gradients, number of samples)."""
+    vals = g.forward(values)
+    total, seed = autodiff._loss_sums(vals[g.output], y, loss)
+    return total, g.backward(vals, seed, wrt), len(y)
+
+
+def _share(arr):
+    """Copies an array into a new shared memory block, and returns the block and an array viewing it."""
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[...] = arr
+    return shm, view
+
+
+def _spec(shm, view):
+    """Returns the few bytes another process needs to attach to a shared array."""
+    return (shm.name, view.shape, view.dtype.str)
+
+
+def _attach(spec):
+    """Attaches to a shared array created by _share() in another process, without copying it."""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _worker_loop(conn, g, data_specs, y_spec, param_specs, out_spec, row, lo, hi, loss, wrt):
+    """Serves gradient requests for the samples lo:hi until it receives b'stop'.
+
+    The data, y_true, the leaves in wrt and the output row all live in shared memory, so a request
+    and its reply are a few bytes each.
+    """
+    blocks = []
+    def attach(spec):
+        shm, arr = _attach(spec)
+        blocks.append(shm)
+        return arr
+
+    values = list(g.values)
+    for idx, spec in data_specs.items():
+        values[idx] = attach(spec)[lo:hi]
+    shard = adgraph.graph(g.ops, g.names, values)
+    y = attach(y_spec)[lo:hi]
+    params = {name:attach(spec) for name, spec in param_specs.items()}
+    out = attach(out_spec)[row]
+
+    while conn.recv_bytes() != b'stop':
+        try:
+            total, grads, num_samples = _shard_loss_sums(shard, y, loss, wrt, params)
+            out[0] = total
+            start = 1
+            for name in wrt:
+                size = params[name].size
+                out[start:start+size] = np.broadcast_to(grads[name], params[name].shape).ravel()
+                start = start + size
+            conn.send_bytes(b'done')
+        except Exception as err:
+            conn.send_bytes(pickle.dumps(err))
+    conn.close()
+
+
+class data_parallel():
+    """Pool of worker processes that each own a shard of the samples of a traced function.
+
+    The per-sample inputs of f (constants, or leaves created with der=None, with one row per entry of y_true) and
+    y_true are copied once into shared memory blocks, and every worker attaches to the contiguous range
+    of samples it owns instead of receiving a copy. The leaves in wrt and the per-worker loss sums and
+    gradients are shared buffers too: backprop() writes the leaf values, sends each worker a few bytes
+    to start, runs the forward and reverse sweeps on every shard in parallel, and tree-reduces the results.
+
+    EXAMPLES
+    =========
+    >>> import numpy as np
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_parallel as adparallel
+    >>> x = np.arange(12.0).reshape(6, 2)
+    >>> w = ad.autodiff('w', [1, -1])
+    >>> with adparallel.data_parallel(w*x, np.ones(6), num_workers=2) as pool:
+    ...     grads, loss_value = pool.backprop({'w': [1, -1]})
+    >>> delta, loss_serial = (w*x).backprop(np.ones(6))
+    >>> print(np.allclose(grads['w'], [np.sum(value) for value in delta['w']]), loss_value == loss_serial)
+    True True
+    """
+
+    def __init__(self, f, y_true, num_workers=None, loss='MSE', wrt=None):
+        if wrt is None:
+            wrt = ['w']
+        g = f if isinstance(f, adgraph.graph) else adgraph.trace(f)
+        y_true = np.atleast_1d(np.asarray(y_true, dtype=float))
+        num_samples = y_true.shape[0]
+        data = g.sample_inputs(num_samples)
+        if not data:
+            raise ValueError("Error: could not find data with one row per entry of y_true to shard.")
+        if loss not in ('MSE', 'MAE', 'RMSE'):
+            raise ValueError("Error: loss must be one of 'MSE', 'MAE', or 'RMSE'.")
+
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(1, min(num_workers, num_samples))
+
+        self.loss = loss
+        self.wrt = list(wrt)
+        self.num_samples = num_samples
+        self.workers = []
+        self._blocks = []
+        self._params = {}
+
+        def share(arr):
+            shm, view = _share(arr)
+            self._blocks.append(shm)
+            return view, _spec(shm, view)
+
+        try:
+            # The workers get the graph without its data; they attach to the shared copies instead
+            skeleton = list(g.values)
+            data_specs = {}
+            for idx in data:
+                view, data_specs[idx] = share(g.values[idx])
+                skeleton[idx] = None
+            y_view, y_spec = share(y_true)
+            param_specs = {}
+            for name in self.wrt:
+                self._params[name], param_specs[name] = share(np.asarray(g.values[g._resolve(name)[0]], dtype=float))
+            width = 1 + sum(self._params[name].size for name in self.wrt)
+            self._out, out_spec = share(np.zeros((num_workers, width)))
+            skeleton = adgraph.graph(g.ops, g.names, skeleton)
+
+            bounds = np.linspace(0, num_samples, num_workers + 1).astype(int)
+            for row, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])):
+                parent_conn, child_conn = multiprocessing.Pipe()
+                args = (child_conn, skeleton, data_specs, y_spec, param_specs, out_spec, row, lo, hi, loss, self.wrt)
+                proc = multiprocessing.Process(target=_worker_loop, args=args, daemon=True)
+                proc.start()
+                child_conn.close()
+                self.workers.append((proc, parent_conn))
+        except BaseException:
+            self.close()
+            raise
+
+
+    def backprop(self, values=None):
+        """Returns the gradient of the loss over all shards with respect to the leaves in wrt, and the loss itself.
+
+        INPUTS
+        =======
+        values: dictionary of leaf values (keyed by leaf name) to use for this and later calls, typically the current weights
+
+        RETURNS
+        ========
+        tuple of a dictionary mapping each leaf name in wrt to its gradient, and the loss value
+        """
+        for name, value in (values or {}).items():
+            if name not in self._params:
+                raise KeyError(f"Error: variable '{name}' is not differentiated by this pool.")
+            self._params[name][...] = value
+
+        try:
+            for proc, conn in self.workers:
+                conn.send_bytes(b'grad')
+            replies = [conn.recv_bytes() for proc, conn in self.workers]
+        except (EOFError, OSError):
+            # A worker died without replying: the others cannot cover its shard, so stop them all
+            for proc, conn in self.workers:
+                proc.terminate()
+            self.close()
+            raise RuntimeError("Error: a worker process of the pool exited unexpectedly; the pool has been closed.")
+        for reply in replies:
+            if reply != b'done':
+                raise pickle.loads(reply)
+
+        out = self._out.copy()
+        parts = []
+        for row in out:
+            grads = {}
+            start = 1
+            for name in self.wrt:
+                size = self._params[name].size
+                grads[name] = row[start:start+size].reshape(self._params[name].shape)
+                start = start + size
+            parts.append((row[0], grads))
+        total, grads = _tree_reduce(parts, _combine)
+        return autodiff._finish_loss(total, grads, self.num_samples, self.loss)
+
+
+    def close(self):
+        """Stops the worker processes and frees the shared memory."""
+        for proc, conn in self.workers:
+            try:
+                conn.send_bytes(b'stop')
+                conn.close()
+            except (OSError, BrokenPipeError):
+                pass
+        for proc, conn in self.workers:
+            proc.join()
+        self.workers = []
+
+        # Views of the blocks must be dropped before the blocks can be closed
+        self._params = {}
+        self._out = None
+        for shm in self._blocks:
+            shm.close()
+            shm.unlink()
+        self._blocks = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _graph_descent(g, y, loss, beta, max_iter, tol, w0):
+    """Runs gradient descent on the weights 'w' of a traced graph from the starting weights w0."""
+    w = np.asarray(w0, dtype=float)
+    loss_values = []
+    i = 0
+    loss_v = np.inf
+    while i<max_iter and loss_v>tol:
+        delta, loss_v = g.backprop(y, loss=loss, wrt=['w'], values={'w':w})
+        loss_values.append(loss_v)
+        w = w - beta*delta['w']
+        i=i+1
+    return w, loss_values
+
+
+_multistart_state = {}
+
+def _multistart_init(g, data_specs, y_spec, settings):
+    """Attaches a pool worker to the shared data of a multi-start run."""
+    blocks = []
+    values = list(g.values)
+    for idx, spec in data_specs.items():
+        shm, values[idx] = _attach(spec)
+        blocks.append(shm)
+    shm, y = _attach(y_spec)
+    blocks.append(shm)
+    _multistart_state.update(g=adgraph.graph(g.ops, g.names, values), y=y, settings=settings, blocks=blocks)
+
+
+def _multistart_task(w0):
+    """Runs one start of a multi-start run in a pool worker."""
+    state = _multistart_state
+    loss, beta, max_iter, tol = state['settings']
+    return _graph_descent(state['g'], state['y'], loss, beta, max_iter, tol, w0)
+
+
+def _multistart_processes(g, y_true, starts, loss, beta, max_iter, tol, num_workers):
+    """Runs every start on a pool of worker processes that share the data of g."""
+    blocks = []
+    try:
+        skeleton = list(g.values)
+        data_specs = {}
+        for idx in g.sample_inputs(y_true.shape[0]):
+            shm, view = _share(g.values[idx])
+            blocks.append(shm)
+            data_specs[idx] = _spec(shm, view)
+            skeleton[idx] = None
+        shm, view = _share(y_true)
+        blocks.append(shm)
+        y_spec = _spec(shm, view)
+        del view
+
+        initargs = (adgraph.graph(g.ops, g.names, skeleton), data_specs, y_spec, (loss, beta, max_iter, tol))
+        with multiprocessing.Pool(num_workers, initializer=_multistart_init, initargs=initargs) as pool:
+            results = pool.map(_multistart_task, list(starts), chunksize=1)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return [w for w, curve in results], [curve for w, curve in results]
+
+
+def _multistart_vectorized(g, y_true, starts, loss, beta, max_iter, tol):
+    """Runs every start at once in this process, with the starting points stacked along a leading batch axis of 'w'."""
+    W = np.array(starts, dtype=float)
+    curves = [[] for start in W]
+    active = np.arange(W.shape[0])
+    i = 0
+    while i<max_iter and active.size:
+        vals = g.forward({'w':W[active]})
+        loss_v, d_loss = autodiff._loss(vals[g.output], y_true, loss)
+        delta = g.backward(vals, d_loss, ['w'])
+        W[active] = W[active] - beta*delta['w']
+        for k, value in zip(active, loss_v):
+            curves[k].append(value)
+        active = active[~(loss_v <= tol)]
+        i=i+1
+    return list(W), curves
+
+
+def multistart(f, y_true, starts, loss='MSE', beta=0.01, max_iter=10000, tol=10**(-8), num_workers=None, vectorize=False):
+    """Runs gradient descent from several starting weights and returns the best run, to escape the local minima of non-convex fits.
+
+    By default every start runs in its own task on a pool of worker processes that attach to one shared
+    copy of the data, so N starts take about as long as one on an N-core machine. With vectorize=True the
+    starts run in this process instead, stacked along a leading batch axis of the weights, so every
+    operation is applied to all starts at once; the model must then broadcast over that axis.
+
+    INPUTS
+    =======
+    f: autodiff instance with weights named 'w'
+    y_true: desired outputs
+    starts: list or 2D array with one starting weight vector per row
+    loss: string name of the desired loss function; allowed types are ['MSE', 'MAE', 'RMSE']
+    beta: learning rate (constant)
+    max_iter: maximum allowed number of iterations per start
+    tol: minimum desired loss for the function
+    num_workers: number of worker processes (all cores by default)
+    vectorize: run the starts as one batch in this process instead of on worker processes
+
+    RETURNS
+    ========
+    dictionary containing the following keys and values:
+       'f': the function autodiff instance at the best final weights
+       'w': the best final weights (the weight autodiff instance of f)
+       'loss_array': the losses of the best start for all of its iterations
+       'num_iter': number of iterations of the best start
+       'best': index of the best start
+       'w_array': array of the final weights of every start
+       'loss_arrays': list of the loss arrays of every start
+
+    EXAMPLES
+    =========
+    >>> import numpy as np
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_parallel as adparallel
+    >>> x = np.array([[1.0], [2.0], [3.0]])
+    >>> w = ad.autodiff('w', [0.0])
+    >>> f = admath.sin(w*x)
+    >>> y_true = np.sin(2.5*x[:, 0])
+    >>> res = adparallel.multistart(f, y_true, [[0.0], [1.0], [2.0], [3.0]], beta=0.1, max_iter=500, vectorize=True)
+    >>> print(np.round(res['w'].val, 2), [len(curve) for curve in res['loss_arrays']])
+    [2.5] [500, 500, 47, 60]
+    """
+    w = autodiff._find_weights(f)
+    g = adgraph.trace(f)
+    y_true = np.atleast_1d(np.asarray(y_true, dtype=float))
+    if loss not in ('MSE', 'MAE', 'RMSE'):
+        raise ValueError("Error: loss must be one of 'MSE', 'MAE', or 'RMSE'.")
+
+    if vectorize:
+        finals, curves = _multistart_vectorized(g, y_true, starts, loss, beta, max_iter, tol)
+    else:
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        finals, curves = _multistart_processes(g, y_true, starts, loss, beta, max_iter, tol, max(1, min(num_workers, len(starts))))
+
+    # The last recorded loss of each start is that of its weights before the final update, so compare final weights directly
+    final_losses = [g.backprop(y_true, loss=loss, wrt=['w'], values={'w':final})[1] for final in finals]
+    best = int(np.nanargmin(final_losses))
+
+    w.val = finals[best]
+    f = f.forwardprop()
+    return {"f":f, "w":w, "loss_array":curves[best], "num_iter":len(curves[best]), "best":best,
+            "w_array":np.asarray(finals), "loss_arrays":curves}
+
+
+_jacobian_state = {}
+
+def _jacobian_init(payload, out_spec, order):
+    """Unpickles the graph of a parallel Jacobian in a pool worker, evaluates it once, and attaches to the shared output."""
+    g = pickle.loads(payload)
+    shm, out = _attach(out_spec)
+    _jacobian_state.update(g=g, vals=g.forward(), out=out, order=order, blocks=[shm])
+
+
+def _jacobian_task(bounds):
+    """Writes the Jacobian rows lo:hi into the shared output from a pool worker."""
+    state = _jacobian_state
+    lo, hi = bounds
+    state['out'][lo:hi] = state['g'].jacobian(state['vals'], state['order'][lo:hi])
+
+
+def parallel_jacobian(f, order=None, num_workers=None, block_size=None):
+    """Returns the same dictionary as f.jacobian(), built on worker processes for functions of many variables.
+
+    f is traced once and the graph is pickled to a pool of workers. The variables are split into seed blocks
+    of block_size names; a worker evaluates the graph once and then computes the partials of a whole block
+    in a single forward-mode sweep, writing its rows straight into a preallocated shared output array.
+
+    INPUTS
+    =======
+    f: autodiff instance
+    order: list of variable names giving the row order (the names in alphabetical order by default)
+    num_workers: number of worker processes (all cores by default); 1 computes every block in this process
+    block_size: number of variables per seed block (about four blocks per worker by default)
+
+    RETURNS
+    ========
+    dictionary containing array representation (under key "jacobian") and the ordering of the variables (under key "order")
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_parallel as adparallel
+    >>> x = ad.autodiff('x', 3)
+    >>> y = ad.autodiff('y', 4)
+    >>> resdict = adparallel.parallel_jacobian(admath.sqrt(x*y), order=['y', 'x'], num_workers=2)
+    >>> print(resdict["order"], resdict["jacobian"][0], resdict['jacobian'][1])
+    ['y', 'x'] [0.4330127] [0.57735027]
+    """
+    g = adgraph.trace(f)
+    if order is None:
+        order = sorted(g.leaves)
+    else:
+        order = list(order)
+        if any(name not in g.leaves for name in order):
+            raise KeyError("Error: variable(s) in order have not been encountered by this autodiff instance.")
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(order)))
+    if block_size is None:
+        block_size = -(-len(order)//(4*num_workers))
+    bounds = [(lo, min(lo + block_size, len(order))) for lo in range(0, len(order), max(1, block_size))]
+    shape = (len(order),) + np.shape(f.val)
+
+    if num_workers == 1:
+        jacobian = np.empty(shape)
+        vals = g.forward()
+        for lo, hi in bounds:
+            jacobian[lo:hi] = g.jacobian(vals, order[lo:hi])
+        return {"jacobian":jacobian, "order":order}
+
+    shm, out = _share(np.empty(shape))
+    try:
+        initargs = (pickle.dumps(g), _spec(shm, out), order)
+        with multiprocessing.Pool(num_workers, initializer=_jacobian_init, initargs=initargs) as pool:
+            pool.map(_jacobian_task, bounds, chunksize=1)
+        jacobian = np.array(out)
+    finally:
+        del out
+        shm.close()
+        shm.unlink()
+    return {"jacobian":jacobian, "order":order}
@@ -0,0 +1,238 @@
+import json
+import asyncio
+import numpy as np
+from autodiffpy import autodiff_graph as adgraph
+
+
+
+class gradient_service():
+    """Serves values and derivatives of a fixed autodiff model to many concurrent clients.
+
+    Each request gives a few points as one array per input leaf. Requests that arrive within window
+    seconds of each other are concatenated along the value axis, evaluated with one forward and one
+    reverse sweep of the traced model, and split back into one result per request. The sweeps run on
+    a worker thread, so the event loop keeps collecting the next batch while one is being computed.
+    Leaves not named in inputs keep the values they were traced with.
+
+    INPUTS
+    =======
+    f: autodiff instance, elementwise in its inputs along the value axis
+    inputs: names of the leaves every request supplies (all leaves by default)
+    window: seconds to wait for more requests after the first one of a batch
+    max_batch: number of points after which a batch is evaluated without taking more requests
+
+    EXAMPLES
+    =========
+    >>> import asyncio
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> from autodiffpy import autodiff_service as adservice
+    >>> x = ad.autodiff('x', 0.0)
+    >>> y = ad.autodiff('y', 0.0)
+    >>> async def clients(f):
+    ...     async with adservice.gradient_service(f) as service:
+    ...         results = await asyncio.gather(service.evaluate({'x': [0.0, 1.0], 'y': [2.0, 2.0]}), service.evaluate({'x': 3.0, 'y': 1.0}))
+    ...         return results, service.num_batches
+    >>> results, num_batches = asyncio.run(clients(x*y + admath.sin(x)))
+    >>> print(results[0]['val'], results[0]['der']['x'], results[1]['val'], num_batches)
+    [0.         2.84147098] [3.         2.54030231] [3.14112001] 1
+    """
+
+    def __init__(self, f, inputs=None, window=0.002, max_batch=4096):
+        self.graph = adgraph.trace(f)
+        self.inputs = list(self.graph.leaves) if inputs is None else list(inputs)
+        for name in self.inputs:
+            self.graph._resolve(name)
+        self.window = window
+        self.max_batch = max_batch
+        self.num_batches = 0
+        self._queue = None
+        self._batcher = None
+        self._batch = []
+
+
+    def start(self):
+        """Starts collecting requests on the running event loop."""
+        if self._batcher is None:
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.get_running_loop().create_task(self._collect())
+
+
+    async def close(self):
+        """Stops the service; requests still waiting for a batch, or in the batch being computed, are cancelled."""
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+            for request in self._batch:
+                request[3].cancel()
+            self._batch = []
+            while not self._queue.empty():
+                self._queue.get_nowait()[3].cancel()
+            self._batcher = None
+
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+    def _check(self, point):
+        """Returns the arrays of a request and its number of points, or raises an error for a malformed request."""
+        if set(point) != set(self.inputs):
+            raise KeyError(f"Error: requests must give exactly the inputs {self.inputs}.")
+        arrays = {name:np.atleast_1d(np.asarray(point[name], dtype=float)) for name in self.inputs}
+        sizes = set(arr.shape[0] for arr in arrays.values())
+        if len(sizes) != 1 or any(arr.ndim != 1 for arr in arrays.values()):
+            raise ValueError("Error: every input of a request must be a 1D array of the same length.")
+        return arrays, sizes.pop()
+
+
+    async def evaluate(self, point, grad=True):
+        """Returns the value of the model at the given points, and its derivatives with respect to the inputs.
+
+        INPUTS
+        =======
+        point: dictionary mapping every input name to a number or 1D array of values
+        grad: whether to return derivatives
+
+        RETURNS
+        ========
+        dictionary holding the values (under key "val") and, if grad, a dictionary of the derivatives with respect to each input (under key "der")
+        """
+        arrays, size = self._check(point)
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((arrays, size, grad, future))
+        return await future
+
+
+    async def _collect(self):
+        """Gathers queued requests into batches and evaluates them one batch at a time.
+
+        The batch being gathered or computed is kept in self._batch, so close() can cancel its requests.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = []
+            batch = self._batch
+            batch.append(await self._queue.get())
+            size = batch[0][1]
+            await asyncio.sleep(self.window)
+            while size < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                size = size + batch[-1][1]
+            batch[:] = [request for request in batch if not request[3].cancelled()]
+            if not batch:
+                continue
+            try:
+                results = await loop.run_in_executor(None, self._compute, batch)
+            except Exception as err:
+                for request in batch:
+                    if not request[3].done():
+                        request[3].set_exception(err)
+                continue
+            self.num_batches = self.num_batches + 1
+            for request, result in zip(batch, results):
+                if not request[3].done():
+                    request[3].set_result(result)
+
+
+    def _compute(self, batch):
+        """Evaluates a batch of requests with one forward and one reverse sweep, and splits the results per request."""
+        g = self.graph
+        values = {name:np.concatenate([arrays[name] for arrays, size, grad, future in batch]) for name in self.inputs}
+        total = sum(size for arrays, size, grad, future in batch)
+        vals = g.forward(values)
+        out = np.broadcast_to(vals[g.output], (total,))
+        grads = None
+        if any(grad for arrays, size, grad, future in batch):
+            # The model is elementwise along the value axis, so the gradient of the sum of its
+            # values holds the derivative of every point with respect to its own inputs
+            grads = {name:np.broadcast_to(grad, (total,)) for name, grad in g.backward(vals, np.ones(total), self.inputs).items()}
+
+        results = []
+        lo = 0
+        for arrays, size, grad, future in batch:
+            result = {"val":np.array(out[lo:lo+size])}
+            if grad:
+                result["der"] = {name:np.array(grads[name][lo:lo+size]) for name in self.inputs}
+            results.append(result)
+            lo = lo + size
+        return results
+
+
+    async def serve(self, host='127.0.0.1', port=0):
+        """Starts answering requests over a local socket, and returns the asyncio server.
+
+        Each request is one line of JSON mapping the inputs to values, with an optional "grad" key; each reply
+        is one line of JSON with the keys "val" and "der", or "error" if the request could not be evaluated.
+        """
+        self.start()
+        return await asyncio.start_server(self._handle, host, port)
+
+
+    async def _handle(self, reader, writer):
+        """Answers the requests of one socket connection in order."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    point = json.loads(line)
+                    grad = bool(point.pop("grad", True))
+                    result = await self.evaluate(point, grad)
+                    reply = {"val":result["val"].tolist()}
+                    if grad:
+                        reply["der"] = {name:der.tolist() for name, der in result["der"].items()}
+                except Exception as err:
+                    reply = {"error":str(err)}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+
+class service_client():
+    """Client for a gradient_service served over a socket; create it with connect()."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self._lock = asyncio.Lock()
+
+
+    async def evaluate(self, point, grad=True):
+        """Same as gradient_service.evaluate(), through the socket."""
+        request = {name:np.atleast_1d(value).tolist() for name, value in point.items()}
+        request["grad"] = grad
+        async with self._lock:
+            self.writer.write(json.dumps(request).encode() + b"\n")
+            await self.writer.drain()
+            reply = json.loads(await self.reader.readline())
+        if "error" in reply:
+            raise ValueError(reply["error"])
+        result = {"val":np.asarray(reply["val"])}
+        if grad:
+            result["der"] = {name:np.asarray(der) for name, der in reply["der"].items()}
+        return result
+
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+
+async def connect(host, port):
+    """Opens a connection to a gradient_service served with serve(), and returns a service_client."""
+    reader, writer = await asyncio.open_connection(host, port)
+    return service_client(reader, writer)
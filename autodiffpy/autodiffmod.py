@@ -1,7 +1,202 @@
+import threading
+import itertools
 import numpy as np
 import pandas as pd
+from collections import deque
 #from autodiff_math import *
 from autodiffpy.autodiff_math import *
+from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_graph as adgraph
+from autodiffpy import autodiff_parallel as adparallel
+
+_grad_state = threading.local()
+
+# Stamps every assignment to a val attribute, so re-evaluation can tell which nodes are out of date
+_clock = itertools.count()
+
+def grad_enabled():
+    """Returns whether operations in this thread record derivatives and parents (True unless disabled, see no_grad)."""
+    return getattr(_grad_state, 'enabled', True)
+
+
+def set_grad_enabled(enabled):
+    """Turns the recording of derivatives and parents on or off for this thread, and returns the previous setting."""
+    previous = grad_enabled()
+    _grad_state.enabled = bool(enabled)
+    return previous
+
+
+class no_grad():
+    """Context manager under which operations on autodiff instances compute values only.
+
+    Results carry no derivatives, parents or partial derivatives, which saves their memory and most of the
+    work of every operation when only values are needed, for example when scoring a trained model. The
+    setting is per thread, and the previous one is restored on exit.
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> x = ad.autodiff('x', [1, 2])
+    >>> with ad.no_grad():
+    ...     f = admath.exp(x)*2 + x
+    >>> print(f.val, f.der, f.lparent)
+    [ 6.43656366 16.7781122 ] {} None
+    """
+
+    def __enter__(self):
+        self.previous = set_grad_enabled(False)
+        return self
+
+
+    def __exit__(self, *args):
+        set_grad_enabled(self.previous)
+
+
+def _keys(*ders):
+    """Returns the variables an operation on operands with the given derivative dictionaries propagates derivatives for."""
+    keys = np.unique([key for der in ders for key in der]) if len(ders) > 1 else list(ders[0])
+    wanted = getattr(_grad_state, 'wrt', None)
+    if wanted is None:
+        return keys
+    return [key for key in keys if key in wanted]
+
+
+class wrt():
+    """Context manager under which operations only propagate derivatives with respect to the named variables.
+
+    Forward-mode derivatives of every other variable (data leaves, constants wrapped as autodiff instances)
+    are skipped, so the cost of each operation scales with the variables of interest rather than with every
+    leaf. Values and backpropagation are unaffected. To leave a single leaf out instead, create it with
+    der=None. The setting is per thread, and the previous one is restored on exit.
+
+    INPUTS
+    =======
+    names: name or list of names of the variables to propagate derivatives for
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> w = ad.autodiff('w', 2)
+    >>> x = ad.autodiff('x', 3)
+    >>> with ad.wrt('w'):
+    ...     f = admath.exp(w*x) + x
+    >>> print(f.der['w'], 'x' in f.der)
+    [1210.28638048] False
+    """
+
+    def __init__(self, names):
+        self.names = set([names] if isinstance(names, str) else names)
+
+
+    def __enter__(self):
+        self.previous = getattr(_grad_state, 'wrt', None)
+        _grad_state.wrt = self.names
+        return self
+
+
+    def __exit__(self, *args):
+        _grad_state.wrt = self.previous
+
+
+def lazy_enabled():
+    """Returns whether operations in this thread only record the graph (see lazy)."""
+    return getattr(_grad_state, 'lazy', False)
+
+
+class lazy():
+    """Context manager under which operations on autodiff instances only record the expression graph.
+
+    Every result is a deferred instance: its value and derivatives are computed the first time they are
+    used, from the whole traced graph at once, and only the derivatives asked for through jacobian(order)
+    are computed. Using a deferred instance outside this context evaluates it and carries on eagerly.
+    The setting is per thread, and the previous one is restored on exit.
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> from autodiffpy import autodiff_math as admath
+    >>> x = ad.autodiff('x', 3)
+    >>> y = ad.autodiff('y', 4)
+    >>> with ad.lazy():
+    ...     f = admath.sqrt(x*y) + admath.log(y, base=2)
+    >>> print(type(f).__name__, f.shape)
+    deferred (1,)
+    >>> resdict = f.jacobian(order=['x'])
+    >>> print(resdict["order"], resdict["jacobian"][0], f.val)
+    ['x'] [0.57735027] [5.46410162]
+    """
+
+    def __enter__(self):
+        self.previous = lazy_enabled()
+        _grad_state.lazy = True
+        return self
+
+
+    def __exit__(self, *args):
+        _grad_state.lazy = self.previous
+
+
+def _shape_of(x):
+    """Returns the shape of the value of an operand, without evaluating deferred instances."""
+    if isinstance(x, deferred):
+        return x.shape
+    return np.shape(x.val) if isinstance(x, autodiff) else np.shape(x)
+
+
+def _value(other):
+    """Returns the value of an operand: its val if it is an autodiff instance, else the operand itself."""
+    return other.val if isinstance(other, autodiff) else other
+
+
+def _value_only(name, val):
+    """Returns the autodiff instance an operation computes under no_grad: its value, without derivatives or parents."""
+    result = autodiff(name, val, None)
+    result.no_grad = True
+    return result
+
+
+def _loss(val, y_true, loss):
+    """Returns the value of the named loss function ('MSE', 'MAE' or 'RMSE') and its derivative with respect to val.
+
+    Any leading axes of val beyond those of y_true are independent batches, each with its own loss value.
+    """
+    y_true = np.atleast_1d(np.asarray(y_true))
+    if loss == 'MSE':
+        d_loss = (2/y_true.shape[0]*(val-y_true))
+        loss_value = (1/y_true.shape[0])*np.sum((val-y_true)**2, axis=-1)
+    elif loss == 'MAE':
+        d_loss = np.where(val-y_true>=0, 1/y_true.shape[0], -1/y_true.shape[0])
+        loss_value = (1/y_true.shape[0])*np.sum(np.absolute((val-y_true)), axis=-1)
+    elif loss == 'RMSE':
+        d_loss = (1/y_true.shape[0])**(-0.5)*(val-y_true)/(np.sum((val-y_true)**2, axis=-1, keepdims=True))
+        loss_value = ((1/y_true.shape[0])*np.sum((val-y_true)**2, axis=-1))**(0.5)
+    else:
+        raise ValueError("Error: loss must be one of 'MSE', 'MAE', or 'RMSE'.")
+    return loss_value, d_loss
+
+
+def _loss_sums(val, y, loss):
+    """Returns the sum over a subset of samples that the named loss is built from, and the per-sample adjoint seed of that sum."""
+    r = val - y
+    if loss == 'MSE':
+        return np.sum(r**2), 2*r
+    elif loss == 'MAE':
+        return np.sum(np.absolute(r)), np.where(r>=0, 1.0, -1.0)
+    elif loss == 'RMSE':
+        return np.sum(r**2), r
+    raise ValueError("Error: loss must be one of 'MSE', 'MAE', or 'RMSE'.")
+
+
+def _finish_loss(total, grads, num_samples, loss):
+    """Turns statistics summed over subsets of the samples into the loss and gradients backprop() would give on all of them."""
+    if loss == 'RMSE':
+        # Same scaling as the RMSE derivative in _loss()
+        scale = (1/num_samples)**(-0.5)/total
+        return {name:grad*scale for name, grad in grads.items()}, ((1/num_samples)*total)**(0.5)
+    return {name:grad/num_samples for name, grad in grads.items()}, total/num_samples
+
 
 class autodiff():
     def __init__(self,name,val,der=1):
@@ -14,7 +209,11 @@ class autodiff():
         else:
             self.val = np.asarray([val])
 
-        if isinstance(der, np.ndarray):
+        # der=None: a leaf no derivatives are propagated for (data, constants) or a value-only instance (see no_grad);
+        # operations pass their operand's dictionary and fill in their own derivatives
+        if der is None or isinstance(der, dict):
+            self.der = {}
+        elif isinstance(der, np.ndarray):
             self.der = {name:der}
         elif isinstance(der, list):
             self.der = {name:np.asarray(der)}
@@ -25,12 +224,28 @@ class autodiff():
         self.lparent = None
         self.rparent = None
 
-        self.forwardpropcomplete = 'No'
-
         self.function = None
+        self.params = None
+
+        # Partial derivatives of this node with respect to its parents, set once when the node is created
+        self.lpartial = None
+        self.rpartial = None
+        # Set once backprop() has released the graph behind this node
+        self.released = False
+        # Set on the value-only instances operations return under no_grad
+        self.no_grad = False
+
 
-        self.back_der = None
-        self.back_partial_der = None
+    @property
+    def val(self):
+        return self._val
+
+
+    @val.setter
+    def val(self, value):
+        self._val = value
+        # Assigning a new value marks everything computed from this instance before now as out of date
+        self.modified = next(_clock)
 
 
     def __str__(self):
@@ -55,11 +270,15 @@ class autodiff():
 
     def __neg__(self,other=-1):
         """Allows unary operation of autodiff instance."""
+        if grad_enabled() == False:
+            return _value_only(self.name, -self.val)
+        if lazy_enabled():
+            return deferred(self.name, self.__neg__, self)
         anew = autodiff(self.name, -self.val, self.der)
         anew.lparent = self
-        for key in self.der:
+        for key in _keys(self.der):
             anew.der[key] = -1*self.der[key]
-        self.back_partial_der = -1
+        anew.lpartial = -1
         anew.function = self.__neg__
         return anew
 
@@ -74,6 +293,12 @@ class autodiff():
         if isinstance(other, list):
             other = np.asarray(other)
 
+        if grad_enabled() == False:
+            if isinstance(other, np.ndarray) and other.shape != self.val.shape:
+                return _value_only(self.name, np.dot(other, self.val))
+            return _value_only(self.name, self.val*_value(other))
+        if lazy_enabled():
+            return deferred(self.name, self.__mul__, self, other)
 
         anew = autodiff(self.name, self.val, self.der)
 
@@ -89,7 +314,7 @@ class autodiff():
         #assuming that other is autodiff instance
         try:
             anew.val = self.val*other.val
-            for key in np.unique([key for key in self.der] + [key for key in other.der]):
+            for key in _keys(self.der, other.der):
                 if key not in self.der:
                     anew.der[key]=self.val*(other.der[key])
                 elif key not in other.der:
@@ -98,8 +323,8 @@ class autodiff():
                     anew.der[key]=(self.der[key])*other.val+(other.der[key])*self.val
 
             #set the back partial derivatives that can be used for backpropagation
-            self.back_partial_der = other.val
-            other.back_partial_der = self.val
+            anew.lpartial = other.val
+            anew.rpartial = self.val
 
 
         # if 'other' is not autodiff instance
@@ -107,9 +332,9 @@ class autodiff():
             # assuming that 'other' is a valid constant
             if isinstance(other, (int,float)):
                 anew.val = self.val*other
-                for key in self.der:
+                for key in _keys(self.der):
                     anew.der[key] = other*self.der[key]
-                self.back_partial_der = other
+                anew.lpartial = other
 
             else:
                 other = np.asarray(other)
@@ -118,7 +343,7 @@ class autodiff():
                 else:
                     anew.val = self.val*other
 
-                for key in self.der:
+                for key in _keys(self.der):
                     anew.der[key] = other
                     #anew.der[key] = np.dot(other,self.der[key])
                 try:
@@ -130,7 +355,7 @@ class autodiff():
 
                     fder = other
 
-                self.back_partial_der = fder
+                anew.lpartial = fder
 
         return anew
 
@@ -143,18 +368,19 @@ class autodiff():
             raise ValueError("Error: Only integer, float, list, numpy arrays, or autodiff instances can be divided.")
         if isinstance(other,list):
             other = np.asarray(other)
+        if grad_enabled() == False:
+            return _value_only(self.name, self.val/_value(other))
+        if lazy_enabled():
+            return deferred(self.name, self.__truediv__, self, other)
         anew = autodiff(self.name, self.val, self.der)
         anew.lparent = self
         anew.rparent = other
 
         anew.function = self.__truediv__
-        self.back_partial_der = 1/other
         try:
             anew.val = self.val/other.val
-            self.back_partial_der = 1/other
-
 
-            for key in np.unique([key for key in self.der] + [key for key in other.der]):
+            for key in _keys(self.der, other.der):
                 if key not in self.der:
                     anew.der[key]= -self.val*other.der[key]/(other.val**2)
                 elif key not in other.der:
@@ -162,16 +388,16 @@ class autodiff():
                 else:
                     anew.der[key]=0
 
-            self.back_partial_der = 1/other.val
-            other.back_partial_der = -self.val/(other.val**2)
+            anew.lpartial = 1/other.val
+            anew.rpartial = -self.val/(other.val**2)
 
         except AttributeError:
             anew.val = self.val/other
 
-            for key in self.der:
+            for key in _keys(self.der):
                 anew.der[key] = (self.der[key])/other
 
-                self.back_partial_der = 1/other
+            anew.lpartial = 1/other
 
         return anew
 
@@ -183,6 +409,10 @@ class autodiff():
             raise ValueError("Error: Only integer, float, list, numpy arrays, or autodiff instances can be divided.")
         if isinstance(other,(list,float,int)):
             other = np.asarray(other)
+        if grad_enabled() == False:
+            return _value_only(self.name, other/self.val)
+        if lazy_enabled():
+            return deferred(self.name, self.__rtruediv__, self, other)
 
         anew = autodiff(self.name, self.val, self.der)
         anew.lparent = self
@@ -192,11 +422,11 @@ class autodiff():
         anew.function=self.__rtruediv__
         if isinstance(other, (int,float,list,np.ndarray)):
 
-            for key in self.der:
+            for key in _keys(self.der):
                 anew.der[key] = -other*(self.der[key])/self.val**2
 
             anew.val = other/self.val
-            self.back_partial_der = -1*(self.val**2)
+            anew.lpartial = -other/self.val**2
 
             return anew
 
@@ -206,7 +436,10 @@ class autodiff():
 
         if isinstance(other, (int, float, autodiff, list, np.ndarray)) == False:
             raise ValueError("Error: Only integer, float, list, numpy arrays, or autodiff instances can be added.")
-
+        if grad_enabled() == False:
+            return _value_only(self.name, self.val + _value(other))
+        if lazy_enabled():
+            return deferred(self.name, self.__add__, self, other)
 
         #Generate a new autodiff instance copy of self
         anew = autodiff(self.name, self.val, self.der)
@@ -224,7 +457,7 @@ class autodiff():
             anew.val = self.val + other.val
 
             #Calculate derivatives of this addition for all variables so far encountered
-            for key in np.unique([key for key in self.der] + [key for key in other.der]): #Iterate through all unique variables so far encountered
+            for key in _keys(self.der, other.der): #Iterate through all unique variables so far encountered
                 #If self has not encountered this variable before (so derivative of self with respect to variable must be 0)
                 if key not in self.der:
                     anew.der[key] = other.der[key]
@@ -237,17 +470,17 @@ class autodiff():
                 else:
                     anew.der[key] = self.der[key] + other.der[key]
 
-            self.back_partial_der = 1
-            other.back_partial_der = 1
+            anew.lpartial = 1
+            anew.rpartial = 1
 
         #Otherwise, if not two autodiff instances:
         except AttributeError:
             #Tries adding autodiff instance and number together
 
-            for key in self.der:
+            for key in _keys(self.der):
                 anew.der[key] = self.der[key]
-                anew.val = other + self.val
-            self.back_partial_der = 1
+            anew.val = other + self.val
+            anew.lpartial = 1
 
         #Returns new autodiff instance
         return anew
@@ -264,6 +497,10 @@ class autodiff():
     def __sub__(self, other):
         if isinstance(other, (int, float, autodiff, list, np.ndarray)) == False:
             raise ValueError("Error: Only integer, float, list, numpy arrays, or autodiff instances can be subtracted.")
+        if grad_enabled() == False:
+            return _value_only(self.name, self.val - _value(other))
+        if lazy_enabled():
+            return deferred(self.name, self.__sub__, self, other)
 
         #Generate a new autodiff instance copy of self
         anew = autodiff(self.name, self.val, self.der)
@@ -280,7 +517,7 @@ class autodiff():
             anew.val = self.val - other.val
 
             #Calculate derivatives of this subtraction for all variables so far encountered
-            for key in np.unique([key for key in self.der] + [key for key in other.der]): #Iterate through all unique variables so far encountered
+            for key in _keys(self.der, other.der): #Iterate through all unique variables so far encountered
                 #If self has not encountered this variable before (so derivative of self with respect to variable must be 0)
                 if key not in self.der:
                     anew.der[key] = -1*other.der[key]
@@ -293,19 +530,19 @@ class autodiff():
                 else:
                     anew.der[key] = self.der[key] - other.der[key]
 
-            self.back_partial_der = 1
-            other.back_partial_der = -1
+            anew.lpartial = 1
+            anew.rpartial = -1
         #Otherwise, if not two autodiff instances:
         except AttributeError:
             #Tries subtracting number from autodiff instance
 
-            for key in self.der:
+            for key in _keys(self.der):
                 anew.der[key] = self.der[key]
-                anew.val = self.val - other
+            anew.val = self.val - other
 
-            self.back_partial_der = 1
+            anew.lpartial = 1
         #Returns new autodiff instance
-        self.back_partial_der = 1
+        anew.lpartial = 1
         return anew
 
 
@@ -322,6 +559,10 @@ class autodiff():
 
         if isinstance(other, (int, float, autodiff, list, np.ndarray)) == False:
             raise ValueError("Error: Only integer, float, or autodiff instances can be .")
+        if grad_enabled() == False:
+            return _value_only(self.name, self.val**_value(other))
+        if lazy_enabled():
+            return deferred(self.name, self.__pow__, self, other)
 
         #Generate a new autodiff instance copy of self
         anew = autodiff(self.name, self.val, self.der)
@@ -336,7 +577,7 @@ class autodiff():
             anew.val = self.val**other.val
 
             #Calculate derivatives of this exponentiation for all variables so far encountered
-            for key in np.unique([key for key in self.der] + [key for key in other.der]): #Iterate through all unique variables so far encountered
+            for key in _keys(self.der, other.der): #Iterate through all unique variables so far encountered
                 #If self has not encountered this variable before (so derivative of self with respect to variable must be 0)
                 if key not in self.der:
                     anew.der[key] = anew.val*(np.log(self.val)*other.der[key])
@@ -349,13 +590,13 @@ class autodiff():
                 else:
                     anew.der[key] = anew.val*((np.log(self.val)*other.der[key]) + (other.val*self.der[key]/1.0/self.val))
 
-            self.back_partial_der = other.val*self.val**(other.val-1)
-            other.back_partial_der = (self.val**other.val)*np.log(self.val)
+            anew.lpartial = other.val*self.val**(other.val-1)
+            anew.rpartial = (self.val**other.val)*np.log(self.val)
 
         #Otherwise, if not two autodiff instances:
         except AttributeError:
             #Tries adding autodiff instance and number together
-            for key in self.der:
+            for key in _keys(self.der):
                 if self.der[key].shape == (other*(self.val**(other - 1))).shape:
                     anew.der[key] = other*(self.val**(other - 1))*self.der[key]
                 else:
@@ -363,7 +604,7 @@ class autodiff():
 
 
             anew.val = self.val**other
-            self.back_partial_der = other*self.val**(other-1)
+            anew.lpartial = other*self.val**(other-1)
         #Returns new autodiff instance
         return anew
 
@@ -373,6 +614,10 @@ class autodiff():
     def __rpow__(self, other):
         if isinstance(other, (int, float, autodiff)) == False:
             raise ValueError("Error: Only integer, float, or autodiff instances can be multiplied.")
+        if grad_enabled() == False:
+            return _value_only(self.name, other**self.val)
+        if lazy_enabled():
+            return deferred(self.name, self.__rpow__, self, other)
 
         #Generate a new autodiff instance copy of self
         anew = autodiff(self.name, self.val, self.der)
@@ -380,11 +625,11 @@ class autodiff():
         anew.lparent=self
         anew.rparent=other
         #Tries autodiff instance and number together
-        for key in self.der:
+        for key in _keys(self.der):
             anew.der[key] = (other**self.val)*np.log(other)*self.der[key]
 
         anew.val = other**self.val
-        self.back_partial_der = other**(self.val)*np.log(other)
+        anew.lpartial = other**(self.val)*np.log(other)
         #Return new autodiff instance
         return anew
 
@@ -436,88 +681,90 @@ class autodiff():
         return {"jacobian":jacobian, "order":order}
 
 
-    def backprop(self,y_true, loss = 'MSE', backproplist = None, loss_value = 0):
-        if backproplist == None:
-            if isinstance(y_true,list):
-                y_true = np.asarray(y_true)
-            elif isinstance(y_true, (float, int)):
-                y_true = np.asarray([y_true])
-            elif not isinstance(y_true, np.ndarray):
-                y_true = np.asarray(y_true)
-            backproplist = {}
-
-            if loss == 'MSE':
-                d_loss = (2/y_true.shape[0]*(self.val-y_true))
-                loss_value = (1/y_true.shape[0])*np.sum((self.val-y_true)**2)
-            elif loss == 'MAE':
-                d_loss = []
-                for idx, yt in enumerate(y_true):
-                    if self.val[idx]-yt>=0:
-                        d_loss.append(1/y_true.shape[0])
-                    else:
-                        d_loss.append(-1/y_true.shape[0])
-                d_loss = np.asarray(d_loss)
-                loss_value = (1/y_true.shape[0])*np.sum(np.absolute((self.val-y_true)))
-            elif loss == 'RMSE':
-                d_loss = (1/y_true.shape[0])**(-0.5)*(self.val-y_true)/(np.sum((self.val-y_true)**2))
-                loss_value = ((1/y_true.shape[0])*np.sum((self.val-y_true)**2))**(0.5)
-
-            self.back_der = d_loss
-
-        if self.lparent:
-
-            self.lparent.back_der = self.back_der*self.lparent.back_partial_der
-            self.lparent.backprop(y_true,loss,backproplist, loss_value)
-
-        if isinstance(self.rparent, autodiff):
-
-            self.rparent.back_der = self.back_der*self.rparent.back_partial_der
-            self.rparent.backprop(y_true,loss,backproplist,loss_value)
-
-        if self.lparent is None and self.rparent is None:
-            backproplist[self.name] = self.back_der
+    def backprop(self, y_true, loss = 'MSE', retain_graph = False):
+        """Returns the derivative of the loss with respect to every leaf of this autodiff instance, and the loss itself.
 
+        The adjoints live on a stack local to this call, so several threads can differentiate the same
+        expression at once if they pass retain_graph=True. Otherwise the graph is released afterwards: every
+        node it went through other than the leaves drops its parents and partial derivatives (keeping its val
+        and der), so the intermediate nodes can be garbage collected as soon as nothing else refers to them.
+        A released instance can no longer be backpropagated, forwardpropagated or traced.
+        """
+        if self.released:
+            raise ValueError("Error: the graph of this autodiff instance has been released by backprop(); pass retain_graph=True to keep it.")
+        if self.no_grad:
+            raise ValueError("Error: cannot backpropagate through an autodiff instance computed under no_grad.")
+        loss_value, d_loss = _loss(self.val, y_true, loss)
+        backproplist = {}
+        interior = {}
+        materialized = {}
+        # Visit the left parent before the right one, like a depth-first recursion would
+        stack = [(self, d_loss)]
+        while stack:
+            node, back_der = stack.pop()
+            if isinstance(node, deferred):
+                # A deferred parent of an eager node has no partials: replay it eagerly, once per node
+                node = node.materialize(materialized)
+            if node.released:
+                raise ValueError("Error: this expression depends on a node whose graph has been released by backprop(); pass retain_graph=True when backpropagating expressions that share nodes.")
+            if node.lparent is None and node.rparent is None:
+                # A leaf reached along several paths (or several leaves sharing a name) gets the sum of their adjoints
+                backproplist[node.name] = back_der if node.name not in backproplist else backproplist[node.name] + back_der
+                continue
+            interior[id(node)] = node
+            if isinstance(node.rparent, autodiff):
+                stack.append((node.rparent, back_der*node.rpartial))
+            if node.lparent is not None:
+                stack.append((node.lparent, back_der*node.lpartial))
+
+        if not retain_graph:
+            for node in interior.values():
+                node.lparent, node.rparent = None, None
+                node.lpartial, node.rpartial = None, None
+                node.released = True
         return (backproplist, loss_value)
 
 
-    def forwardprop(self):
-        if self.lparent.lparent is None:
-            self.lparent.forwardpropcomplete = "Yes"
-        if isinstance(self.rparent, autodiff) and self.rparent.lparent is None:
-            self.rparent.forwardpropcomplete = "Yes"
-
-
-        if self.lparent.forwardpropcomplete == 'No':
-            self.lparent=self.lparent.forwardprop()
-
-        if isinstance(self.rparent,autodiff):
-            if self.rparent.forwardpropcomplete == 'Yes':
-                self = self.function(self.rparent)
-
-        if 'mul' in str(self.function):
-            self.function = self.lparent.__mul__
-        elif 'add' in str(self.function):
-            self.function = self.lparent.__add__
-        elif 'sub' in str(self.function):
-            self.function = self.lparent.__sub__
-        elif 'rtruediv' in str(self.function):
-            self.function = self.lparent.__rtruediv__
-        elif 'div' in str(self.function):
-            self.function = self.lparent.__truediv__
-        elif 'rpow' in str(self.function):
-            self.function = self.lparent.__rpow__
-        elif 'pow' in str(self.function):
-            self.function = self.lparent.__pow__
-        elif 'neg' in str(self.function):
-            self.function = self.lparent.__neg__
-
-        if (isinstance(self.rparent, (int,float,list,np.ndarray,autodiff))):
-            self = self.function(self.rparent)
+    def forwardprop(self, rebuilt = None, incremental = False):
+        """Returns a new autodiff instance recomputed from the current values of the leaves of this one.
+
+        Existing nodes are left untouched; rebuilt maps the nodes already recomputed during this call to their
+        new versions, so nodes shared by several branches are recomputed once. With incremental=True, a node is
+        reused as it is when none of its parents was recomputed or assigned a new val after it was computed, so
+        only the part of the graph downstream of modified leaves is recomputed (values changed in place, as in
+        w.val[0] = 1, are not detected).
+        """
+        if self.released:
+            raise ValueError("Error: the graph of this autodiff instance has been released by backprop(); pass retain_graph=True to keep it.")
+        if rebuilt is None:
+            rebuilt = {}
+        if id(self) in rebuilt:
+            return rebuilt[id(self)]
+        # A released parent has lost its own parents, and would otherwise be reused as if it were a leaf
+        for parent in [self.lparent, self.rparent]:
+            if isinstance(parent, autodiff) and parent.released:
+                raise ValueError("Error: this expression depends on a node whose graph has been released by backprop(); pass retain_graph=True when backpropagating expressions that share nodes.")
+
+        lparent = self.lparent if self.lparent.lparent is None else self.lparent.forwardprop(rebuilt, incremental)
+        rparent = self.rparent
+        if isinstance(rparent, autodiff) and rparent.lparent is not None:
+            rparent = rparent.forwardprop(rebuilt, incremental)
+
+        if incremental and lparent is self.lparent and rparent is self.rparent and self._clean():
+            anew = self
+        elif hasattr(self.function, '__self__'): # Operators are rebound to the recomputed left parent
+            method = getattr(lparent, self.function.__name__)
+            anew = method() if self.rparent is None else method(rparent)
         else:
-            self = self.function(self.lparent)
+            anew = self.function(lparent)
 
+        rebuilt[id(self)] = anew
+        return anew
 
-        return self
+
+    def _clean(self):
+        """Returns whether this node was computed after its parents last changed."""
+        return all(parent.modified < self.modified for parent in [self.lparent, self.rparent] if isinstance(parent, autodiff))
 
 
     def weight_update(self,delta,learning_rate):
@@ -530,9 +777,128 @@ class autodiff():
 
 
 
-def gradient_descent(f,y_true, loss = 'MSE', beta= 0.01, max_iter = 10000, tol=10**(-8)):
+class deferred(autodiff):
+    """autodiff instance recorded under lazy mode, whose value and derivatives are computed when first used.
+
+    Only the operation (function and params), its parents and the shape of its value are stored. The first
+    access to val, der or jacobian() traces the graph behind the instance and evaluates it as a whole;
+    derivatives use a single forward-mode sweep over all variables, or reverse sweeps when the output has
+    fewer elements than there are variables. backprop() and forwardprop() replay the expression eagerly.
+    """
+
+    def __init__(self, name, function, lparent, rparent=None, params=None):
+        self.name = name
+        self.function = function
+        self.params = params
+        self.lparent = lparent
+        self.rparent = rparent
+        self.lpartial = None
+        self.rpartial = None
+        self.released = False
+        self.no_grad = False
+        self.wrt = getattr(_grad_state, 'wrt', None)
+
+        op = function.__name__.strip('_')
+        lshape = _shape_of(lparent)
+        if rparent is None:
+            self.shape = lshape
+        elif op == 'mul' and isinstance(rparent, np.ndarray) and rparent.ndim == 2 and rparent.shape != lshape:
+            self.shape = rparent.shape[:1] # Matrix-vector product, see __mul__
+        else:
+            self.shape = np.broadcast_shapes(lshape, _shape_of(rparent))
+        self._val = None
+        self._der = None
+
+
+    def _names(self, g):
+        """Returns the variables this instance has derivatives for: leaves created with a derivative seed, limited by wrt."""
+        return sorted(name for name, idxs in g.leaves.items()
+                      if g.seeds[idxs[0]] is not None and (self.wrt is None or name in self.wrt))
+
+
+    def _forward(self, g):
+        """Returns the values of the nodes of the graph of this instance, checking the domain of each function
+        applied on the way as the eager functions do (see autodiff_math._check_domain)."""
+        vals = g.forward()
+        for op, args, params in g.ops:
+            if op != 'input':
+                admath._check_domain(op, vals[args[0]])
+        return vals
+
+
+    @property
+    def val(self):
+        if self._val is None:
+            g = adgraph.trace(self)
+            self._val = self._forward(g)[g.output]
+        return self._val
+
+
+    @property
+    def der(self):
+        if self._der is None:
+            g = adgraph.trace(self)
+            vals = self._forward(g)
+            self._val = vals[g.output]
+            names = self._names(g)
+            self._der = dict(zip(names, g.jacobian(vals, names)))
+        return self._der
+
+
+    def jacobian(self, order=None):
+        """Same as autodiff.jacobian(), computing only the derivatives with respect to the variables in order."""
+        if order is None or self._der is not None:
+            return autodiff.jacobian(self, order)
+        order = list(order)
+        g = adgraph.trace(self)
+        if any(name not in self._names(g) for name in order):
+            raise KeyError("Error: variable(s) in order have not been encountered by this autodiff instance.")
+        vals = self._forward(g)
+        self._val = vals[g.output]
+        return {"jacobian":np.asarray(g.jacobian(vals, order)), "order":order}
+
+
+    def materialize(self, rebuilt=None):
+        """Returns an eager autodiff instance computed by replaying this expression from the current leaf values."""
+        if rebuilt is None:
+            rebuilt = {}
+        if id(self) in rebuilt:
+            return rebuilt[id(self)]
+        parents = [parent.materialize(rebuilt) if isinstance(parent, deferred) else parent for parent in [self.lparent, self.rparent]]
+        previous = lazy_enabled()
+        _grad_state.lazy = False
+        try:
+            if hasattr(self.function, '__self__'): # Operators are rebound to the replayed left parent
+                method = getattr(parents[0], self.function.__name__)
+                anew = method() if self.rparent is None else method(parents[1])
+            else:
+                anew = self.function(parents[0], **(self.params or {}))
+        finally:
+            _grad_state.lazy = previous
+        rebuilt[id(self)] = anew
+        return anew
+
+
+    def backprop(self, y_true, loss = 'MSE', retain_graph = False):
+        return self.materialize().backprop(y_true, loss, retain_graph)
+
+
+    def forwardprop(self, rebuilt = None, incremental = False):
+        return self.materialize()
+
+
+
+def gradient_descent(f,y_true, loss = 'MSE', beta= 0.01, max_iter = 10000, tol=10**(-8), batch_size = None, seed = None, num_workers = None):
     """Runs gradient descent for the given function, using the specified loss function to calculate loss.
 
+    If batch_size is given, runs mini-batch stochastic gradient descent instead: every data array of f with
+    one row per entry of y_true (constants, or leaves created with der=None) is rebound to the rows of a shuffled
+    mini-batch on each iteration, so an iteration costs O(batch_size) rather than O(len(y_true)). The weights
+    must not follow the sample axis of the data (such as w*x_data with one weight per sample).
+
+    If num_workers is given, the same data arrays and y_true are instead split into one shard per worker
+    process, and every full-batch gradient is computed by the workers in parallel (see autodiff_parallel).
+
     INPUTS
     =======
     f: autodiff instance
@@ -540,7 +906,10 @@ def gradient_descent(f,y_true, loss = 'MSE', beta= 0.01, max_iter = 10000, tol=1
     loss: string name of the desired loss function; allowed types are ['MSE', 'MAE', 'RMSE']
     beta: learning rate (constant)
     max_iter: maximum allowed number of iterations
-    tol: minimum desired loss for the function
+    tol: minimum desired loss for the function (the mini-batch loss when batch_size is given)
+    batch_size: number of samples per mini-batch, or None for full-batch gradient descent
+    seed: seed for shuffling the mini-batches
+    num_workers: number of worker processes to compute the gradient with, or None to compute it in this process
 
     RETURNS
     ========
@@ -563,20 +932,22 @@ def gradient_descent(f,y_true, loss = 'MSE', beta= 0.01, max_iter = 10000, tol=1
     True
     """
     #get w from f
-    j = 0
-    w=f.lparent
-    while j<100 and w.lparent is not None:
-        w = w.lparent
-        j += 1
-    if w.name != 'w':
-        raise ValueError('Could not find weight vector. Be sure to name the weight autodiff as "w"')
+    w = _find_weights(f)
+
+    if batch_size is not None and num_workers is not None:
+        raise ValueError("Error: mini-batches and worker processes cannot be combined.")
+    if batch_size is not None:
+        return _minibatch_descent(f, w, y_true, loss, beta, max_iter, tol, batch_size, seed)
+    if num_workers is not None:
+        return _parallel_descent(f, w, y_true, loss, beta, max_iter, tol, num_workers)
 
     loss_values = []
 
     i = 0
     loss_v = 1
     while i<max_iter and loss_v>tol:
-        backprop_ans = f.backprop(y_true, loss = loss)
+        # The next forwardprop() reuses the nodes the weights do not reach, so the graph is kept
+        backprop_ans = f.backprop(y_true, loss = loss, retain_graph = True)
         delta = backprop_ans[0]
         loss_v = backprop_ans[1]
         loss_values.append(loss_v)
@@ -594,10 +965,309 @@ def gradient_descent(f,y_true, loss = 'MSE', beta= 0.01, max_iter = 10000, tol=1
             l=0.01'''
         w.weight_update(delta['w'],l)
         if loss_v > tol:
-            f = f.forwardprop()
+            f = f.forwardprop(incremental = True)
         i=i+1
 
 
 
 
     return {"f":f,"w":w,"loss_array":loss_values,"num_iter":i}
+
+
+
+def _minibatch_descent(f, w, y_true, loss, beta, max_iter, tol, batch_size, seed):
+    """Mini-batch stochastic gradient descent behind gradient_descent(batch_size=...)."""
+    y_true = np.atleast_1d(np.asarray(y_true))
+    num_samples = y_true.shape[0]
+
+    # Trace once; every step only rebinds the per-sample inputs to the rows of the current batch
+    g = adgraph.trace(f)
+    data = g.sample_inputs(num_samples)
+    if not data:
+        raise ValueError("Error: could not find data with one row per entry of y_true to draw mini-batches from.")
+    # Weights as long as the sample axis of some data, with as many axes, would be sliced with it in every batch
+    if np.ndim(w.val) >= 1 and np.shape(w.val)[0] == num_samples and any(np.ndim(w.val) >= np.ndim(g.values[idx]) for idx in data):
+        raise ValueError("Error: the weights have one entry per sample, so they cannot be combined with mini-batches of the data; use gradient_descent() without batch_size.")
+
+    rng = np.random.RandomState(seed)
+    order = rng.permutation(num_samples)
+    start = 0
+
+    loss_values = []
+    i = 0
+    loss_v = np.inf
+    while i<max_iter and loss_v>tol:
+        if start >= num_samples:
+            order = rng.permutation(num_samples)
+            start = 0
+        batch = order[start:start+batch_size]
+        start = start + batch_size
+
+        values = {idx:g.values[idx][batch] for idx in data}
+        values['w'] = w.val
+        delta, loss_v = g.backprop(y_true[batch], loss=loss, wrt=['w'], values=values)
+        loss_values.append(loss_v)
+        w.val = w.val - beta*delta['w']
+        i=i+1
+
+    f = f.forwardprop()
+    return {"f":f,"w":w,"loss_array":loss_values,"num_iter":i}
+
+
+def _parallel_descent(f, w, y_true, loss, beta, max_iter, tol, num_workers):
+    """Full-batch gradient descent with the gradient computed by data-parallel worker processes."""
+    loss_values = []
+    i = 0
+    loss_v = np.inf
+    with adparallel.data_parallel(f, y_true, num_workers=num_workers, loss=loss, wrt=['w']) as pool:
+        while i<max_iter and loss_v>tol:
+            delta, loss_v = pool.backprop({'w':w.val})
+            loss_values.append(loss_v)
+            w.val = w.val - beta*delta['w']
+            i=i+1
+
+    f = f.forwardprop()
+    return {"f":f,"w":w,"loss_array":loss_values,"num_iter":i}
+
+
+def _find_weights(f):
+    """Walks down the left parents of f to find the weight vector autodiff instance named 'w'."""
+    j = 0
+    w = f.lparent
+    while j<100 and w.lparent is not None:
+        w = w.lparent
+        j += 1
+    if w.name != 'w':
+        raise ValueError('Could not find weight vector. Be sure to name the weight autodiff as "w"')
+    return w
+
+
+def _weight_loss_and_grad(f, w, y_true, loss):
+    """Returns the loss of f and its gradient with respect to the weights w, summed the same way as weight_update()."""
+    delta, loss_v = f.backprop(y_true, loss = loss, retain_graph = True)
+    grad = np.asarray([np.sum(value) for value in delta['w']], dtype=float)
+    return loss_v, grad
+
+
+def _wolfe_zoom(phi, alo, ahi, loss_lo, dphi_lo, loss_hi, loss0, dphi0, c1, c2, max_iter):
+    """Shrinks the bracket [alo, ahi] until a step satisfying the strong Wolfe conditions is found."""
+    for i in range(max_iter):
+        # Minimizer of the quadratic through (alo, loss_lo, dphi_lo) and (ahi, loss_hi), kept away from the ends
+        d = ahi - alo
+        denom = 2*(loss_hi - loss_lo - dphi_lo*d)
+        alpha = alo - dphi_lo*d*d/denom if denom > 0 else alo + 0.5*d
+        if not (min(alo, ahi) + 0.1*abs(d) <= alpha <= max(alo, ahi) - 0.1*abs(d)):
+            alpha = alo + 0.5*d
+
+        loss_a, dphi_a, state = phi(alpha)
+        if not np.isfinite(loss_a) or loss_a > loss0 + c1*alpha*dphi0 or loss_a >= loss_lo:
+            ahi, loss_hi = alpha, loss_a
+        else:
+            if abs(dphi_a) <= -c2*dphi0:
+                return alpha, state
+            if dphi_a*(ahi - alo) >= 0:
+                ahi, loss_hi = alo, loss_lo
+            alo, loss_lo, dphi_lo = alpha, loss_a, dphi_a
+    # Settle for the best point found if it at least decreases the loss
+    if alo > 0:
+        return alo, phi(alo)[2]
+    return None, None
+
+
+def _wolfe_line_search(phi, loss0, dphi0, alpha=1.0, c1=1e-4, c2=0.9, max_iter=20):
+    """Finds a step length along a descent direction satisfying the strong Wolfe conditions.
+
+    phi(alpha) must return (loss, directional derivative, state) at the trial step; the state of the
+    accepted step is returned alongside it, or (None, None) if no acceptable step was found.
+    """
+    alpha_prev, loss_prev, dphi_prev = 0.0, loss0, dphi0
+    for i in range(max_iter):
+        loss_a, dphi_a, state = phi(alpha)
+        if not np.isfinite(loss_a) or loss_a > loss0 + c1*alpha*dphi0 or (i > 0 and loss_a >= loss_prev):
+            return _wolfe_zoom(phi, alpha_prev, alpha, loss_prev, dphi_prev, loss_a, loss0, dphi0, c1, c2, max_iter)
+        if abs(dphi_a) <= -c2*dphi0:
+            return alpha, state
+        if dphi_a >= 0:
+            return _wolfe_zoom(phi, alpha, alpha_prev, loss_a, dphi_a, loss_prev, loss0, dphi0, c1, c2, max_iter)
+        alpha_prev, loss_prev, dphi_prev = alpha, loss_a, dphi_a
+        alpha = 2*alpha
+    return alpha_prev, phi(alpha_prev)[2]
+
+
+def lbfgs(f, y_true, loss = 'MSE', m = 10, max_iter = 1000, tol=10**(-8), gtol=10**(-10)):
+    """Minimizes the loss of the given function with the limited-memory BFGS method and a strong Wolfe line search.
+
+    Only the last m curvature pairs are stored, so memory use is O(m*n) for n weights.
+
+    INPUTS
+    =======
+    f: autodiff instance
+    y_true: desired outputs
+    loss: string name of the desired loss function; allowed types are ['MSE', 'MAE', 'RMSE']
+    m: number of past updates kept to approximate the inverse Hessian
+    max_iter: maximum allowed number of iterations
+    tol: minimum desired loss for the function
+    gtol: the search stops once the norm of the gradient falls below this value
+
+    RETURNS
+    ========
+    dictionary containing the following keys and values:
+       'f': the final function autodiff instance
+       'w': the final weights
+       'loss_array': an array of the loss after each iteration, one entry per iteration (under key 'loss_array')
+       'num_iter': total number of iterations
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> import numpy as np
+    >>> x_data = np.array([[1, 2], [3, 1], [0, 4]])
+    >>> y_true = np.dot(x_data, [2, -1])
+    >>> w = ad.autodiff('w', [1, 1])
+    >>> f1 = w*x_data
+    >>> g = ad.lbfgs(f1, y_true, loss='MSE', tol=1E-10)
+    >>> print(g['loss_array'][-1] <= 1E-10, g['num_iter'] < 20)
+    True True
+    """
+    w = _find_weights(f)
+    w.val = np.asarray(w.val, dtype=float)
+
+    loss_v, grad = _weight_loss_and_grad(f, w, y_true, loss)
+    loss_values = []
+    history = deque(maxlen=m)
+
+    def phi_factory(x, p):
+        def phi(alpha):
+            w.val = x + alpha*p
+            f_trial = f.forwardprop()
+            loss_a, grad_a = _weight_loss_and_grad(f_trial, w, y_true, loss)
+            return loss_a, np.dot(grad_a, p), (loss_a, grad_a, f_trial)
+        return phi
+
+    i = 0
+    while i<max_iter and loss_v>tol and np.linalg.norm(grad)>gtol:
+        # Two-loop recursion for the search direction p = -H*grad
+        q = grad.copy()
+        alphas = []
+        for s, y, rho in reversed(history):
+            a = rho*np.dot(s, q)
+            q = q - a*y
+            alphas.append(a)
+        if history:
+            s, y, rho = history[-1]
+            q = q*(np.dot(s, y)/np.dot(y, y))
+        else:
+            q = q/np.linalg.norm(grad)
+        for (s, y, rho), a in zip(history, reversed(alphas)):
+            b = rho*np.dot(y, q)
+            q = q + s*(a - b)
+        p = -q
+
+        dphi0 = np.dot(grad, p)
+        if dphi0 >= 0:
+            # Not a descent direction; restart from steepest descent
+            history.clear()
+            p = -grad/np.linalg.norm(grad)
+            dphi0 = np.dot(grad, p)
+
+        x = w.val
+        alpha, state = _wolfe_line_search(phi_factory(x, p), loss_v, dphi0)
+        if alpha is None:
+            w.val = x
+            break
+        loss_new, grad_new, f = state
+        w.val = x + alpha*p
+
+        s = w.val - x
+        y = grad_new - grad
+        sy = np.dot(s, y)
+        if sy > 1e-12*np.dot(y, y):
+            history.append((s, y, 1.0/sy))
+
+        loss_v, grad = loss_new, grad_new
+        loss_values.append(loss_v)
+        i = i+1
+
+    return {"f":f,"w":w,"loss_array":loss_values,"num_iter":i}
+
+
+def _newton_system(F, names, x):
+    """Evaluates the system F at the stacked points x (one row per system) and returns the residuals and Jacobians."""
+    variables = [autodiff(name, x[:, k].copy()) for k, name in enumerate(names)]
+    eqs = F(*variables)
+    if isinstance(eqs, (list, tuple)) == False:
+        eqs = [eqs]
+    if len(eqs) != len(names):
+        raise ValueError("Error: the system must have as many equations as variables.")
+
+    num_sys = x.shape[0]
+    Fx = np.empty((num_sys, len(eqs)))
+    J = np.zeros((num_sys, len(eqs), len(names)))
+    for ii, eq in enumerate(eqs):
+        if isinstance(eq, autodiff) == False:
+            raise ValueError("Error: every equation of the system must be an autodiff instance.")
+        Fx[:, ii] = np.broadcast_to(eq.val, (num_sys,))
+        for k, name in enumerate(names):
+            if name in eq.der:
+                J[:, ii, k] = np.broadcast_to(eq.der[name], (num_sys,))
+    return Fx, J
+
+
+def _stacked_solve(J, b):
+    """Solves the stacked linear systems J[i] x[i] = b[i], falling back to least squares if any J[i] is singular."""
+    try:
+        return np.linalg.solve(J, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.matmul(np.linalg.pinv(J), b[..., None])[..., 0]
+
+
+def newton(F, x0, max_iter=50, tol=10**(-10)):
+    """Solves the nonlinear system F(x) = 0 with the Newton-Raphson method.
+
+    Many independent systems of the same form can be solved at once by giving each variable an array of
+    starting values: system i uses the i-th entry of every variable, all systems are stepped together with
+    one stacked linear solve per iteration, and systems that have converged are no longer stepped.
+
+    INPUTS
+    =======
+    F: function taking one autodiff instance per variable (in the order of x0) and returning an autodiff
+       instance, or list of autodiff instances, with one equation per variable. The equations must act
+       elementwise along the value axis.
+    x0: dictionary mapping each variable name to its starting value(s)
+    max_iter: maximum allowed number of Newton steps
+    tol: a system is solved once the absolute values of all of its equations are at most tol
+
+    RETURNS
+    ========
+    dictionary containing the following keys and values:
+       'x': dictionary mapping each variable name to its array of solutions, one per system
+       'residual': the largest absolute equation value of each system
+       'converged': boolean array marking the systems that reached tol
+       'num_iter': total number of Newton steps taken
+
+    EXAMPLES
+    =========
+    >>> from autodiffpy import autodiffmod as ad
+    >>> import numpy as np
+    >>> F = lambda x, y: [x**2 + y**2 - 4, x - y]
+    >>> sol = ad.newton(F, {'x': [1, -1], 'y': [1, -3]})
+    >>> print(np.round(sol['x']['x'], 6), sol['converged'])
+    [ 1.414214 -1.414214] [ True  True]
+    """
+    names = list(x0)
+    starts = [np.atleast_1d(np.asarray(x0[name], dtype=float)) for name in names]
+    num_sys = max(start.shape[0] for start in starts)
+    x = np.stack([np.broadcast_to(start, (num_sys,)) for start in starts], axis=1)
+
+    i = 0
+    while True:
+        # F may close over per-system data, so every system is evaluated and only the unsolved ones are stepped
+        Fx, J = _newton_system(F, names, x)
+        residual = np.max(np.abs(Fx), axis=1)
+        active = ~(residual <= tol)
+        if not active.any() or i >= max_iter:
+            break
+        x[active] = x[active] + _stacked_solve(J[active], -Fx[active])
+        i = i+1
+
+    return {"x":{name:x[:, k] for k, name in enumerate(names)}, "residual":residual, "converged":residual <= tol, "num_iter":i}
@@ -0,0 +1,147 @@
+import pytest
+import sys
+import importlib.util
+import numpy as np
+
+sys.path.append('..')
+from autodiffpy import autodiffmod as ad
+from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_graph as adgraph
+from autodiffpy import autodiff_codegen as adcodegen
+
+
+
+## Expression using every operation the graph can trace
+def model(x_val=[0.3, 0.5], y_val=[1.2, 2.0]):
+    x = ad.autodiff('x', x_val)
+    y = ad.autodiff('y', y_val)
+    c = ad.autodiff('c', [2.0, 3.0], der=[0.5, 2.0])
+    f = admath.logistic(x*c, A=2, k=0.5)/y + admath.log(y, base=2)**x - 2/x + 3**x - c*c + -y
+    f = f + admath.sqrt(y) - admath.sin(x) + admath.cos(y) + admath.tan(x) + admath.exp(-c) + admath.log(y)
+    return f + admath.arcsin(x) + admath.arccos(x) + admath.arctan(y) + admath.sinh(x) + admath.cosh(x) + admath.tanh(y)/4 + [1, 2]
+
+
+## Test compiled code matches the graph it was generated from, for new inputs too
+def test_codegen_matches_graph():
+    g = adgraph.trace(model())
+    c = adcodegen.compile_graph(g)
+    values = {'x': np.array([0.1, 0.7]), 'y': np.array([3.0, 1.5])}
+    assert np.allclose(c.value(), g.evaluate())
+    assert np.allclose(c.value(values), g.evaluate(values))
+    grads, loss_value = c.backprop([1, 2], values=values)
+    grads_graph, loss_graph = g.backprop([1, 2], values=values)
+    assert loss_value == pytest.approx(loss_graph)
+    for name in ['c', 'x', 'y']:
+        assert np.allclose(grads[name], grads_graph[name])
+        assert np.allclose(c.gradient(np.ones(2))[name], g.backward(g.forward(), np.ones(2))[name])
+    res = c.jacobian()
+    assert res['order'] == ['c', 'x', 'y']
+    assert np.allclose(res['jacobian'], g.jacobian(g.forward(), ['c', 'x', 'y']))
+    assert np.allclose(res['jacobian'], model().jacobian(order=['c', 'x', 'y'])['jacobian'])
+
+## Test matrix-vector products, shared leaves, wrt and leaf names that are not identifiers
+def test_codegen_dot_and_names():
+    w = ad.autodiff('w', [0.5, -1.0])
+    b = ad.autodiff('bias 1', 0.3)
+    X = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+    g = adgraph.trace(admath.logistic(w*X) + w*X*b)
+    c = adcodegen.compile_graph(g, wrt=['w'])
+    assert 'def value(bias_' not in c.source and c.order == ['bias 1', 'w']
+    grads, loss_value = c.backprop([1, 0, 1])
+    grads_graph, loss_graph = g.backprop([1, 0, 1], wrt=['w'])
+    assert list(grads) == ['w']
+    assert np.allclose(grads['w'], grads_graph['w'])
+    assert np.allclose(c.value({'bias 1': 1.0}), g.evaluate({'bias 1': 1.0}))
+    with pytest.raises(KeyError):
+        c.value({'z': 1.0})
+    with pytest.raises(KeyError):
+        adcodegen.compile_graph(g, wrt=['z'])
+
+## Test leaf names that clash with the generated functions, their locals or builtins
+def test_codegen_reserved_names():
+    names = ['forward', 'backward', 'range', 'int', 'value', 'leaf_adjoints', 'rows', 'shape', 'i']
+    leaves = [ad.autodiff(name, [0.1*k, 0.2]) for k, name in enumerate(names)]
+    f = leaves[0]
+    for leaf in leaves[1:]:
+        f = f*leaf + admath.sin(leaf)
+    g = adgraph.trace(f)
+    c = adcodegen.compile_graph(g)
+    assert np.allclose(c.value(), g.evaluate())
+    grads, loss_value = c.backprop([1, 1])
+    grads_graph, loss_graph = g.backprop([1, 1])
+    for name in names:
+        assert np.allclose(grads[name], grads_graph[name])
+    assert np.allclose(c.jacobian()['jacobian'], g.jacobian(g.forward(), c.wrt))
+
+## Test compiled code is cached by graph structure, and constants are part of the structure
+def test_codegen_cache():
+    first = adcodegen.compile_graph(model())
+    second = adcodegen.compile_graph(model([0.2, 0.4], [3.0, 4.0]))
+    assert second.source is first.source
+    assert np.allclose(second.value(), model([0.2, 0.4], [3.0, 4.0]).val)
+    x = ad.autodiff('x', 1.0)
+    assert adcodegen.graph_hash(adgraph.trace(x*2)) != adcodegen.graph_hash(adgraph.trace(x*3))
+    assert adcodegen.compile_graph(x*3).value() == 3.0
+
+## Test large constants are bound rather than written into the source, and do not enter the graph hash
+def test_codegen_large_constants(tmp_path):
+    x = np.linspace(0, 1, 20000)
+    data = np.linspace(1, 2, 20000)
+    c = adcodegen.compile_graph(admath.sin(ad.autodiff('x', x))*data + data, cache_dir=str(tmp_path))
+    assert len(c.source) < 5000
+    assert np.allclose(c.value(), np.sin(x)*data + data)
+    other = np.linspace(2, 3, 20000)
+    d = adcodegen.compile_graph(admath.sin(ad.autodiff('x', x))*other + other, cache_dir=str(tmp_path))
+    assert d.key == c.key
+    assert np.allclose(d.value(), np.sin(x)*other + other)
+    assert np.allclose(d.gradient(np.ones(20000))['x'], np.cos(x)*other)
+    assert np.allclose(d.jacobian()['jacobian'][0][:3], np.cos(x[:3])*other[:3])
+    assert np.allclose(adcodegen.load(c.key, str(tmp_path)).value(), c.value())
+    path = tmp_path / 'generated_large.py'
+    d.save(str(path))
+    spec = importlib.util.spec_from_file_location('generated_large', str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    assert np.allclose(module.value(x), d.value())
+
+## Test the generated source can be saved and imported as a module
+def test_codegen_save(tmp_path):
+    g = adgraph.trace(model())
+    path = tmp_path / 'generated_model.py'
+    adcodegen.compile_graph(g).save(str(path))
+    spec = importlib.util.spec_from_file_location('generated_model', str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    c, x, y = [g.values[g.leaves[name][0]] for name in module.order]
+    assert np.allclose(module.value(c, x, y), g.evaluate())
+    assert np.allclose(module.gradient(np.ones(2), c, x, y)[1], g.backward(g.forward(), np.ones(2))['x'])
+
+## Test compiled code stored in a cache directory is loaded by another process without tracing
+def test_codegen_disk_cache(tmp_path):
+    import subprocess
+    import json
+    import os
+    c = adcodegen.compile_graph(model(), cache_dir=str(tmp_path))
+    assert sorted(os.listdir(str(tmp_path))) == [c.key + '.pkl', c.key + '.py']
+    script = ("import json; import numpy as np; from autodiffpy import autodiff_codegen as adcodegen; "
+              f"c = adcodegen.load('{c.key}', r'{tmp_path}'); "
+              "print(json.dumps([c.value().tolist(), c.gradient(np.ones(2))['x'].tolist()]))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True, check=True).stdout
+    value, grad_x = json.loads(out)
+    assert np.allclose(value, c.value())
+    assert np.allclose(grad_x, c.gradient(np.ones(2))['x'])
+    with pytest.raises(KeyError):
+        adcodegen.load('missing', str(tmp_path))
+
+## Test compile_graph() reuses code stored on disk, and keys depend on the package version
+def test_codegen_disk_reuse(tmp_path, monkeypatch):
+    import autodiffpy
+    key = adcodegen.compile_graph(model(), cache_dir=str(tmp_path)).key
+    monkeypatch.setattr(adcodegen, '_CACHE', {})
+    monkeypatch.setattr(adcodegen, 'generate', None)
+    c = adcodegen.compile_graph(model([0.2, 0.4], [3.0, 4.0]), cache_dir=str(tmp_path))
+    assert c.key == key
+    assert np.allclose(c.value(), model([0.2, 0.4], [3.0, 4.0]).val)
+    monkeypatch.setattr(autodiffpy, '__version__', '0.0.2')
+    assert adcodegen.cache_key(c.graph) != key
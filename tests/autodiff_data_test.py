@@ -0,0 +1,157 @@
+import pytest
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.append('..')
+from autodiffpy import autodiffmod as ad
+from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_data as addata
+
+demo_csv = os.path.join(os.path.dirname(__file__), '..', 'docs', 'demo.csv')
+
+
+
+## Test read_chunks() splits the file into bounded chunks
+def test_read_chunks():
+    chunks = list(addata.read_chunks(demo_csv, chunksize=60))
+    assert [len(y) for table, y in chunks] == [60, 60, 60, 18]
+    assert list(chunks[0][0].columns) == ['x1', 'x2', 'x3', 'x4', 'x5']
+    data = pd.read_csv(demo_csv)
+    assert np.allclose(np.concatenate([y for table, y in chunks]), data['y'])
+
+## Test chunked_backprop() agrees with backprop() on the full data for every loss
+@pytest.mark.parametrize("loss", ["MSE", "MAE", "RMSE"])
+def test_chunked_backprop_losses(loss):
+    data = pd.read_csv(demo_csv)
+    x = data.drop(columns=['y'])
+    w = ad.autodiff('w', [0.5, -1, 1, 0, 2])
+    f_full = admath.tanh(w*x)
+    delta, loss_full = f_full.backprop(data['y'], loss=loss)
+
+    f_sample = admath.tanh(w*x[:3])
+    grads, loss_value = addata.chunked_backprop(f_sample, addata.read_chunks(demo_csv, chunksize=37), loss=loss)
+    assert loss_value == pytest.approx(loss_full)
+    assert np.allclose(grads['w'], [np.sum(value) for value in delta['w']])
+
+## Test leaves named after columns are bound to those columns
+def test_chunked_backprop_column_leaves():
+    data = pd.read_csv(demo_csv)
+    x1 = ad.autodiff('x1', data['x1'].to_numpy()[:4])
+    x2 = ad.autodiff('x2', data['x2'].to_numpy()[:4])
+    w = ad.autodiff('w', 3.0)
+    f = w*admath.sin(x1) + x2
+    grads, loss_value = addata.chunked_backprop(f, addata.read_chunks(demo_csv, chunksize=50))
+    r = 3*np.sin(data['x1']) + data['x2'] - data['y']
+    assert loss_value == pytest.approx(np.mean(r**2))
+    assert grads['w'] == pytest.approx(np.mean(2*r*np.sin(data['x1'])))
+
+## Test constants holding one column or a few columns are bound to those columns
+def test_chunked_backprop_column_constants():
+    data = pd.read_csv(demo_csv)
+    x = data.drop(columns=['y'])
+    w = ad.autodiff('w', [0.5, -1])
+    def fun(rows):
+        return w*x[['x4', 'x2']].to_numpy()[rows] + data['x3'].to_numpy()[rows]
+    delta, loss_full = fun(slice(None)).backprop(data['y'])
+    grads, loss_value = addata.chunked_backprop(fun(slice(0, 6)), addata.read_chunks(demo_csv, chunksize=40))
+    assert loss_value == pytest.approx(loss_full)
+    assert np.allclose(grads['w'], [np.sum(value) for value in delta['w']])
+    with pytest.raises(ValueError):
+        addata.chunked_backprop(fun(slice(3, 9)), addata.read_chunks(demo_csv, chunksize=40))
+
+## Test a feature matrix with its columns in another order than the file is matched column by column
+def test_chunked_backprop_reordered_columns():
+    data = pd.read_csv(demo_csv)
+    x = data[['x5', 'x4', 'x3', 'x2', 'x1']]
+    w = ad.autodiff('w', [1, 1, 1, 1, 1])
+    delta, loss_full = (w*x).backprop(data['y'])
+    grads, loss_value = addata.chunked_backprop(w*x[:10], addata.read_chunks(demo_csv, chunksize=64))
+    assert loss_value == pytest.approx(loss_full)
+    assert np.allclose(grads['w'], [np.sum(value) for value in delta['w']])
+
+## Test an input matching several equal columns is an error rather than a guess
+def test_chunked_backprop_ambiguous_columns():
+    table = pd.DataFrame({'a': [1.0, 2.0, 3.0, 4.0], 'b': [1.0, 2.0, 3.0, 4.0], 'c': [0.0, 1.0, 0.0, 1.0]})
+    w = ad.autodiff('w', [1.0, 1.0])
+    with pytest.raises(ValueError):
+        addata.chunked_backprop(w*table[['a', 'c']].to_numpy()[:2], [(table, np.ones(4))])
+
+def test_chunked_backprop_nodata():
+    w = ad.autodiff('w', [1.0, 1.0])
+    with pytest.raises(ValueError):
+        addata.chunked_backprop(w*2, addata.read_chunks(demo_csv))
+    x = np.ones((3, 2))
+    with pytest.raises(ValueError):
+        addata.chunked_backprop(w*x, [])
+
+## Test chunked_gradient_descent() matches full-batch gradient_descent()
+def test_chunked_gradient_descent():
+    data = pd.read_csv(demo_csv)
+    x = data.drop(columns=['y'])
+    w = ad.autodiff('w', [1, 1, 1, 1, 1])
+    g_full = ad.gradient_descent(w*x, data['y'], beta=0.1, max_iter=20)
+
+    w = ad.autodiff('w', [1, 1, 1, 1, 1])
+    g = addata.chunked_gradient_descent(w*x[:5], demo_csv, beta=0.1, max_iter=20, chunksize=50)
+    assert g['num_iter'] == 20
+    assert np.allclose(g['loss_array'], g_full['loss_array'])
+    assert np.allclose(g['w'].val, g_full['w'].val)
+
+
+## Test build_cache() writes one .npy per column that load_cache() maps back without parsing
+def test_cache_roundtrip(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    manifest = addata.build_cache(demo_csv, cache_dir, chunksize=50)
+    assert manifest['rows'] == 198
+    assert manifest['columns'] == ['x1', 'x2', 'x3', 'x4', 'x5', 'y']
+    assert not addata.is_stale(demo_csv, cache_dir)
+
+    columns = addata.load_cache(demo_csv, cache_dir)
+    data = pd.read_csv(demo_csv)
+    for name in data.columns:
+        assert isinstance(columns[name], np.memmap)
+        assert np.array_equal(columns[name], data[name].to_numpy())
+
+## Test staleness detection against the source file
+def test_cache_staleness(tmpdir):
+    source = str(tmpdir.join('data.csv'))
+    pd.DataFrame({'x1': [1.0, 2.0], 'y': [3.0, 4.0]}).to_csv(source, index=False)
+    assert addata.is_stale(source)
+    columns = addata.load_cache(source)
+    assert os.path.exists(source + '.cache')
+    assert np.array_equal(columns['y'], [3.0, 4.0])
+
+    pd.DataFrame({'x1': [1.0, 2.0, 5.0], 'y': [3.0, 4.0, 6.0]}).to_csv(source, index=False)
+    assert addata.is_stale(source)
+    columns = addata.load_cache(source)
+    assert np.array_equal(columns['y'], [3.0, 4.0, 6.0])
+    assert not addata.is_stale(source)
+
+    os.remove(os.path.join(source + '.cache', 'col0.npy'))
+    assert addata.is_stale(source)
+
+## Test leaves and chunks built on cached columns
+def test_cache_leaves_and_chunks(tmpdir):
+    columns = addata.load_cache(demo_csv, str(tmpdir.join('cache')))
+    leaves = addata.cache_leaves(columns, ['x1', 'x2'], differentiable=True)
+    assert leaves['x1'].val is columns['x1']
+    f = admath.sin(leaves['x1'])*leaves['x2']
+    assert np.allclose(f.der['x2'], np.sin(columns['x1']))
+
+    w = ad.autodiff('w', 3.0)
+    x1 = addata.cache_leaves({'x1': columns['x1'][:4]})['x1']
+    grads, loss_value = addata.chunked_backprop(w*x1, addata.cache_chunks(columns, chunksize=64))
+    r = 3*columns['x1'] - columns['y']
+    assert loss_value == pytest.approx(np.mean(r**2))
+    assert grads['w'] == pytest.approx(np.mean(2*r*columns['x1']))
+
+## Test leaves built on cached columns are data for mini-batch gradient descent
+def test_cache_leaves_minibatch(tmpdir):
+    columns = addata.load_cache(demo_csv, str(tmpdir.join('cache')))
+    x1 = addata.cache_leaves(columns, ['x1'])['x1']
+    assert x1.der == {}
+    w = ad.autodiff('w', 0.0)
+    result = ad.gradient_descent(w*x1, columns['y'], beta=0.1, max_iter=50, tol=0, batch_size=8, seed=0)
+    assert result['loss_array'][-1] < result['loss_array'][0]
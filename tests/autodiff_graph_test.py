@@ -0,0 +1,155 @@
+import pytest
+import sys
+import numpy as np
+
+sys.path.append('..')
+from autodiffpy import autodiffmod as ad
+from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_graph as adgraph
+
+
+
+## Finite-difference gradient of fun(**point) summed over its outputs
+def numeric_grad(fun, point, name, h=1E-6):
+    up = dict(point)
+    down = dict(point)
+    up[name] = point[name] + h
+    down[name] = point[name] - h
+    return (fun(**up).val - fun(**down).val)/(2*h)
+
+
+## Test trace() ordering and input bookkeeping
+def test_trace_structure():
+    x = ad.autodiff('x', [1, 2])
+    y = ad.autodiff('y', [3, 4])
+    g = adgraph.trace(x*y + x)
+    assert [op for op, args, params in g.ops] == ['input', 'input', 'mul', 'add']
+    assert g.ops[2][1] == [0, 1]
+    assert g.ops[3][1] == [2, 0]
+    assert g.leaves == {'x': [0], 'y': [1]}
+    assert g.names[2] is None
+
+def test_trace_err_types():
+    with pytest.raises(ValueError):
+        adgraph.trace(3)
+
+## Test evaluate() matches the traced expression, and records operation parameters
+def test_evaluate_all_ops():
+    x = ad.autodiff('x', [0.3, 0.5])
+    y = ad.autodiff('y', [1.2, 2.0])
+    f = admath.logistic(x*y, A=2, k=3, x0=0.1)/y + admath.log(y, base=2)**x - 2/x + 3**x - x*x
+    f = f + admath.sqrt(y) + admath.sin(x) + admath.cos(x) + admath.tan(x) + admath.exp(-x)
+    f = f + admath.arcsin(x) + admath.arccos(x) + admath.arctan(x) + admath.sinh(y) + admath.cosh(y) + admath.tanh(y)
+    g = adgraph.trace(f)
+    assert np.allclose(g.evaluate(), f.val)
+    assert ('log', [1], {'base': 2}) in [(op, args, params) for op, args, params in g.ops]
+
+## Test backward() against finite differences on a graph with shared nodes
+def test_backward_all_ops():
+    def fun(x, y):
+        x = ad.autodiff('x', x)
+        y = ad.autodiff('y', y)
+        f = admath.logistic(x*y, A=2, k=3, x0=0.1)/y + admath.log(y, base=2)**x - 2/x + 3**x - x*x
+        f = f + admath.sqrt(y) + admath.sin(x) + admath.cos(x) + admath.tan(x) + admath.exp(-x)
+        return f + admath.arcsin(x) + admath.arccos(x) + admath.arctan(x) + admath.sinh(y)*admath.cosh(y)*admath.tanh(y)
+    point = {'x': np.array([0.3, 0.5]), 'y': np.array([1.2, 2.0])}
+    g = adgraph.trace(fun(**point))
+    grads = g.backward(g.forward(), np.ones(2))
+    assert np.allclose(grads['x'], numeric_grad(fun, point, 'x'))
+    assert np.allclose(grads['y'], numeric_grad(fun, point, 'y'))
+
+## Test tangent() against finite differences, one seed direction per batch row
+def test_tangent_all_ops():
+    def fun(x, y):
+        x = ad.autodiff('x', x)
+        y = ad.autodiff('y', y)
+        f = admath.logistic(x*y, A=2, k=3, x0=0.1)/y + admath.log(y, base=2)**x - 2/x + 3**x - x*x
+        f = f + admath.sqrt(y) + admath.sin(x) + admath.cos(x) + admath.tan(x) + admath.exp(-x)
+        return f + admath.arcsin(x) + admath.arccos(x) + admath.arctan(x) + admath.sinh(y)*admath.cosh(y)*admath.tanh(y)
+    point = {'x': np.array([0.3, 0.5]), 'y': np.array([1.2, 2.0])}
+    g = adgraph.trace(fun(**point))
+    vals = g.forward()
+    tangents = {idx: np.array([[1.0, 1.0], [0.0, 0.0]]) for idx in g.leaves['x']}
+    tangents.update({idx: np.array([[0.0, 0.0], [1.0, 1.0]]) for idx in g.leaves['y']})
+    t = g.tangent(vals, tangents)
+    assert np.allclose(t[0], numeric_grad(fun, point, 'x'))
+    assert np.allclose(t[1], numeric_grad(fun, point, 'y'))
+    assert g.tangent(vals, {}) is None
+
+## Test backprop() matches autodiff.backprop() for a matrix-vector model
+def test_backprop_dot():
+    x = np.array([[1,-2,1],[3,0,4]]) #Data
+    w = ad.autodiff('w', [3, -1, 0]) #Weights
+    f = admath.exp(w*x/10)
+    y_act = [5.5, 9.5]
+    delta, loss_value = f.backprop(y_act, retain_graph=True)
+    grads, loss_graph = adgraph.trace(f).backprop(y_act)
+    assert loss_graph == pytest.approx(loss_value)
+    assert np.allclose(grads['w'], [np.sum(value) for value in delta['w']])
+
+## Test values overrides and bind()
+def test_bind_and_values():
+    x_data = np.array([1.0, 2.0, 3.0])
+    w = ad.autodiff('w', [2.0, 2.0, 2.0])
+    g = adgraph.trace(w*x_data)
+    assert np.allclose(g.evaluate({'w': 3.0}), [3, 6, 9])
+    assert np.allclose(g.evaluate(), [2, 4, 6])
+    data = g.sample_inputs(3)
+    assert data == [1]
+    g.bind(data[0], [1.0, 1.0, 1.0])
+    assert np.allclose(g.evaluate(), [2, 2, 2])
+    grads, loss_value = g.backprop([0, 0, 0], wrt=['w'])
+    assert list(grads) == ['w']
+    assert np.allclose(grads['w'], [4/3, 4/3, 4/3])
+    assert np.allclose(g.evaluate({'w': 1.0, 1: [1.0, 5.0]}), [1, 5])
+    with pytest.raises(KeyError):
+        g.bind('z', 1)
+
+## Test vmap() matches building and differentiating the expression once per setting
+def test_vmap_matches_jacobian():
+    def fun(x, y):
+        x = ad.autodiff('x', x)
+        y = ad.autodiff('y', y, der=[1, 2])
+        c = ad.autodiff('c', [2.0, 3.0])
+        return admath.exp(x/4)*y + x**2*c - admath.tanh(y) + admath.logistic(x, k=2)
+    rng = np.random.RandomState(0)
+    xs = rng.rand(6, 2)
+    ys = rng.rand(6, 2)
+    res = adgraph.vmap(fun([0.0, 0.0], [0.0, 0.0]), {'x': xs, 'y': ys})
+    assert res['order'] == ['c', 'x', 'y']
+    assert res['val'].shape == (6, 2)
+    assert res['jacobian'].shape == (6, 3, 2)
+    for m in range(6):
+        f = fun(xs[m], ys[m])
+        assert np.allclose(res['val'][m], f.val)
+        assert np.allclose(res['jacobian'][m], f.jacobian(order=res['order'])['jacobian'])
+
+## Test vmap() over the weights of a matrix-vector model
+def test_vmap_dot():
+    x = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]) #Data
+    w = ad.autodiff('w', [0.0, 0.0])
+    g = adgraph.trace(admath.sin(w*x))
+    ws = np.array([[1.0, 2.0], [0.5, -1.0], [0.0, 3.0], [2.0, 2.0]])
+    res = adgraph.vmap(g, {'w': ws})
+    assert np.allclose(res['val'], np.sin(np.dot(ws, x.T)))
+    assert np.allclose(res['jacobian'][:, 0], np.cos(np.dot(ws, x.T))*x.sum(axis=1))
+
+def test_vmap_err_types():
+    x = ad.autodiff('x', 1.0)
+    y = ad.autodiff('y', 2.0)
+    with pytest.raises(KeyError):
+        adgraph.vmap(x*y, {'z': [1, 2]})
+    with pytest.raises(ValueError):
+        adgraph.vmap(x*y, {'x': [1, 2], 'y': [1, 2, 3]})
+
+## Test reverse-mode jacobian() agrees with forward mode, including derivative seeds and repeated names
+def test_jacobian_modes():
+    x = ad.autodiff('x', [0.3, 0.5], der=[1, 2])
+    y = ad.autodiff('y', [1.2, 2.0])
+    x2 = ad.autodiff('x', [0.3, 0.5], der=[1, 2])
+    g = adgraph.trace(admath.sin(x*y) + x2**2 - admath.exp(y)/3)
+    vals = g.forward()
+    forward = g.jacobian(vals, ['y', 'x'], mode='forward')
+    reverse = g.jacobian(vals, ['y', 'x'], mode='reverse')
+    assert forward.shape == reverse.shape == (2, 2)
+    assert np.allclose(forward, reverse)
@@ -0,0 +1,94 @@
+import pytest
+import sys
+import io
+import pickle
+import numpy as np
+
+sys.path.append('..')
+from autodiffpy import autodiffmod as ad
+from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_graph as adgraph
+from autodiffpy import autodiff_io as adio
+
+
+
+## Expression with operators, math functions with params, seeds and a no-derivative leaf
+def model():
+    x = ad.autodiff('x', [0.3, 0.5])
+    y = ad.autodiff('y', [1.2, 2.0])
+    c = ad.autodiff('c', [2.0, 3.0], der=[0.5, 2.0])
+    t = ad.autodiff('t', [1.0, 4.0], der=None)
+    return admath.logistic(x*c, A=2, k=0.5)/2 + admath.log(y, base=2)**x - 2/x + 3**x - admath.sqrt(y)*t + [1, 2]
+
+
+## Test save_graph() and load_graph() give back the same graph
+def test_graph_roundtrip(tmp_path):
+    g = adgraph.trace(model())
+    path = str(tmp_path / 'model.npz')
+    adio.save_graph(g, path)
+    h = adio.load_graph(path)
+    assert h.ops == g.ops and h.names == g.names and h.output == g.output
+    for a, b in zip(h.values, g.values):
+        assert type(a) == type(b) and np.array_equal(a, b)
+    for a, b in zip(h.seeds, g.seeds):
+        assert (a is None and b is None) or np.array_equal(a, b)
+    assert np.allclose(h.evaluate(), g.evaluate())
+    grads, loss_value = h.backprop([1, 1])
+    grads_graph, loss_graph = g.backprop([1, 1])
+    assert loss_value == loss_graph
+    for name in grads:
+        assert np.allclose(grads[name], grads_graph[name])
+    assert np.allclose(h.jacobian(h.forward(), ['c', 'x']), g.jacobian(g.forward(), ['c', 'x']))
+
+## Test dumps() is compact, and its bytes can be shipped to a worker as is
+def test_dumps_loads():
+    w = ad.autodiff('w', np.ones(10))
+    X = np.random.RandomState(0).rand(1000, 10)
+    g = adgraph.trace(admath.logistic(w*X))
+    data = adio.dumps(g)
+    h = adio.loads(data)
+    assert len(data) < X.nbytes + 10**4
+    assert len(data) <= len(pickle.dumps(g)) + 10**4
+    assert np.allclose(h.evaluate(), g.evaluate())
+    assert np.allclose(pickle.loads(pickle.dumps(h)).evaluate(), g.evaluate())
+
+## Test to_autodiff() rebuilds an expression with the same values and derivatives
+def test_to_autodiff():
+    f = model()
+    rebuilt = adio.to_autodiff(adio.loads(adio.dumps(adgraph.trace(f))))
+    assert np.allclose(rebuilt.val, f.val)
+    assert sorted(rebuilt.der) == sorted(f.der)
+    for name in f.der:
+        assert np.allclose(rebuilt.der[name], f.der[name])
+    w = ad.autodiff('w', [1.0, -1.0])
+    f = admath.logistic(w*np.array([[1, 2], [3, 4], [5, 6]])) - 1
+    rebuilt = adio.to_autodiff(adgraph.trace(f))
+    assert np.allclose(rebuilt.val, f.val)
+    assert np.allclose(rebuilt.der['w'], f.der['w'])
+
+## Test gradient_descent results are saved and loaded, and training can resume from them
+def test_result_roundtrip(tmp_path):
+    w = ad.autodiff('w', [1, 1, 1])
+    x = np.array([[1, 2, 3], [0, 1, 2]])
+    result = ad.gradient_descent(w*x, [4, 2], max_iter=50)
+    path = str(tmp_path / 'result.npz')
+    adio.save_result(result, path)
+    loaded = adio.load_result(path)
+    assert np.allclose(loaded['w'].val, result['w'].val)
+    assert np.allclose(loaded['f'].val, result['f'].val)
+    assert loaded['loss_array'] == pytest.approx(result['loss_array'])
+    assert loaded['num_iter'] == result['num_iter']
+    resumed = ad.gradient_descent(loaded['f'], [4, 2], max_iter=50)
+    assert resumed['loss_array'][0] == pytest.approx(result['loss_array'][-1], rel=0.1)
+    assert resumed['loss_array'][-1] < result['loss_array'][-1]
+
+def test_io_err_types(tmp_path):
+    path = str(tmp_path / 'other.npz')
+    np.savez(path, a=np.ones(2))
+    with pytest.raises(ValueError):
+        adio.load_graph(path)
+    x = ad.autodiff('x', [1.0, 2.0])
+    file = io.BytesIO()
+    adio.save_graph(admath.sin(x), file)
+    with pytest.raises(ValueError):
+        adio.load_result(io.BytesIO(file.getvalue()))
@@ -0,0 +1,236 @@
+import pytest
+import sys
+import numpy as np
+
+sys.path.append('..')
+from autodiffpy import autodiffmod as ad
+from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_graph as adgraph
+from autodiffpy import autodiff_optimize as adoptimize
+
+
+
+## Checks two graphs agree in value and in the gradients for every leaf of h
+def assert_equivalent(g, h, y_true):
+    assert np.allclose(h.evaluate(), g.evaluate())
+    grads, loss_value = g.backprop(y_true)
+    grads_h, loss_h = h.backprop(y_true)
+    assert loss_h == pytest.approx(loss_value)
+    for name in grads_h:
+        assert np.allclose(grads_h[name], grads[name])
+
+
+## Test simplify() applies every identity and keeps values and gradients
+def test_simplify_identities():
+    x = ad.autodiff('x', [0.3, 0.5])
+    y = ad.autodiff('y', [1.2, 2.0])
+    f = (x*1)*(1*y) + 0 + (0 + x) - 0 + y/1 + x**1 + -(-y) + admath.log(admath.exp(x*y))
+    g = adgraph.trace(f)
+    h = adoptimize.simplify(g)
+    ops = [op for op, args, params in h.ops]
+    assert ops.count('input') == 2
+    assert set(ops) == {'input', 'mul', 'add'}
+    assert sorted(h.leaves) == ['x', 'y']
+    assert_equivalent(g, h, [1, 2])
+
+## Test simplify() leaves non-identities alone: non-scalar ones, logarithms of other bases, exp(log(x))
+def test_simplify_safe_only():
+    x = ad.autodiff('x', [0.3, 0.5])
+    f = x*np.ones(2) + np.zeros(2) + admath.log(admath.exp(x), base=2) + admath.exp(admath.log(x))
+    g = adgraph.trace(f)
+    h = adoptimize.simplify(g)
+    assert [op for op, args, params in h.ops] == [op for op, args, params in g.ops]
+    assert_equivalent(g, h, [0, 0])
+
+## Test simplify() folds subgraphs of fixed leaves into constants, and can reduce the output to a leaf
+def test_simplify_folding():
+    x = ad.autodiff('x', [0.3, 0.5])
+    t = ad.autodiff('t', [1.0, 2.0], der=None) #Data leaf
+    f = admath.sin(x)*admath.exp(admath.cos(t)*2) + t**2
+    g = adgraph.trace(f)
+    h = adoptimize.simplify(g, fixed=['t'])
+    assert [op for op, args, params in h.ops] == ['input', 'sin', 'input', 'mul', 'input', 'add']
+    assert list(h.leaves) == ['x']
+    assert_equivalent(g, h, [0, 0])
+    assert len(adoptimize.simplify(g).ops) == len(g.ops)
+    h = adoptimize.simplify(adgraph.trace((x + 0)*1))
+    assert [op for op, args, params in h.ops] == ['input']
+    assert np.allclose(h.evaluate({'x': [1.0, 2.0]}), [1.0, 2.0])
+
+## Test eliminate_dead() drops nodes the output does not use but keeps every leaf
+def test_eliminate_dead():
+    g = adgraph.graph([('input', [], {}), ('input', [], {}), ('sin', [1], {}), ('cos', [0], {})],
+                      ['x', 'z', None, None], [np.ones(2), np.ones(2), None, None])
+    h = adoptimize.eliminate_dead(g)
+    assert [op for op, args, params in h.ops] == ['input', 'input', 'cos']
+    assert h.leaves == {'x': [0], 'z': [1]}
+    grads = h.backward(h.forward(), np.ones(2))
+    assert np.allclose(grads['z'], 0)
+    assert np.allclose(grads['x'], -np.sin(1))
+
+## Test tracing with cse merges repeated subexpressions, commuted products and equal constants
+def test_trace_cse():
+    k = ad.autodiff('k', [0.5, 2.0])
+    x = ad.autodiff('x', [1.0, 3.0])
+    y = ad.autodiff('y', [2.0, 0.5])
+    f = admath.exp(-k*(x - 1)) + 2*admath.exp(-k*(x - 1)) + x*y*2 + y*x
+    g = adgraph.trace(f)
+    h = adgraph.trace(f, cse=True)
+    assert len(h.ops) == len(g.ops) - 5
+    assert [op for op, args, params in h.ops].count('exp') == 1
+    assert [op for op, args, params in h.ops].count('mul') == 4
+    assert_equivalent(g, h, [1, 2])
+    delta, loss_value = f.backprop([1, 2])
+    grads, loss_h = h.backprop([1, 2])
+    assert loss_h == pytest.approx(loss_value)
+    for name in ['k', 'x', 'y']:
+        assert np.allclose(grads[name], delta[name])
+
+## Test cse keeps leaves with different seeds, constants with different values and ops with different params apart
+def test_cse_distinct():
+    x = ad.autodiff('x', [1.0, 3.0])
+    f = admath.log(x, base=2) + admath.log(x) + x*2 + x*3 + x*np.array([2.0, 2.0])
+    g = adgraph.trace(f)
+    h = adoptimize.cse(g)
+    assert len(h.ops) == len(g.ops)
+    assert_equivalent(g, h, [0, 0])
+
+## Test cse keys large constants by identity: the same array is merged, an equal copy is not
+def test_cse_large_constants():
+    x = ad.autodiff('x', np.ones(100))
+    c = np.arange(100.0)
+    assert adgraph._key('input', [], {}, None, c) == adgraph._key('input', [], {}, None, c)
+    assert adgraph._key('input', [], {}, None, c) != adgraph._key('input', [], {}, None, c.copy())
+    assert adgraph._key('input', [], {}, None, np.ones(3)) == adgraph._key('input', [], {}, None, np.ones(3))
+    f = admath.sin(x*c) + admath.sin(x*c) + x*c.copy()
+    g = adgraph.trace(f)
+    h = adgraph.trace(f, cse=True)
+    assert len(h.ops) == len(g.ops) - 2
+    assert_equivalent(g, h, np.zeros(100))
+
+## Test cse after simplify merges subexpressions exposed by simplification
+def test_cse_after_simplify():
+    x = ad.autodiff('x', [0.3, 0.5])
+    f = admath.sin(x*1) + admath.sin(x)
+    g = adgraph.trace(f)
+    h = adoptimize.cse(adoptimize.simplify(g))
+    assert [op for op, args, params in h.ops] == ['input', 'sin', 'add']
+    assert_equivalent(g, h, [0, 0])
+
+## Test fuse() groups elementwise chains and matches the unfused graph, including across block edges
+def test_fuse_matches_graph():
+    x1 = ad.autodiff('x1', np.linspace(0.1, 1, 1001))
+    x2 = ad.autodiff('x2', np.linspace(1, 2, 1001))
+    c = ad.autodiff('c', 1.5)
+    f = 4*admath.sin(x1/2) + 2*admath.cos(x2*3)*c + admath.logistic(x1, A=2.0, k=0.5) - admath.log(x2, base=2)**2
+    g = adgraph.trace(f)
+    for block_size in (1, 64, 1000, 2**14):
+        h = adoptimize.fuse(g, block_size)
+        assert len(h.groups) == 1
+        vals = h.forward()
+        assert sum(val is None for val in vals) == len(list(h.groups.values())[0][0]) - 1
+        assert_equivalent(g, h, np.ones(1001))
+        assert np.allclose(h.jacobian(vals, ['c'], mode='forward'), g.jacobian(g.forward(), ['c'], mode='forward'))
+
+## Test fuse() keeps shared intermediates and matrix-vector products out of groups
+def test_fuse_boundaries():
+    x = ad.autodiff('x', [0.3, 0.5, 0.7])
+    s = admath.sin(x*2)
+    f = admath.exp(s) + s + admath.cos((x + 1)*np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]]))*2
+    g = adgraph.trace(f)
+    h = adoptimize.fuse(g, block_size=2)
+    ops = [[h.ops[idx][0] for idx in nodes] for nodes, inputs in h.groups.values()]
+    assert 'dot' in [op for op, args, params in h.ops]
+    assert sorted(ops) == [['exp', 'add', 'cos', 'mul', 'add'], ['mul', 'sin']]
+    assert_equivalent(g, h, [1, 2, 3])
+
+## Test fused graphs fall back to node by node evaluation for inputs of other shapes
+def test_fuse_other_shapes():
+    x = ad.autodiff('x', [0.3, 0.5, 0.7])
+    g = adgraph.trace(admath.exp(admath.sin(x)*2))
+    h = adoptimize.fuse(g)
+    values = {'x': np.linspace(0, 1, 7)}
+    assert np.allclose(h.evaluate(values), g.evaluate(values))
+    assert np.allclose(h.backprop(np.ones(7), values=values)[0]['x'], g.backprop(np.ones(7), values=values)[0]['x'])
+
+## Test fused and planned graphs traced from int inputs fall back to node by node evaluation for float inputs
+def test_optimize_other_dtypes():
+    w = ad.autodiff('w', [1, 2, 3])
+    g = adgraph.trace((w*2 + 1)*3)
+    values = {'w': np.array([0.5, 0.5, 0.5])}
+    for h in [adoptimize.fuse(g), adoptimize.plan_memory(g)]:
+        assert np.allclose(h.evaluate(values), [6, 6, 6])
+        grads, loss_value = h.backprop(np.ones(3), values=values)
+        assert np.allclose(grads['w'], g.backprop(np.ones(3), values=values)[0]['w'])
+        assert np.allclose(h.evaluate(), [9, 15, 21])
+
+## Deep elementwise model with two branches per layer
+def deep_model(n, depth):
+    x = ad.autodiff('x', np.linspace(-1, 1, n))
+    w = ad.autodiff('w', 0.5)
+    f = x
+    for layer in range(depth):
+        f = admath.sin(f*w) + admath.cos(f)*0.5
+    return f
+
+## Test plan_memory() matches the graph, and reuses buffers so evaluation holds O(width) values
+def test_plan_memory_matches_graph():
+    g = adgraph.trace(deep_model(101, 10))
+    h = adoptimize.plan_memory(g)
+    slot_of, slots, release = h.plans['evaluate']
+    assert len(slots) <= 3
+    vals = h.forward(plan='evaluate')
+    assert sum(val is not None for val, (op, args, params) in zip(vals, h.ops) if op != 'input') == 1
+    assert_equivalent(g, h, np.zeros(101))
+    vals = h.forward()
+    assert np.allclose(h.jacobian(vals, ['w', 'x'], mode='forward'), g.jacobian(g.forward(), ['w', 'x'], mode='forward'))
+    assert np.allclose(h.backward(vals, np.ones(101))['w'], g.backward(g.forward(), np.ones(101))['w'])
+    values = {'x': np.ones(7)}
+    assert np.allclose(h.evaluate(values), g.evaluate(values))
+
+## Test planned evaluation and backprop lower peak memory on a deep model
+def test_plan_memory_peak():
+    import tracemalloc
+    g = adgraph.trace(deep_model(10**5, 20))
+    h = adoptimize.plan_memory(g)
+    peaks = []
+    for run in (g.evaluate, h.evaluate, lambda: g.backprop(np.zeros(10**5)), lambda: h.backprop(np.zeros(10**5))):
+        tracemalloc.start()
+        run()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < peaks[0]/10
+    assert peaks[3] < peaks[2]
+
+## Test checkpoint() matches the graph for any number of segments, storing only the checkpoints
+def test_checkpoint_matches_graph():
+    g = adgraph.trace(deep_model(31, 12))
+    for segments in (None, 1, 2, 5, len(g.ops)):
+        h = adoptimize.checkpoint(g, segments)
+        vals = h.forward()
+        assert set(idx for idx, val in enumerate(vals) if val is not None and h.ops[idx][0] != 'input') == h.checkpoints
+        assert_equivalent(g, h, np.zeros(31))
+        assert np.allclose(h.backward(vals, np.ones(31), ['w'])['w'], g.backward(g.forward(), np.ones(31), ['w'])['w'])
+        assert np.allclose(h.jacobian(vals, ['w'], mode='forward'), g.jacobian(g.forward(), ['w'], mode='forward'))
+    assert len(adoptimize.checkpoint(g).checkpoints) < len(g.ops)/4
+    with pytest.raises(ValueError):
+        adoptimize.checkpoint(g, 0)
+
+## Test checkpointed backprop lowers peak memory on a long time-stepping loop
+def test_checkpoint_peak():
+    import tracemalloc
+    x = ad.autodiff('x', np.linspace(0, 1, 10**4))
+    k = ad.autodiff('k', 0.3)
+    f = x
+    for step in range(200):
+        f = f + (admath.sin(f)*k)*0.01
+    g = adgraph.trace(f)
+    h = adoptimize.checkpoint(g)
+    peaks = []
+    for run in (g.backprop, h.backprop):
+        tracemalloc.start()
+        run(np.zeros(10**4))
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < peaks[0]/4
+    assert np.allclose(h.backprop(np.zeros(10**4))[0]['k'], g.backprop(np.zeros(10**4))[0]['k'])
@@ -0,0 +1,168 @@
+import pytest
+import sys
+import numpy as np
+
+sys.path.append('..')
+from autodiffpy import autodiffmod as ad
+from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_parallel as adparallel
+
+
+
+## Test tree reduction of partial results
+def test_tree_reduce():
+    assert adparallel._tree_reduce([1, 2, 3, 4, 5], lambda a, b: a + b) == 15
+    assert adparallel._tree_reduce([[1], [2], [3]], lambda a, b: a + b) == [1, 2, 3]
+
+## Test data_parallel.backprop() agrees with backprop() for every loss
+@pytest.mark.parametrize("loss", ["MSE", "MAE", "RMSE"])
+def test_data_parallel_backprop(loss):
+    rng = np.random.RandomState(0)
+    x = rng.rand(101, 3) #Data
+    y_act = rng.rand(101)
+    w = ad.autodiff('w', [0.2, -0.4, 0.3]) #Weights
+    f = admath.logistic(w*x, A=2)
+    delta, loss_serial = f.backprop(y_act, loss=loss, retain_graph=True)
+    with adparallel.data_parallel(f, y_act, num_workers=3, loss=loss) as pool:
+        assert len(pool.workers) == 3
+        grads, loss_value = pool.backprop({'w': w.val})
+        assert loss_value == pytest.approx(loss_serial)
+        assert np.allclose(grads['w'], [np.sum(value) for value in delta['w']])
+        r = 1 - y_act
+        expected = {"MSE": np.mean(r**2), "MAE": np.mean(np.abs(r)), "RMSE": np.sqrt(np.mean(r**2))}
+        grads, loss_value = pool.backprop({'w': [0, 0, 0]})
+        assert loss_value == pytest.approx(expected[loss])
+    assert pool.workers == []
+
+## Test worker errors are raised in the calling process
+def test_data_parallel_errors():
+    x = np.ones((4, 2))
+    w = ad.autodiff('w', [1.0, 1.0])
+    with pytest.raises(ValueError):
+        adparallel.data_parallel(w*2, [1, 2, 3])
+    with pytest.raises(ValueError):
+        adparallel.data_parallel(w*x, np.ones(4), loss='L1')
+    with adparallel.data_parallel(w*x, np.ones(4), num_workers=8) as pool:
+        assert len(pool.workers) == 4
+        with pytest.raises(KeyError):
+            pool.backprop({'v': [1.0, 1.0]})
+
+## Test a worker that dies closes the pool with a clear error instead of hanging or raising EOFError
+def test_data_parallel_dead_worker():
+    x = np.ones((4, 2))
+    w = ad.autodiff('w', [1.0, 1.0])
+    pool = adparallel.data_parallel(w*x, np.ones(4), num_workers=2, wrt=['w'])
+    pool.backprop()
+    pool.workers[0][0].kill()
+    pool.workers[0][0].join()
+    with pytest.raises(RuntimeError):
+        pool.backprop({'w': [0.5, 0.5]})
+    assert pool.workers == [] and pool._blocks == []
+
+## Test gradient_descent() with worker processes matches the serial run
+def test_gradient_descent_workers():
+    x = np.array([[1,-2,1],[3,0,4],[2,2,2],[0,1,-1]]) #Data
+    y_act = [5.5, 9.5, 1, 2]
+    w = ad.autodiff('w', [3, -1, 0]) #Weights
+    g_serial = ad.gradient_descent(w*x, y_act, beta=0.005, max_iter=200)
+    w = ad.autodiff('w', [3, -1, 0]) #Weights
+    g = ad.gradient_descent(w*x, y_act, beta=0.005, max_iter=200, num_workers=2)
+    assert g['num_iter'] == g_serial['num_iter']
+    assert np.allclose(g['loss_array'], g_serial['loss_array'])
+    assert np.allclose(g['w'].val, g_serial['w'].val)
+    with pytest.raises(ValueError):
+        ad.gradient_descent(w*x, y_act, batch_size=2, num_workers=2)
+
+## Test shared arrays attach without copying and are freed by close()
+def test_shared_memory_blocks():
+    shm, view = adparallel._share(np.arange(6.0).reshape(3, 2))
+    other, attached = adparallel._attach(adparallel._spec(shm, view))
+    attached[0, 0] = 10
+    assert view[0, 0] == 10
+    del attached
+    other.close()
+    del view
+    shm.close()
+    shm.unlink()
+
+    x = np.ones((6, 2))
+    w = ad.autodiff('w', [1.0, 1.0])
+    pool = adparallel.data_parallel(w*x, np.ones(6), num_workers=2)
+    names = [shm.name for shm in pool._blocks]
+    assert len(names) == 4
+    pool.backprop({'w': [0.5, 0.5]})
+    assert np.allclose(pool._params['w'], [0.5, 0.5])
+    pool.close()
+    with pytest.raises(FileNotFoundError):
+        adparallel.shared_memory.SharedMemory(name=names[0])
+
+## Test multistart() on worker processes and vectorized agree and pick the global minimum
+def test_multistart_modes():
+    x = np.array([[0.5, 1.0], [1.0, 1.0], [2.0, 1.0], [3.0, 1.0]]) #Data
+    y_act = np.tanh(np.dot(x, [3.0, -1.0]))
+    starts = [[-2.0, 0.0], [0.0, 0.0], [2.0, -2.0]]
+    results = []
+    for vectorize in (False, True):
+        w = ad.autodiff('w', [0.0, 0.0])
+        f = admath.tanh(w*x)
+        results.append(adparallel.multistart(f, y_act, starts, beta=0.5, max_iter=300, tol=1E-10, num_workers=2, vectorize=vectorize))
+    for res in results:
+        assert res['w_array'].shape == (3, 2)
+        assert len(res['loss_arrays']) == 3
+        assert res['loss_array'] is res['loss_arrays'][res['best']]
+        assert res['num_iter'] == len(res['loss_array'])
+        assert np.allclose(res['w'].val, res['w_array'][res['best']])
+        assert np.allclose(res['f'].val, np.tanh(np.dot(x, res['w'].val)))
+    assert results[0]['best'] == results[1]['best']
+    assert np.allclose(results[0]['w_array'], results[1]['w_array'])
+    for curve0, curve1 in zip(results[0]['loss_arrays'], results[1]['loss_arrays']):
+        assert np.allclose(curve0, curve1)
+
+## Test each start of multistart() matches a single gradient_descent() run
+def test_multistart_matches_gradient_descent():
+    x = np.array([[1,-2,1],[3,0,4]]) #Data
+    y_act = [5.5, 9.5]
+    w = ad.autodiff('w', [3, -1, 0])
+    g = ad.gradient_descent(w*x, y_act, beta=0.005, max_iter=100)
+    w = ad.autodiff('w', [0, 0, 0])
+    res = adparallel.multistart(w*x, y_act, [[1, 1, 1], [3, -1, 0]], beta=0.005, max_iter=100, vectorize=True)
+    assert np.allclose(res['loss_arrays'][1], g['loss_array'])
+    assert np.allclose(res['w_array'][1], g['w'].val)
+
+def test_multistart_err_types():
+    x = np.ones((2, 2))
+    w = ad.autodiff('w', [1.0, 1.0])
+    with pytest.raises(ValueError):
+        adparallel.multistart(w*x, [1, 1], [[0, 0]], loss='L1')
+    t = ad.autodiff('t', [1.0, 1.0])
+    with pytest.raises(ValueError):
+        adparallel.multistart(t*x, [1, 1], [[0, 0]])
+
+## Test parallel_jacobian() matches jacobian() for a function of many variables
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_parallel_jacobian(num_workers):
+    xs = [ad.autodiff('x%02d' % i, [0.1*i, 0.2, 0.3]) for i in range(40)]
+    f = xs[0]
+    for a, b in zip(xs[:-1], xs[1:]):
+        f = f + admath.sin(a)*b*admath.exp(b)/3 + a**2
+    order = [x.name for x in reversed(xs)]
+    res = adparallel.parallel_jacobian(f, order=order, num_workers=num_workers, block_size=7)
+    assert res['order'] == order
+    assert res['jacobian'].shape == (40, 3)
+    assert np.allclose(res['jacobian'], f.jacobian(order=order)['jacobian'])
+    assert adparallel.parallel_jacobian(f, num_workers=num_workers)['order'] == sorted(order)
+
+## Test parallel_jacobian() honours derivative seeds and matrix-vector products
+def test_parallel_jacobian_seeds():
+    x = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]) #Data
+    w = ad.autodiff('w', [1.0, 2.0], der=[1.0, 0.0])
+    t = ad.autodiff('t', [0.5, 0.5, 0.5], der=[2.0, 2.0, 2.0])
+    res = adparallel.parallel_jacobian(admath.sin(w*x), num_workers=2)
+    assert np.allclose(res['jacobian'][0], np.cos(np.dot(x, w.val))*x[:, 0])
+    res = adparallel.parallel_jacobian(admath.sin(t)*t, num_workers=2)
+    assert np.allclose(res['jacobian'][0], 2*(np.cos(0.5)*0.5 + np.sin(0.5)))
+
+def test_parallel_jacobian_err_types():
+    x = ad.autodiff('x', 3)
+    with pytest.raises(KeyError):
+        adparallel.parallel_jacobian(x*2, order=['y'])
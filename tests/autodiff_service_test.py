@@ -0,0 +1,108 @@
+import pytest
+import sys
+import asyncio
+import numpy as np
+
+sys.path.append('..')
+from autodiffpy import autodiffmod as ad
+from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_service as adservice
+
+
+
+## Model used by the service tests, built at the given points
+def model(x, y, c=2.0):
+    x = ad.autodiff('x', x)
+    y = ad.autodiff('y', y)
+    c = ad.autodiff('c', c)
+    return admath.exp(x/4)*y + x**2*c - admath.tanh(y)
+
+
+## Test concurrent requests are batched together and match evaluating each one on its own
+def test_service_batches_requests():
+    rng = np.random.RandomState(0)
+    points = [{'x': rng.rand(k), 'y': rng.rand(k)} for k in range(1, 21)]
+
+    async def clients():
+        async with adservice.gradient_service(model(0.0, 0.0), inputs=['x', 'y'], window=0.05) as service:
+            results = await asyncio.gather(*[service.evaluate(point) for point in points])
+            return results, service.num_batches
+
+    results, num_batches = asyncio.run(clients())
+    assert num_batches < len(points)
+    for point, result in zip(points, results):
+        f = model(point['x'], point['y'])
+        assert np.allclose(result['val'], f.val)
+        assert np.allclose(result['der']['x'], f.der['x'])
+        assert np.allclose(result['der']['y'], f.der['y'])
+
+## Test max_batch splits a burst of requests into several batches, and grad=False skips derivatives
+def test_service_max_batch():
+    async def clients():
+        async with adservice.gradient_service(model(0.0, 0.0), inputs=['x', 'y'], window=0.05, max_batch=10) as service:
+            results = await asyncio.gather(*[service.evaluate({'x': np.ones(5), 'y': np.ones(5)}, grad=False) for i in range(8)])
+            return results, service.num_batches
+
+    results, num_batches = asyncio.run(clients())
+    assert num_batches == 4
+    assert all('der' not in result for result in results)
+    assert np.allclose(results[-1]['val'], model(np.ones(5), np.ones(5)).val)
+
+## Test the service over a local socket
+def test_service_socket():
+    async def clients():
+        service = adservice.gradient_service(model(0.0, 0.0), inputs=['x', 'y'])
+        server = await service.serve()
+        port = server.sockets[0].getsockname()[1]
+        clients = [await adservice.connect('127.0.0.1', port) for i in range(3)]
+        results = await asyncio.gather(*[client.evaluate({'x': [0.5*i, 1.0], 'y': [1.0, 2.0]}) for i, client in enumerate(clients)])
+        with pytest.raises(ValueError):
+            await clients[0].evaluate({'x': [1.0]})
+        for client in clients:
+            await client.close()
+        server.close()
+        await server.wait_closed()
+        await service.close()
+        return results
+
+    results = asyncio.run(clients())
+    for i, result in enumerate(results):
+        f = model([0.5*i, 1.0], [1.0, 2.0])
+        assert np.allclose(result['val'], f.val)
+        assert np.allclose(result['der']['x'], f.der['x'])
+
+def test_service_err_types():
+    async def clients():
+        async with adservice.gradient_service(model(0.0, 0.0), inputs=['x', 'y']) as service:
+            with pytest.raises(KeyError):
+                await service.evaluate({'x': [1.0]})
+            with pytest.raises(ValueError):
+                await service.evaluate({'x': [1.0, 2.0], 'y': [1.0]})
+
+    asyncio.run(clients())
+    with pytest.raises(KeyError):
+        adservice.gradient_service(model(0.0, 0.0), inputs=['z'])
+
+## Test closing the service while a batch is computed cancels the requests of that batch
+def test_service_close_during_batch():
+    import threading
+    started = threading.Event()
+    release = threading.Event()
+
+    async def clients():
+        service = adservice.gradient_service(model(0.0, 0.0), inputs=['x', 'y'], window=0.0)
+        compute = service._compute
+        def slow(batch):
+            started.set()
+            release.wait(5)
+            return compute(batch)
+        service._compute = slow
+        request = asyncio.ensure_future(service.evaluate({'x': [1.0], 'y': [2.0]}))
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        await service.close()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(request, 1)
+
+    asyncio.run(clients())
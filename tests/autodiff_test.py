@@ -7,6 +7,7 @@ sys.path.append('..')
 import numpy as np
 from autodiffpy import autodiffmod as ad
 from autodiffpy import autodiff_math as admath
+from autodiffpy import autodiff_graph as adgraph
 
 
 
@@ -330,22 +331,42 @@ def test_forwardprop2():
     assert f7 == f8
     assert f9 == f10
 
+## Test incremental forwardprop() only recomputes nodes downstream of leaves given a new val
+def test_forwardprop_incremental():
+    x = np.array([[1.0, -2.0], [3.0, 0.5], [0.2, 4.0]]) #Data
+    w = ad.autodiff('w', [0.3, -0.1]) #Weights
+    t = ad.autodiff('t', [0.5, 1.0, 1.5], der=None) #Data leaf
+    data = admath.exp(admath.sin(t)*2)/3
+    f = admath.tanh(w*x)*2 + data
+    assert f.forwardprop(incremental=True) is f
+    w.val = np.array([0.5, 0.2])
+    f2 = f.forwardprop(incremental=True)
+    assert f2 is not f
+    assert f2.rparent is data #Constant-data subtree reused
+    assert np.allclose(f2.val, f.forwardprop().val)
+    assert np.allclose(f2.val, np.tanh(np.dot(x, w.val))*2 + np.exp(np.sin(t.val)*2)/3)
+    t.val = np.array([0.0, 0.0, 0.0])
+    f3 = f2.forwardprop(incremental=True)
+    assert f3.rparent is not data
+    assert np.allclose(f3.val, np.tanh(np.dot(x, w.val))*2 + 1/3)
+
 ## Test backprop() output with hyperbolic functions
 def test_backprop_hyperbolic():
     x = ad.autodiff('x', 1)
     y = ad.autodiff('y', 2)
     z = ad.autodiff('z', 3)
     f1 = admath.sinh(x)*admath.cosh(y)*admath.tanh(z)
-    print(f1.backprop(y_true=2))
-    assert pytest.approx(f1.backprop(y_true=2)[0]['x'][0]) == f1.back_der*np.tanh(z.val)*np.cosh(y.val)*np.cosh(x.val)
-    assert pytest.approx(f1.backprop(y_true=2)[0]['y'][0]) == f1.back_der*np.tanh(z.val)*np.sinh(x.val)*np.sinh(y.val)
+    print(f1.backprop(y_true=2, retain_graph=True))
+    d_loss = 2*(f1.val - 2) #Derivative of the MSE loss
+    assert pytest.approx(f1.backprop(y_true=2, retain_graph=True)[0]['x'][0]) == d_loss*np.tanh(z.val)*np.cosh(y.val)*np.cosh(x.val)
+    assert pytest.approx(f1.backprop(y_true=2)[0]['y'][0]) == d_loss*np.tanh(z.val)*np.sinh(x.val)*np.sinh(y.val)
 
 
 def test_backprop_sincostanlog():
     x = ad.autodiff('x', 3)
     f = admath.sin(admath.cos(admath.tan(admath.log(x))))
     # f.backprop() = {'x': array([-1.38686635])}
-    assert pytest.approx(f.backprop(y_true=[2])[0]['x'][0]) == -1.386866349701885*f.back_der
+    assert pytest.approx(f.backprop(y_true=[2])[0]['x'][0]) == -1.386866349701885*2*(f.val - 2)
 
 
 def test_backprop_ytrue_input():
@@ -353,6 +374,188 @@ def test_backprop_ytrue_input():
     y_true = (2,2)
     assert w.backprop(y_true)[1] == 0.5
 
+## Test no_grad computes the same values as the recording operations, and records nothing
+def test_no_grad_values():
+    def fun():
+        x = ad.autodiff('x', [0.3, 0.5])
+        y = ad.autodiff('y', [1.2, 2.0])
+        f = admath.logistic(x*y, A=2, k=3, x0=0.1)/y + admath.log(y, base=2)**x - 2/x + 3**x - x*x
+        f = f + admath.sqrt(y) + admath.sin(x) + admath.cos(x) + admath.tan(x) + admath.exp(-x) - 1 + [1, 2]
+        f = f + admath.arcsin(x) + admath.arccos(x) + admath.arctan(x) + admath.sinh(y)*admath.cosh(y)*admath.tanh(y)
+        return admath.sin(ad.autodiff('w', [1.0, -1.0])*np.array([[1, 2], [3, 4], [5, 6]])), f
+    g, f = fun()
+    assert ad.grad_enabled()
+    with ad.no_grad():
+        assert ad.grad_enabled() == False
+        g2, f2 = fun()
+    assert ad.grad_enabled()
+    assert np.allclose(f2.val, f.val)
+    assert np.allclose(g2.val, g.val)
+    assert f2.der == {} and f2.lparent is None and f2.rparent is None and f2.lpartial is None
+    assert f2.no_grad and g2.no_grad and not f.no_grad
+    with pytest.raises(ValueError):
+        f2.backprop([1, 1])
+    delta, loss_value = ad.autodiff('c', [1.0, 2.0], None).backprop([1, 1])
+    assert np.allclose(delta['c'], [0, 1]) and loss_value == 0.5
+
+## Test no_grad only applies to the thread that entered it
+def test_no_grad_threads():
+    import threading
+    x = ad.autodiff('x', 2.0)
+    results = []
+    with ad.no_grad():
+        thread = threading.Thread(target=lambda: results.append(x*x))
+        thread.start()
+        thread.join()
+        assert (x*x).der == {}
+    assert np.allclose(results[0].der['x'], 4.0)
+    previous = ad.set_grad_enabled(False)
+    assert previous and (x + 1).der == {}
+    ad.set_grad_enabled(previous)
+
+## Test wrt only propagates the requested derivatives, and leaves values and backprop() unchanged
+def test_wrt_pruning():
+    def fun(c_der=1):
+        x = ad.autodiff('x', [0.3, 0.5])
+        y = ad.autodiff('y', [1.2, 2.0])
+        c = ad.autodiff('c', [2.0, 3.0], der=c_der)
+        f = admath.logistic(x*c, A=2)/y + admath.log(y, base=2)**x - 2/x + 3**x - c*c
+        return f + admath.sqrt(y) - admath.sin(x) + admath.exp(-c) - 1 + [1, 2] + admath.tanh(y)/4
+    f = fun()
+    with ad.wrt(['x', 'y']):
+        with ad.wrt('x'):
+            f_x = fun()
+        f_xy = fun()
+    f_const = fun(c_der=None)
+    assert np.allclose(f_x.val, f.val)
+    assert list(f_x.der) == ['x']
+    assert sorted(f_xy.der) == ['x', 'y']
+    assert sorted(f_const.der) == ['x', 'y']
+    for g in [f_x, f_xy, f_const]:
+        for key in g.der:
+            assert np.allclose(g.der[key], f.der[key])
+        delta, loss_value = g.backprop([1, 1])
+        delta_full, loss_full = f.backprop([1, 1], retain_graph=True)
+        assert loss_value == loss_full
+        assert np.allclose(delta['y'], delta_full['y'])
+    assert sorted(fun().der) == ['c', 'x', 'y']
+
+## Test lazy expressions record the graph only, and give the same values and derivatives as eager ones when used
+def test_lazy_matches_eager():
+    def fun():
+        x = ad.autodiff('x', [0.3, 0.5])
+        y = ad.autodiff('y', [1.2, 2.0], der=[1, 2])
+        f = admath.logistic(x*y, A=2, k=3, x0=0.1)/2 + admath.log(y, base=2)**x - 2/x + 3**x - x*x
+        f = f + admath.sqrt(y) + admath.sin(x) + admath.cos(x) + admath.tan(x) + admath.exp(-x) - 1 + [1, 2]
+        return f + admath.arcsin(x) + admath.arccos(x) + admath.arctan(x) + admath.sinh(y)*admath.cosh(y)*admath.tanh(y)
+    f = fun()
+    with ad.lazy():
+        f_lazy = fun()
+        assert ad.lazy_enabled()
+    assert ad.lazy_enabled() == False
+    assert isinstance(f_lazy, ad.deferred)
+    assert f_lazy._val is None and f_lazy.shape == (2,)
+    res = f_lazy.jacobian(order=['y'])
+    assert f_lazy._der is None
+    assert np.allclose(res['jacobian'], f.jacobian(order=['y'])['jacobian'])
+    assert np.allclose(f_lazy.val, f.val)
+    assert sorted(f_lazy.der) == ['x', 'y']
+    assert np.allclose(f_lazy.der['x'], f.der['x'])
+    delta, loss_value = f_lazy.backprop([1, 1])
+    delta_eager, loss_eager = f.backprop([1, 1])
+    assert loss_value == loss_eager
+    assert np.allclose(delta['x'], delta_eager['x'])
+    g = admath.exp(f_lazy)*2 #Eager operation on a deferred instance
+    assert np.allclose(g.der['y'], (admath.exp(f)*2).der['y'])
+
+## Test eager operations on deferred instances can be backpropagated
+def test_lazy_then_eager_backprop():
+    x = ad.autodiff('x', [0.3, 0.5])
+    y = ad.autodiff('y', [1.2, 2.0])
+    with ad.lazy():
+        f = admath.sin(x)*x + y
+    g = admath.exp(f*2 + 1)*x
+    delta, loss_value = g.backprop([1, 1])
+    h = admath.exp((admath.sin(x)*x + y)*2 + 1)*x
+    delta_eager, loss_eager = h.backprop([1, 1])
+    assert loss_value == pytest.approx(loss_eager)
+    assert np.allclose(delta['x'], delta_eager['x']) and np.allclose(delta['y'], delta_eager['y'])
+    assert isinstance(f, ad.deferred) and np.allclose(f.val, np.sin(x.val)*x.val + y.val)
+
+## Test lazy expressions check the domain of sqrt, log, arcsin and arccos when they are evaluated
+def test_lazy_domain_err():
+    x = ad.autodiff('x', [0.3, 0.5])
+    with ad.lazy():
+        f_sqrt = admath.sqrt(x - 1)
+        f_log = admath.log(x*0)
+        f_arcsin = admath.arcsin(x + 2)
+        f_arccos = admath.arccos(x - 2) + x
+    for f in [f_sqrt, f_log, f_arcsin, f_arccos]:
+        with pytest.raises(ValueError):
+            f.val
+        with pytest.raises(ValueError):
+            f.der
+        with pytest.raises(ValueError):
+            f.jacobian(order=['x'])
+        with pytest.raises(ValueError):
+            f.backprop([1, 1])
+    with ad.lazy():
+        assert np.allclose(admath.sqrt(x + 1).val, np.sqrt([1.3, 1.5]))
+
+## Test lazy matrix-vector models, reverse-mode derivatives and wrt
+def test_lazy_dot_and_modes():
+    x = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]) #Data
+    w = ad.autodiff('w', [0.5, -1.0])
+    with ad.lazy():
+        f = admath.logistic(w*x, A=2)
+    assert f.shape == (3,)
+    assert np.allclose(f.val, admath.logistic(w*x, A=2).val)
+    assert np.allclose(f.forwardprop().val, f.val)
+    names = ['x%d' % i for i in range(5)]
+    leaves = [ad.autodiff(name, 0.1*i) for i, name in enumerate(names)]
+    with ad.lazy():
+        with ad.wrt(names[:3]):
+            s = leaves[0]
+            for leaf in leaves[1:]:
+                s = s*admath.sin(leaf) + leaf
+    s_eager = leaves[0]
+    for leaf in leaves[1:]:
+        s_eager = s_eager*admath.sin(leaf) + leaf
+    assert sorted(s.der) == names[:3] #One output element: reverse mode
+    for name in names[:3]:
+        assert np.allclose(s.der[name], s_eager.der[name])
+    with pytest.raises(KeyError):
+        s.jacobian(order=['x4'])
+
+## Test backprop() is unaffected by later expressions that reuse its nodes
+def test_backprop_shared_parent():
+    x = ad.autodiff('x', [1.0, 2.0])
+    y = ad.autodiff('y', [3.0, 4.0])
+    f = x*y
+    delta, loss_value = f.backprop([1, 1], retain_graph=True)
+    g = admath.sin(x) + y/2
+    delta2, loss_value2 = f.backprop([1, 1])
+    assert np.allclose(delta2['x'], delta['x'])
+    assert np.allclose(delta2['y'], delta['y'])
+
+## Test backprop() and forwardprop() can run on one expression from several threads at once
+def test_backprop_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    rng = np.random.RandomState(0)
+    x = rng.rand(50, 3) #Data
+    w = ad.autodiff('w', [0.2, -0.4, 0.3]) #Weights
+    f = admath.logistic(w*x) - 1
+    targets = [rng.rand(50) for i in range(16)]
+    serial = [f.backprop(y_act, retain_graph=True) for y_act in targets]
+    with ThreadPoolExecutor(4) as pool:
+        threaded = list(pool.map(lambda y_act: f.backprop(y_act, retain_graph=True), targets))
+        rebuilt = list(pool.map(lambda i: f.forwardprop(), range(8)))
+    for (delta, loss_serial), (delta2, loss_value) in zip(serial, threaded):
+        assert loss_value == loss_serial
+        assert np.allclose(delta2['w'], delta['w'])
+    for f2 in rebuilt:
+        assert f2 == f
+
 ## Test gradient_descent() with MSE loss
 def test_gradient_descent_MSE():
    x = np.array([[1,-2,1],[3,0,4]]) #Data
@@ -442,3 +645,216 @@ def test_gradient_descent_MSE2():
     g = ad.gradient_descent(f1, Y_true, loss='MSE', beta=0.001, max_iter=5000, tol=0.05)
 
     assert g['loss_array'][-1] <= 0.05
+
+
+## Test lbfgs() on a linear least-squares problem
+def test_lbfgs_MSE():
+    x = np.array([[1,-2,1],[3,0,4],[2,1,-1],[0,5,2]]) #Data
+    w = ad.autodiff('w', [3, -1, 0]) #Weights
+    y_act = np.dot(x, [0.5, 2, -1])
+
+    g = ad.lbfgs(w*x, y_act, loss="MSE", tol=1E-12)
+
+    assert g['loss_array'][-1] <= 1E-12
+    assert g['num_iter'] == len(g['loss_array'])
+    assert np.allclose(g['w'].val, [0.5, 2, -1])
+    assert np.allclose(g['f'].val, y_act)
+
+## Test lbfgs() converges faster than gradient_descent() on a nonlinear model
+def test_lbfgs_nonlinear():
+    x = np.array([[5,-2],[3,-4]]) #Data
+    y_act = [1.0, 1.05]
+
+    w = ad.autodiff('w', [3, 0.5])
+    g = ad.lbfgs(1 + admath.exp(-1*w*x), y_act, loss="MSE", tol=1E-8)
+    assert g['loss_array'][-1] <= 1E-8
+
+    w = ad.autodiff('w', [3, 0.5])
+    g_gd = ad.gradient_descent(1 + admath.exp(-1*w*x), y_act, loss="MSE", beta=0.1, tol=1E-8)
+    assert g['num_iter'] < g_gd['num_iter']
+
+## Test lbfgs() with a one-pair history stops on the iteration limit
+def test_lbfgs_max_iter():
+    x = np.array([[2,0],[5,1]]) #Data
+    w = ad.autodiff('w', [0.6,0.4]) #Weights
+    g = ad.lbfgs(3 + w*x/2.0, [3,4], loss="RMSE", m=1, max_iter=3, tol=0)
+    assert g['num_iter'] <= 3
+    assert g['loss_array'][-1] < g['loss_array'][0]
+
+def test_lbfgs_weightname():
+    x = np.array([[2,0],[5,1]]) #Data
+    w = ad.autodiff('t', [0.6,0.4]) #Weights
+    with pytest.raises(ValueError):
+        ad.lbfgs(3 + w*x/2.0, [3,4])
+
+
+## Test newton() on a single system
+def test_newton_single():
+    F = lambda x, y: [x*y - 6, x + y - 5]
+    sol = ad.newton(F, {'x': 1, 'y': 4})
+    assert sol['converged'][0]
+    assert pytest.approx(sol['x']['x'][0]) == 2
+    assert pytest.approx(sol['x']['y'][0]) == 3
+
+## Test newton() on many independent systems batched along the value axis
+def test_newton_batched():
+    c = np.linspace(1, 10, 1000)
+    F = lambda x, y: [admath.exp(x) - y*c, y - 2]
+    sol = ad.newton(F, {'x': np.ones(1000), 'y': 1.0})
+    assert all(sol['converged'])
+    assert np.allclose(sol['x']['x'], np.log(2*c))
+    assert np.allclose(sol['x']['y'], 2)
+
+## Test newton() with one equation, singular Jacobians, and the iteration limit
+def test_newton_scalar_and_limits():
+    sol = ad.newton(lambda x: x**3 - 8, {'x': [3.0, 0.0]}, max_iter=100)
+    assert sol['converged'][0]
+    assert pytest.approx(sol['x']['x'][0]) == 2
+
+    sol = ad.newton(lambda x: x**2 + 1, {'x': 0.5}, max_iter=5)
+    assert sol['num_iter'] == 5
+    assert not sol['converged'][0]
+
+def test_newton_err_types():
+    with pytest.raises(ValueError):
+        ad.newton(lambda x, y: x + y, {'x': 1, 'y': 2})
+    with pytest.raises(ValueError):
+        ad.newton(lambda x: 3, {'x': 1})
+
+
+## Test gradient_descent() in mini-batch mode
+def test_gradient_descent_minibatch():
+    rng = np.random.RandomState(3)
+    x = rng.rand(500, 3) #Data
+    y_act = np.dot(x, [1.0, -2.0, 0.5])
+    w = ad.autodiff('w', [0, 0, 0]) #Weights
+
+    g = ad.gradient_descent(w*x, y_act, loss="MSE", beta=0.1, max_iter=4000, tol=0, batch_size=20, seed=0)
+    assert g['num_iter'] == 4000
+    assert np.allclose(g['w'].val, [1.0, -2.0, 0.5], atol=1E-2)
+    assert g['f'].val.shape == (500,)
+    assert np.mean((g['f'].val - y_act)**2) <= 1E-4
+
+## Test mini-batches are reproducible and rebind data leaves (der=None) as well as constants
+def test_gradient_descent_minibatch_leaves():
+    x_data = np.linspace(0, 1, 100)
+    x = ad.autodiff('x', x_data, None)
+    y_act = 2*np.sin(x_data) + 1
+    runs = []
+    for i in range(2):
+        w = ad.autodiff('w', [1.0, 1.0])
+        f = w*np.column_stack([np.sin(x_data), np.ones(100)]) + 0*x
+        runs.append(ad.gradient_descent(f, y_act, beta=0.5, max_iter=300, tol=0, batch_size=7, seed=1))
+    assert runs[0]['loss_array'] == runs[1]['loss_array']
+    assert runs[0]['loss_array'][-1] < runs[0]['loss_array'][0]
+
+## Test leaves are not taken for data in mini-batches, even when they have one entry per sample
+def test_gradient_descent_minibatch_weights():
+    X = np.random.RandomState(0).rand(4, 4)
+    y_act = X.dot([1.0, 2.0, 3.0, 4.0])
+    w = ad.autodiff('w', np.zeros(4))
+    b = ad.autodiff('b', np.zeros(4))
+    f = w*X + b*X
+    g = adgraph.trace(f)
+    assert all(g.values[idx] is X for idx in g.sample_inputs(4))
+    result = ad.gradient_descent(f, y_act, beta=0.1, max_iter=200, tol=0, batch_size=2, seed=0)
+    assert result['loss_array'][-1] < result['loss_array'][0]
+
+def test_gradient_descent_minibatch_nodata():
+    w = ad.autodiff('w', [1.0, 1.0])
+    with pytest.raises(ValueError):
+        ad.gradient_descent(w*2 + 1, [1, 2, 3], batch_size=2)
+
+## Test mini-batches reject weights with one entry per sample
+def test_gradient_descent_minibatch_sample_weights():
+    x_data = np.linspace(1,5,5)
+    w = ad.autodiff('w', [1, 1, 1, 1, 1])
+    with pytest.raises(ValueError, match="one entry per sample"):
+        ad.gradient_descent(w*x_data, 3*x_data, batch_size=2)
+
+## Test backprop() through right division matches the traced graph and the forward derivatives
+def test_backprop_rtruediv():
+    w = ad.autodiff('w', [2.0, 4.0])
+    f = 3/w
+    delta, loss_value = f.backprop([0, 0], retain_graph=True)
+    grads, loss_graph = adgraph.trace(f).backprop([0, 0])
+    assert loss_graph == pytest.approx(loss_value)
+    assert np.allclose(delta['w'], grads['w'])
+    assert np.allclose(delta['w'], f.val*f.der['w'])
+    assert np.allclose(delta['w'], [-1.125, -0.140625])
+
+## Test backprop() adds up the adjoints of a leaf used more than once
+def test_backprop_repeated_leaf():
+    x = ad.autodiff('x', [0.3, 0.5])
+    y = ad.autodiff('y', [1.2, 2.0])
+    f = x*x + admath.sin(x)*y + x
+    delta, loss_value = f.backprop([1, 1], retain_graph=True)
+    grads, loss_graph = adgraph.trace(f).backprop([1, 1])
+    assert loss_graph == pytest.approx(loss_value)
+    assert np.allclose(delta['x'], grads['x']) and np.allclose(delta['y'], grads['y'])
+    r = f.val - 1
+    assert np.allclose(delta['x'], r*(2*x.val + np.cos(x.val)*y.val + 1))
+
+## Test backprop() releases the graph unless retain_graph=True, so training loops do not accumulate graphs
+def test_backprop_release_graph():
+    import gc, weakref
+    x = ad.autodiff('x', [0.3, 0.5])
+    y = ad.autodiff('y', [1.2, 2.0])
+    s = admath.sin(x*y)
+    f = s*2 + x
+    retained = f.backprop([1, 1], retain_graph=True)
+    ref = weakref.ref(f.lparent.lparent.lparent) #x*y
+    delta, loss_value = f.backprop([1, 1])
+    assert loss_value == retained[1]
+    assert np.allclose(delta['x'], retained[0]['x'])
+    assert np.allclose(delta['y'], retained[0]['y'])
+    assert f.lparent is None and s.lparent is None
+    assert np.allclose(s.val, np.sin([0.36, 1.0])) and np.allclose(s.der['x'], np.cos([0.36, 1.0])*[1.2, 2.0])
+    assert x.released == False and f.released and s.released
+    gc.collect()
+    assert ref() is None
+    with pytest.raises(ValueError):
+        f.backprop([1, 1])
+    with pytest.raises(ValueError):
+        f.forwardprop()
+    with pytest.raises(ValueError):
+        adgraph.trace(s)
+
+## Test that backprop raises instead of treating a released node shared with another expression as a leaf
+def test_backprop_release_shared():
+    x = ad.autodiff('x', [0.3, 0.5])
+    y = ad.autodiff('y', [1.2, 2.0])
+    s = admath.sin(x*y)
+    f = s*2
+    g = s + 1
+    delta, loss_value = g.backprop([1, 1], retain_graph=True)
+    f.backprop([1, 1])
+    with pytest.raises(ValueError):
+        g.backprop([1, 1])
+    x = ad.autodiff('x', [0.3, 0.5])
+    y = ad.autodiff('y', [1.2, 2.0])
+    s = admath.sin(x*y)
+    f = s*2
+    g = s + 1
+    f.backprop([1, 1], retain_graph=True)
+    retained, retained_loss = g.backprop([1, 1])
+    assert retained_loss == loss_value
+    assert np.allclose(retained['x'], delta['x']) and np.allclose(retained['y'], delta['y'])
+
+## Test forwardprop raises instead of reusing the stale value of a released node shared with another expression
+def test_forwardprop_release_shared():
+    x = ad.autodiff('x', [0.3, 0.5])
+    f1 = admath.sin(x)*2
+    f2 = f1 + 1
+    f1.backprop([1, 1])
+    x.val = np.array([1.0, 1.2])
+    with pytest.raises(ValueError):
+        f2.forwardprop()
+    with pytest.raises(ValueError):
+        f2.forwardprop(incremental=True)
+    x = ad.autodiff('x', [0.3, 0.5])
+    f1 = admath.sin(x)*2
+    f2 = f1 + 1
+    f1.backprop([1, 1], retain_graph=True)
+    x.val = np.array([1.0, 1.2])
+    assert np.allclose(f2.forwardprop().val, 2*np.sin([1.0, 1.2]) + 1)